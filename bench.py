@@ -0,0 +1,146 @@
+#!/bin/env python
+
+import time
+import logging
+
+import lp5xxx_asm
+
+
+def synthetic_src(lines=5000):
+    """
+    Generate a synthetic source with the same shape of the sources in the src
+    folder: mapping table, labels, segment directives, comments and blank lines.
+    """
+    src = []
+    for n in range(9):
+        src.append(f"m{n}:  dw  {1 << n:016b}b  ; led {n}")
+    src.append("all: dw  0000000111111111b")
+
+    body = [
+        "  map_start m0",
+        "  load_end  m8",
+        "  ramp      1,100      ; increase pwm",
+        "  ramp      1,-100",
+        "  set_pwm   80",
+        "  map_next",
+        "",
+        "  wait      0.07",
+        "  trigger   w{1|2}s{3}",
+        "  add       ra, rd, rc",
+        "  jne       ra, rb, skip{n}",
+        "; comment only line",
+        "  sub       rb, 83",
+        "skip{n}:",
+        "  branch    3,loop{n}",
+    ]
+
+    n = 0
+    while len(src) < lines:
+        if n % 8 == 0:
+            src.append(f".segment program{n}")
+        src.append(f"loop{n}:")
+        for b in body:
+            src.append(b.replace("{n}", str(n)))
+        n += 1
+
+    return src[:lines]
+
+
+def bench(fn, *args, repeat=5):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(*args)
+        t = time.perf_counter() - t
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def bench_parse(lines=5000):
+    src = synthetic_src(lines)
+    t = bench(lp5xxx_asm.parse, src, logging)
+    print(f"parse: {lines} lines in {t * 1000:.1f}ms -> {lines / t:.0f} lines/sec")
+
+
+def sweep_src(n):
+    """
+    Variant n of a breathing effect, as produced by a parameter sweep.
+    """
+    return "\n".join([
+        "all: dw 0000000111111111b",
+        ".segment program1",
+        "  map_addr all",
+        "loop:",
+        f"  ramp {0.2 + (n % 20) / 20:g}, {n % 200 + 20}",
+        f"  wait {0.01 + (n % 7) / 100:g}",
+        f"  ramp {0.2 + (n % 13) / 20:g}, -{n % 200 + 20}",
+        "  branch 0, loop",
+    ])
+
+
+def bench_batch(variants=200, samples=500, dt_ms=10):
+    import lp5xxx_sim
+    import lp5xxx_batch
+
+    results = [lp5xxx_asm.assemble(sweep_src(n)) for n in range(variants)]
+    images = [r.image for r in results]
+    addr = results[0].addr
+    dt = lp5xxx_sim.cycles(dt_ms)
+
+    def scalar():
+        for r in results:
+            sim = lp5xxx_sim.Simulator(r.image, addr)
+            lp5xxx_batch.render(sim.run((samples - 1) * dt), samples, dt)
+
+    def batch():
+        lp5xxx_batch.BatchSimulator(images, addr).render(samples, dt)
+
+    ts = bench(scalar, repeat=1)
+    tb = bench(batch, repeat=1)
+    print(f"simulate: {variants} variants x {samples * dt_ms}ms, scalar {ts * 1000:.0f}ms, "
+          f"batch {tb * 1000:.0f}ms -> {ts / tb:.1f}x")
+
+
+def bench_timing(programs=200):
+    import lp5xxx_sim
+    import lp5xxx_timing
+
+    src = ".segment program1\nmap_sel 1\nouter: ramp 0.3, 60\ninner: set_pwm 0\nwait 0.0{w}\n" \
+          "branch 20, inner\nramp 0.3, -60\nbranch {n}, outer\nend i"
+    results = [lp5xxx_asm.assemble(src.format(n=n % 60 + 1, w=n % 9 + 1)) for n in range(programs)]
+
+    def simulate():
+        for r in results:
+            sim = lp5xxx_sim.Simulator(r.image, r.addr)
+            while sim.next_time() is not None:
+                sim.step()
+
+    def analyze():
+        for r in results:
+            lp5xxx_timing.analyze(r.image, r.addr)
+
+    ts = bench(simulate, repeat=1)
+    ta = bench(analyze)
+    print(f"timing: {programs} programs, simulate {ts * 1000:.0f}ms, "
+          f"analyze {ta * 1000:.1f}ms -> {ts / ta:.0f}x")
+
+
+def bench_roll(repeats=2000):
+    import lp5xxx_opt
+
+    body = "".join(f"set_pwm {n}\nmap_next\nwait 0.01\n" for n in range(0, 250, 50))
+    src = (".segment program1\nmap_sel 1\n" + body * repeats + "end").splitlines()
+
+    def roll():
+        lp5xxx_opt.roll(*lp5xxx_asm.parse(src, logging))
+
+    t = bench(roll, repeat=1)
+    print(f"roll: {len(src)} lines in {t * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    bench_parse()
+    bench_batch()
+    bench_timing()
+    bench_roll()
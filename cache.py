@@ -0,0 +1,144 @@
+#!/bin/env python
+
+import os
+import json
+import logging
+import hashlib
+import functools
+import tempfile
+import importlib.util
+
+
+# Keep the cache directory below this size, dropping the least recently
+# used entries first.
+CACHE_MAX_SIZE = 16 * 1024 * 1024
+# Once over the limit, evict down to this fraction of it, so that a full
+# cache isn't scanned again on every put
+CACHE_LOW_WATER = 0.75
+
+# Modules whose source decides how an instruction is encoded
+ENCODER_MODULES = ("lp5xxx_asm", "callbacks", "instruction_set", "timing_table")
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "lp5xxx_asm")
+
+
+@functools.lru_cache(maxsize=None)
+def encoder_fingerprint(modules=ENCODER_MODULES):
+    """
+    Digest of the source of the tokenizer, the instruction set, the
+    callbacks and the timing tables, so that any change in how an
+    instruction is encoded invalidates the cached images.
+    """
+    h = hashlib.sha256()
+    for name in modules:
+        with open(importlib.util.find_spec(name).origin, 'rb') as f:
+            h.update(name.encode() + b"\0" + f.read() + b"\0")
+    return h.hexdigest()
+
+
+class BuildCache:
+    """
+    On disk cache of assembled images, one json file for each source keyed
+    by the hash of the source text, the assembler source and version.
+
+    The cache is only a speed up: an error reading or writing it is logged
+    as a warning, and the source is assembled as without a cache.
+    """
+
+    def __init__(self, path=None, max_size=CACHE_MAX_SIZE, version="", log=logging):
+        self.path = path or default_cache_dir()
+        self.max_size = max_size
+        self.salt = (version + encoder_fingerprint()).encode()
+        self.log = log
+        # Size of the entries, counted by the last scan of evict() and the
+        # puts after it: the directory is scanned again only when it goes
+        # over the limit
+        self.__size = None
+
+    def key(self, src):
+        h = hashlib.sha256(self.salt)
+        h.update(src.encode())
+        return h.hexdigest()
+
+    def __entry(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def get(self, key):
+        fn = self.__entry(key)
+        try:
+            with open(fn) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # Mark as recently used for the eviction
+        try:
+            os.utime(fn)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        except OSError as e:
+            self.log.warning(f"Build cache not written: {e}")
+            return
+
+        text = json.dumps(data)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(text)
+            os.replace(tmp, self.__entry(key))
+        except OSError as e:
+            self.log.warning(f"Build cache not written: {e}")
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        if self.__size is not None:
+            self.__size += len(text)
+        if self.__size is None or self.__size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.path) as it:
+                for e in it:
+                    if not e.name.endswith(".json"):
+                        continue
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        # Evicted by another process
+                        continue
+                    entries.append((st.st_mtime, st.st_size, e.path))
+                    total += st.st_size
+        except OSError as e:
+            self.log.warning(f"Build cache not evicted: {e}")
+            return
+
+        if total <= self.max_size:
+            self.__size = total
+            return
+
+        for _, size, fn in sorted(entries):
+            if total <= self.max_size * CACHE_LOW_WATER:
+                break
+            try:
+                os.unlink(fn)
+            except OSError:
+                continue
+            total -= size
+        self.__size = total
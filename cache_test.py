@@ -0,0 +1,82 @@
+import unittest
+import lp5xxx_asm
+import logging
+import tempfile
+import shutil
+import os
+import unittest.mock
+
+from cache import BuildCache
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_hit(self):
+        src_name = os.path.join(".", "src", "test2.src")
+        cache = BuildCache(self.path, version=lp5xxx_asm.__version__)
+
+        ref = lp5xxx_asm.asm_file(src_name, logging, cache)
+        self.assertEqual(len(os.listdir(self.path)), 1)
+
+        x = lp5xxx_asm.asm_file(src_name, logging, cache)
+        self.assertEqual(bytes(x['bin']), bytes(ref['bin']))
+        self.assertEqual(x['labels'], ref['labels'])
+        self.assertEqual(x['memory'], ref['memory'])
+        self.assertEqual(lp5xxx_asm.hex_fmt(x['bin'], x['memory']), lp5xxx_asm.hex_fmt(ref['bin'], ref['memory']))
+
+    def test_key(self):
+        cache = BuildCache(self.path, version="1")
+        self.assertEqual(cache.key("end"), BuildCache(self.path, version="1").key("end"))
+        self.assertNotEqual(cache.key("end"), cache.key("rst"))
+        self.assertNotEqual(cache.key("end"), BuildCache(self.path, version="2").key("end"))
+
+    def test_evict_scans(self):
+        # The directory is scanned on the first put, then only when the
+        # entries written go over the limit
+        cache = BuildCache(self.path, max_size=10000)
+        with unittest.mock.patch.object(os, "scandir", wraps=os.scandir) as scandir:
+            for n in range(40):
+                cache.put(cache.key(str(n)), {'bin': "00" * 100})
+            self.assertEqual(scandir.call_count, 1)
+
+            for n in range(40, 100):
+                cache.put(cache.key(str(n)), {'bin': "00" * 100})
+            self.assertGreater(scandir.call_count, 1)
+            self.assertLess(scandir.call_count, 10)
+
+        size = sum(os.path.getsize(os.path.join(self.path, f)) for f in os.listdir(self.path))
+        self.assertLessEqual(size, 10000)
+
+    def test_read_only(self):
+        # A file where the cache directory should be: the cache is never
+        # written, and the source is assembled as without it
+        path = os.path.join(self.path, "file")
+        open(path, "w").close()
+        cache = BuildCache(os.path.join(path, "cache"), version=lp5xxx_asm.__version__)
+
+        src_name = os.path.join(".", "src", "test2.src")
+        with self.assertLogs(level=logging.WARNING):
+            x = lp5xxx_asm.asm_file(src_name, logging, cache)
+        self.assertEqual(bytes(x['bin']), bytes(lp5xxx_asm.asm_file(src_name, logging)['bin']))
+
+    def test_evict(self):
+        cache = BuildCache(self.path, max_size=1000)
+        for n in range(20):
+            cache.put(cache.key(str(n)), {'bin': "00" * 100})
+            os.utime(os.path.join(self.path, cache.key(str(n)) + ".json"), (n, n))
+
+        cache.evict()
+        size = sum(os.path.getsize(os.path.join(self.path, f)) for f in os.listdir(self.path))
+        self.assertLessEqual(size, 1000)
+        self.assertIsNotNone(cache.get(cache.key("19")))
+        self.assertIsNone(cache.get(cache.key("0")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 #!/bin/env python
 import re
+
+from timing_table import PRESCALE_MS, STEP_MS, ramp_encoding, wait_encoding
 VARIABLE = {
     'a': 0,
     'b': 1,
@@ -7,12 +9,10 @@ VARIABLE = {
     'd': 3,
 }
 
-
-def byte_fmt(value):
-    vh = ((value & 0xff00) >> 8)
-    vl = (value & 0x00ff)
-
-    return [vh, vl]
+# Operand patterns, compiled once and shared by the callbacks
+VAR_RE = re.compile(r"r([abcd])")
+PRESCALE_RE = re.compile(r"pre=([0-9])")
+TRIGGER_RE = {t: re.compile(r"%s{([123e\|]+)}" % t) for t in ['w', 's']}
 
 
 def show_msg(flag, ctx, msg):
@@ -35,7 +35,7 @@ def show_msg(flag, ctx, msg):
 
 
 def op_nop(op, table, labels, inst):
-    return []
+    return None
 
 
 def op_dw(op, table, labels, inst):
@@ -60,7 +60,7 @@ def op_dw(op, table, labels, inst):
     if value > MAX or value < MIN:
         raise ValueError(show_msg("Error", inst, f"Invalid valid range is {MIN} to {MAX}"))
 
-    return byte_fmt(value)
+    return value
 
 
 def op_map_addr(op, table, labels, inst):
@@ -92,7 +92,7 @@ def op_map_addr(op, table, labels, inst):
         raise ValueError(show_msg("Error", inst, "Invalid address"))
 
     value = OP | addr
-    return byte_fmt(value)
+    return value
 
 
 def op_ramp(op, table, labels, inst):
@@ -166,11 +166,11 @@ def op_ramp(op, table, labels, inst):
         variable = True
 
     if variable:
-        if len(inst['args']) < 2:
-            raise ValueError(show_msg("Error", inst, "Missing arguments"))
+        a0 = None
+        a1 = None
         for n, a in enumerate(inst['args']):
-            p = re.findall(r"r([abcd])", a.lower())
-            pre = re.findall(r"pre=([0-9])", a.lower())
+            p = VAR_RE.findall(a.lower())
+            pre = PRESCALE_RE.findall(a.lower())
             if n == 0:
                 if p:
                     a0 = p[0]
@@ -188,19 +188,26 @@ def op_ramp(op, table, labels, inst):
                 if "-" in a:
                     sign = 1
 
+        if len(inst['args']) < 3 or a0 is None or a1 is None:
+            raise ValueError(show_msg("Error", inst, "Invalid arguments, should be a time and increments, "
+                                      "or a step time variable, pre=0/1 and an increments variable"))
+
         value = OP_VAR | (prescale << 5) | (sign << 4) | (VARIABLE[a0] << 2) | VARIABLE[a1]
     else:
         if level < 0:
             sign = 1
             level = abs(level)
 
-        step_time = round((float(ramp_time) / float(level)) / float(0.488))
-        if step_time > 31 or step_time < 0:
-            step_time = round((float(ramp_time) / float(level)) / float(15.625))
-            prescale = 1
+        if level < 1 or level > 255:
+            raise ValueError(show_msg("Error", inst, "Invalid increments, valid range is 1 to 255, use wait for 0"))
+
+        if ramp_time / level > STEP_MS[-1] + PRESCALE_MS[1] / 2:
+            raise ValueError(show_msg("Error", inst, f"Ramp too slow, max step time is {STEP_MS[-1]}ms"))
+
+        prescale, step_time, _ = ramp_encoding(ramp_time, level)
         value = OP_PARAM | (prescale << 14) | (step_time << 9) | (sign << 8) | level
 
-    return byte_fmt(value)
+    return value
 
 
 def op_wait(op, table, labels, inst):
@@ -219,9 +226,6 @@ def op_wait(op, table, labels, inst):
     OP = table[op]['op']
     MAX = table[op]['max']
     MIN = table[op]['min']
-    LOW_PRESCALE = 0.488
-    HIGH_PRESCALE = 15.625
-
     try:
         w_time = float(inst['args'][0]) * 1000
     except IndexError:
@@ -230,14 +234,9 @@ def op_wait(op, table, labels, inst):
     if w_time > MAX or w_time < MIN:
         raise ValueError(show_msg("Error", inst, f"Invalid valid range is {MIN}ms to {MAX}ms"))
 
-    prescale = 0
-    value = round(float(w_time) / LOW_PRESCALE)
-    if value > 31:
-        value = round(float(w_time) / HIGH_PRESCALE)
-        prescale = 1
-
+    prescale, value, _ = wait_encoding(w_time)
     value = OP | (prescale << 14) | (value << 9)
-    return byte_fmt(value)
+    return value
 
 
 def op_load_start(op, table, labels, inst):
@@ -263,8 +262,8 @@ def op_load_start(op, table, labels, inst):
     if addr < MIN or addr > MAX:
         raise ValueError(show_msg("Error", inst, "Wrong address for label"))
 
-    value = OP | label
-    return byte_fmt(value)
+    value = OP | addr
+    return value
 
 
 def op_load_end(op, table, labels, inst):
@@ -291,7 +290,7 @@ def op_load_end(op, table, labels, inst):
         raise ValueError(show_msg("Error", inst, "Wrong address for labels"))
 
     value = OP | addr
-    return byte_fmt(value)
+    return value
 
 
 def op_map_start(op, table, labels, inst):
@@ -321,7 +320,7 @@ def op_map_start(op, table, labels, inst):
         raise ValueError(show_msg("Error", inst, "Wrong address for label"))
 
     value = OP | addr
-    return byte_fmt(value)
+    return value
 
 
 def op_map_sel(op, table, labels, inst):
@@ -356,7 +355,7 @@ def op_map_sel(op, table, labels, inst):
         raise ValueError(show_msg("Error", inst, "Wrong address for led"))
 
     value = OP | drv
-    return byte_fmt(value)
+    return value
 
 
 def op_map_clr(op, table, labels, inst):
@@ -367,11 +366,11 @@ def op_map_clr(op, table, labels, inst):
     LED brightness.
     """
     OP = table[op]['op']
-    if len(inst['args'] > 0):
+    if len(inst['args']) > 0:
         raise ValueError(show_msg("Error", inst, "No arguments needs for this command"))
 
     value = OP
-    return byte_fmt(value)
+    return value
 
 
 def op_map_next(op, table, labels, inst):
@@ -393,7 +392,7 @@ def op_map_next(op, table, labels, inst):
         raise ValueError(show_msg("Error", inst, "No arguments needs for this command"))
 
     value = OP
-    return byte_fmt(value)
+    return value
 
 
 def op_map_prev(op, table, labels, inst):
@@ -414,7 +413,7 @@ def op_map_prev(op, table, labels, inst):
         raise ValueError(show_msg("Error", inst, "No arguments needs for this command"))
 
     value = OP
-    return byte_fmt(value)
+    return value
 
 
 def op_load_next(op, table, labels, inst):
@@ -427,11 +426,11 @@ def op_load_next(op, table, labels, inst):
     """
     OP = table[op]['op']
 
-    if len(inst['args'] > 0):
+    if len(inst['args']) > 0:
         raise ValueError(show_msg("Error", inst, "No arguments needs for this command"))
 
     value = OP
-    return byte_fmt(value)
+    return value
 
 
 def op_load_prev(op, table, labels, inst):
@@ -443,11 +442,11 @@ def op_load_prev(op, table, labels, inst):
     """
     OP = table[op]['op']
 
-    if len(inst['args'] > 0):
+    if len(inst['args']) > 0:
         raise ValueError(show_msg("Error", inst, "No arguments needs for this command"))
 
     value = OP
-    return byte_fmt(value)
+    return value
 
 
 def op_load_addr(op, table, labels, inst):
@@ -477,7 +476,7 @@ def op_load_addr(op, table, labels, inst):
         raise ValueError(show_msg("Error", inst, "Invalid address"))
 
     value = OP | addr
-    return byte_fmt(value)
+    return value
 
 
 def op_set_pwm(op, table, labels, inst):
@@ -513,7 +512,7 @@ def op_set_pwm(op, table, labels, inst):
         variable = True
 
     if variable:
-        p = re.findall(r"r([abcd])", inst['args'][0].lower())
+        p = VAR_RE.findall(inst['args'][0].lower())
         if not p:
             raise ValueError(show_msg("Error", inst, "Wrong data type, int needed"))
         level = p[0]
@@ -526,7 +525,7 @@ def op_set_pwm(op, table, labels, inst):
 
         value = OP | level
 
-    return byte_fmt(value)
+    return value
 
 
 def op_end(op, table, labels, inst):
@@ -561,7 +560,7 @@ def op_end(op, table, labels, inst):
             raise ValueError(show_msg("Error", inst, f"Wrong arguments valid are {i, r}"))
 
     value = OP | i << 12 | r << 11
-    return byte_fmt(value)
+    return value
 
 
 def op_reset(op, table, labels, inst):
@@ -580,7 +579,7 @@ def op_reset(op, table, labels, inst):
         raise ValueError(f"No arguments needs for this command {inst}")
 
     value = OP
-    return byte_fmt(value)
+    return value
 
 
 def op_int(op, table, labels, inst):
@@ -598,7 +597,7 @@ def op_int(op, table, labels, inst):
         raise ValueError(f"No arguments needs for this command {inst}")
 
     value = OP
-    return byte_fmt(value)
+    return value
 
 
 def op_branch(op, table, labels, inst):
@@ -647,7 +646,7 @@ def op_branch(op, table, labels, inst):
         raise ValueError(show_msg("Error", inst, f"Invalid valid range is {MIN} to {MAX}"))
 
     value = OP | nloops << 7 | addr
-    return byte_fmt(value)
+    return value
 
 
 def op_trigger(op, table, labels, inst):
@@ -714,7 +713,7 @@ def op_trigger(op, table, labels, inst):
     for t in ['w', 's']:
         for i in inst['args']:
             try:
-                d[t]['raw'].append(re.findall(r"%s{([123e\|]+)}" % t, i)[0])
+                d[t]['raw'].append(TRIGGER_RE[t].findall(i)[0])
             except IndexError:
                 pass
 
@@ -733,7 +732,7 @@ def op_trigger(op, table, labels, inst):
                     d[t]['value'] |= d[t]['bit'][v]
 
     value = OP | d['w']['value'] | d['s']['value']
-    return byte_fmt(value)
+    return value
 
 
 def op_trig_clear(op, table, labels, inst):
@@ -748,7 +747,7 @@ def op_trig_clear(op, table, labels, inst):
     OP = table[op]['op']
 
     value = OP
-    return byte_fmt(value)
+    return value
 
 
 def __jump(table, op, inst, labels):
@@ -762,7 +761,7 @@ def __jump(table, op, inst, labels):
         if a in labels:
             label = labels[a]
 
-        p = re.findall(r"r([abcd])", a.lower())
+        p = VAR_RE.findall(a.lower())
         if not p:
             continue
         p = p[0]
@@ -814,7 +813,7 @@ def op_jne(op, table, labels, inst):
     """
     OP = table[op]['op']
     value = OP | __jump(table, op, inst, labels)
-    return byte_fmt(value)
+    return value
 
 
 def op_jl(op, table, labels, inst):
@@ -824,7 +823,7 @@ def op_jl(op, table, labels, inst):
     OP = table[op]['op']
 
     value = OP | __jump(table, op, inst, labels)
-    return byte_fmt(value)
+    return value
 
 
 def op_jge(op, table, labels, inst):
@@ -834,7 +833,7 @@ def op_jge(op, table, labels, inst):
     OP = table[op]['op']
 
     value = OP | __jump(table, op, inst, labels)
-    return byte_fmt(value)
+    return value
 
 
 def op_je(op, table, labels, inst):
@@ -844,7 +843,7 @@ def op_je(op, table, labels, inst):
     OP = table[op]['op']
 
     value = OP | __jump(table, op, inst, labels)
-    return byte_fmt(value)
+    return value
 
 
 def op_ld(op, table, labels, inst):
@@ -866,7 +865,7 @@ def op_ld(op, table, labels, inst):
         raise ValueError(show_msg("Error", inst, "Missing arguments"))
 
     try:
-        dest = re.findall(r"r([abcd])", inst['args'][0].lower())
+        dest = VAR_RE.findall(inst['args'][0].lower())
         if not dest[0] in VARIABLE:
             raise ValueError(show_msg("Error", inst, f"Wrong data type {dest}"))
         dest = VARIABLE[dest[0]]
@@ -880,7 +879,7 @@ def op_ld(op, table, labels, inst):
                                   [{table[op]['max'][1]}]"))
 
     value = OP | dest << 10 | val
-    return byte_fmt(value)
+    return value
 
 
 def __alu(op, table, inst):
@@ -888,7 +887,7 @@ def __alu(op, table, inst):
         raise ValueError(show_msg("Error", inst, "Missing arguments"))
 
     def __varExtract(a):
-        p = re.findall(r"r([abcd])", a.lower())
+        p = VAR_RE.findall(a.lower())
         if p:
             p = p[0]
             if p not in VARIABLE:
@@ -950,7 +949,7 @@ def op_add(op, table, labels, inst):
     |                    |           | 2 = Global variable C
     |                    |           | 3 = Global variable D
     """
-    return byte_fmt(__alu(op, table, inst))
+    return __alu(op, table, inst)
 
 
 def op_sub(op, table, labels, inst):
@@ -977,4 +976,4 @@ def op_sub(op, table, labels, inst):
     |                    |           | 2 = Global variable C
     |                    |           | 3 = Global variable D
     """
-    return byte_fmt(__alu(op, table, inst))
+    return __alu(op, table, inst)
@@ -0,0 +1,195 @@
+#!/bin/env python
+
+# asyncio front-end of the assembler: the source lines are read on the event
+# loop and handed, in batches, to a worker thread that runs the pipeline of
+# lp5xxx_asm.Assembler, so a large source never blocks the loop.
+
+import queue
+import asyncio
+import functools
+import threading
+import concurrent.futures
+
+from lp5xxx_asm import Assembler, AsmResult, SRAM_SIZE
+
+# Source lines sent to the worker in one go
+BATCH_LINES = 256
+# Batches read ahead of the worker
+MAX_PENDING = 4
+
+
+class Cancelled(Exception):
+    """
+    Raised in the worker thread when the coroutine that started it is
+    cancelled or stops consuming its output.
+    """
+
+
+class AsyncAssembler:
+    """
+    Async variant of the assembler calls. The pipeline runs in a bounded
+    thread pool, max_workers sources at a time, and every call returns the
+    same result as the synchronous one of the wrapped Assembler.
+    """
+
+    def __init__(self, assembler=None, max_workers=2, batch=BATCH_LINES):
+        self.assembler = assembler if assembler is not None else Assembler()
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="lp5xxx_aio")
+        self.batch = batch
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __read(self, src, lines, slots, stop):
+        """
+        Push the source lines in the worker queue, a batch at a time. src can
+        be the source text, an iterable or an async iterable of lines, like
+        an asyncio.StreamReader.
+        """
+        if isinstance(src, str):
+            src = src.splitlines()
+
+        async def batches():
+            chunk = []
+            if hasattr(src, "__aiter__"):
+                async for line in src:
+                    if isinstance(line, bytes):
+                        line = line.decode()
+                    chunk.append(line)
+                    if len(chunk) >= self.batch:
+                        yield chunk
+                        chunk = []
+            else:
+                for line in src:
+                    chunk.append(line)
+                    if len(chunk) >= self.batch:
+                        yield chunk
+                        chunk = []
+            if chunk:
+                yield chunk
+
+        try:
+            async for chunk in batches():
+                await slots.acquire()
+                if stop.is_set():
+                    return
+                lines.put(chunk)
+        finally:
+            lines.put(None)
+
+    def __work(self, stage, lines, loop, slots, out, stop):
+        """
+        Worker thread: run the stage on the lines read by __read() and send
+        its output back to the loop, a batch at a time. The last item sent is
+        None, or the exception that stopped the stage.
+        """
+        def feed():
+            while True:
+                chunk = lines.get()
+                loop.call_soon_threadsafe(slots.release)
+                if stop.is_set():
+                    raise Cancelled()
+                if chunk is None:
+                    return
+                yield from chunk
+
+        chunk = []
+        try:
+            for item in stage(feed()):
+                chunk.append(item)
+                if len(chunk) >= self.batch:
+                    if stop.is_set():
+                        raise Cancelled()
+                    loop.call_soon_threadsafe(out.put_nowait, chunk)
+                    chunk = []
+            loop.call_soon_threadsafe(out.put_nowait, chunk)
+            loop.call_soon_threadsafe(out.put_nowait, None)
+        except Cancelled:
+            pass
+        except Exception as e:
+            loop.call_soon_threadsafe(out.put_nowait, e)
+
+    async def __run(self, stage, src):
+        """
+        Async generator of the batches of items produced by stage() on the
+        source lines.
+        """
+        loop = asyncio.get_running_loop()
+        lines = queue.Queue()
+        slots = asyncio.Semaphore(MAX_PENDING)
+        out = asyncio.Queue()
+        stop = threading.Event()
+
+        reader = asyncio.ensure_future(self.__read(src, lines, slots, stop))
+        # An error of the source is raised by the await below, unless the
+        # worker failed first
+        reader.add_done_callback(lambda t: t.cancelled() or t.exception())
+        worker = loop.run_in_executor(self.executor, self.__work, stage, lines, loop, slots, out, stop)
+        try:
+            while True:
+                chunk = await out.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+            await reader
+            await worker
+        finally:
+            if not worker.done():
+                # Wake up the worker, if it is waiting for source lines
+                stop.set()
+                lines.put(None)
+            reader.cancel()
+
+    async def pipeline(self, src, labels):
+        """
+        Yield each instruction with its encoded word, as Assembler.pipeline()
+        does, while the source is still being read.
+        """
+        stage = functools.partial(self.assembler.pipeline, labels=labels)
+        chunks = self.__run(stage, src)
+        try:
+            async for chunk in chunks:
+                for item in chunk:
+                    yield item
+        finally:
+            # Stop the worker as soon as the caller stops reading
+            await chunks.aclose()
+
+    async def parse(self, src):
+        labels = {}
+        memory = []
+        stage = functools.partial(self.assembler.tokenize, labels=labels)
+        async for chunk in self.__run(stage, src):
+            memory.extend(chunk)
+        return memory, labels
+
+    async def asm(self, labels, memory):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.assembler.asm, labels, memory)
+
+    async def asm_stream(self, src):
+        labels = {}
+        image = bytearray(SRAM_SIZE)
+        ln = 0
+        memory = []
+        async for m, word in self.pipeline(src, labels):
+            if m['op'] == 'segment':
+                memory.append(m)
+
+            if word is not None:
+                ln = max(ln, self.assembler.put_word(image, m, word))
+
+        return self.assembler.image_view(image, ln), memory, labels
+
+    async def assemble(self, src, name="stdin"):
+        asm_bin, memory, labels = await self.asm_stream(src)
+        return AsmResult(name, asm_bin, memory, labels)
@@ -0,0 +1,81 @@
+import unittest
+import lp5xxx_asm
+import lp5xxx_aio
+import asyncio
+import logging
+import os
+
+
+async def lines_of(text):
+    for line in text.splitlines():
+        await asyncio.sleep(0)
+        yield line
+
+
+class TestAsync(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.aio = lp5xxx_aio.AsyncAssembler(max_workers=1, batch=4)
+
+    def tearDown(self):
+        self.aio.close()
+
+    def __src(self, name):
+        with open(os.path.join(".", "src", name)) as f:
+            return f.read()
+
+    async def test_assemble(self):
+        for name in ["labels.src", "test1.src", "test2.src", "alu.src", "jump.src"]:
+            text = self.__src(name)
+            ref = lp5xxx_asm.assemble(text, name)
+            for src in [text, text.splitlines(), lines_of(text)]:
+                r = await self.aio.assemble(src, name)
+                self.assertEqual(bytes(r.image), bytes(ref.image))
+                self.assertEqual(r.segments, ref.segments)
+                self.assertEqual(r.labels, ref.labels)
+                self.assertEqual(r.hex(), ref.hex())
+
+    async def test_parse(self):
+        text = self.__src("test2.src")
+        memory, labels = lp5xxx_asm.parse(text.splitlines(), logging)
+
+        x_memory, x_labels = await self.aio.parse(lines_of(text))
+        self.assertEqual(x_memory, memory)
+        self.assertEqual(x_labels, labels)
+
+        asm_bin = await self.aio.asm(x_labels, x_memory)
+        self.assertEqual(bytes(asm_bin), bytes(lp5xxx_asm.asm(labels, memory, logging)))
+
+    async def test_pipeline(self):
+        text = self.__src("jump.src")
+        ref = list(lp5xxx_asm.pipeline(text.splitlines(), {}, logging))
+        res = [x async for x in self.aio.pipeline(lines_of(text), {})]
+        self.assertEqual(res, ref)
+
+    async def test_error(self):
+        with self.assertRaises(ValueError):
+            await self.aio.assemble(lines_of("set_pwm 10\nset_pwm 300\nend"))
+
+        # The worker is free again
+        r = await self.aio.assemble("set_pwm 10\nend")
+        self.assertEqual(bytes(r.image[:4]), b"\x40\x0a\xc0\x00")
+
+    async def test_cancel(self):
+        async def endless():
+            while True:
+                yield "; still typing"
+                await asyncio.sleep(0)
+
+        task = asyncio.ensure_future(self.aio.assemble(endless()))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        # With one worker, this waits for the cancelled one to stop
+        r = await asyncio.wait_for(self.aio.assemble("set_pwm 10\nend"), 5)
+        self.assertEqual(bytes(r.image[:4]), b"\x40\x0a\xc0\x00")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,157 +1,600 @@
 #!/bin/env python
 
+import os
 import re
+import sys
+import contextlib
+import concurrent.futures
+import functools
+import hashlib
+import struct
+import tempfile
+import traceback
 import logging
 
 from instruction_set import lookup_table
 from callbacks import show_msg
+from timing_table import PRESCALE_MS
+from cache import BuildCache
+
+__version__ = "0.3.0"
+
+
+# LP5569 program memory: 256 words of 16 bit
+SRAM_SIZE = 512
+WORD = struct.Struct(">H")
+
+# One scan per line: label definitions, then a segment directive or a
+# mnemonic, then the operand list up to the comment.
+LINE_RE = re.compile(r"""
+    (?P<labels>(?:\w+:\s*)*)
+    (?:\.(?P<segment>\w+)|(?P<op>\w+))?
+    \s*(?P<args>[^;]*)
+""", re.VERBOSE)
+LABEL_RE = re.compile(r"(\w+):")
+ARGS_RE = re.compile(r"[^\s,]+")
+
+
+class Instruction:
+    """
+    Compact record for one source line. The fields are also reachable with
+    the dict-style access used by the op_* callbacks and show_msg().
+    """
+    __slots__ = ("line_no", "line", "addr", "prg", "op", "args")
+
+    def __init__(self, line_no, line, addr, prg=None, op=None, args=()):
+        self.line_no = line_no
+        self.line = line
+        self.addr = addr
+        self.prg = prg
+        self.op = op
+        self.args = args
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __eq__(self, other):
+        try:
+            return all(self[k] == other[k] for k in self.__slots__)
+        except (KeyError, TypeError):
+            return NotImplemented
+
+    # Mutable, and equal to the dict of its fields, as the per-line dicts it
+    # replaces: not hashable either
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Instruction({', '.join(f'{k}={self[k]!r}' for k in self.__slots__)})"
+
+    def get(self, key, default=None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return self.__slots__
+
+    def values(self):
+        return [getattr(self, k) for k in self.__slots__]
+
+    def items(self):
+        return [(k, getattr(self, k)) for k in self.__slots__]
+
+
+class Assembler:
+    """
+    Assembler bound to an opcode table. The table is scanned once, at
+    construction, so the passes below only do a dict lookup for each
+    mnemonic. The object holds no state that changes while assembling:
+    labels, memory and image live in the locals of each call, so a single
+    instance can be shared by the threads of a pool.
+    """
+
+    def __init__(self, table=lookup_table, log=logging):
+        self.table = table
+        self.log = log
+        # mnemonic -> (callback, index of the label operand or None)
+        self.ops = {name: (entry['callback'], entry.get('label')) for name, entry in table.items()}
+
+    def tokenize(self, src, labels):
+        """
+        First pipeline stage: yield one instruction for each source line that
+        carries a label, a segment directive or a mnemonic. Labels are added to
+        the given dict as soon as they are defined.
+        """
+        pc_instruction = 0x0
+        segment_addr = 0
+        line_no = 1
+        for line in src:
+            # Skip blank line and strip
+            # Remove comment string from line
+            line = line.strip()
+            if not line:
+                continue
+            line = line.partition(";")[0]
 
+            inst = Instruction(line_no, line, pc_instruction)
+            line_no += 1
 
-def parse(src, log):
-    pc_instruction = 0x0
-    labels = {}
-    memory = []
-
-    segment_addr = 0
-    line_no = 1
-    for line in src:
-        # Skip blank line and strip
-        # Remove comment string from line
-        line = line.strip()
-        if not line:
-            continue
-        line = re.sub(r";.*$", "", line)
-
-        inst = {
-            "line_no": line_no,
-            "line": line,
-            "addr": pc_instruction,
-            "prg": None,
-            "op": None,
-            "args": []
-        }
-
-        line_no += 1
-        toks = re.split(r"\s+", line)
-        inst_args = False
-        is_label = False
-        is_segment = False
-        for tok in toks:
-            if inst_args and tok:
-                inst["args"] += tok.split(",")
-                inst["args"] = list(filter(len, inst["args"]))
-                continue
+            tok = LINE_RE.match(line)
+            args = tuple(ARGS_RE.findall(tok['args']))
+            if tok['segment'] is not None:
+                inst.op = tok['segment']
+                inst.prg = pc_instruction
+                inst.args = args
+                segment_addr = pc_instruction
+            elif tok['op'] is not None:
+                if tok['op'] not in self.ops:
+                    raise ValueError(show_msg("Error", inst, "No valid opcode"))
+                inst.op = tok['op']
+                inst.prg = segment_addr
+                inst.args = args
+                pc_instruction += 1
+            elif args:
+                raise ValueError(show_msg("Error", inst, "No valid opcode"))
 
-            label = re.search(r'^\w+:', tok)
-            if label is not None:
+            for label in LABEL_RE.findall(tok['labels']):
                 if label in labels:
                     raise ValueError(show_msg("Error", inst, "Wrong label"))
+                labels[label] = inst.addr
 
-                labels[label.group().replace(":", "")] = pc_instruction
-                is_label = True
+            if not tok['labels'] and inst.op is None:
+                continue
 
-            seg = re.search(r"^\.\w+", tok)
-            if seg is not None:
-                inst['op'] = tok.replace(".", "")
-                inst['prg'] = pc_instruction
-                segment_addr = pc_instruction
-                inst_args = True
-                is_segment = True
+            yield inst
+
+    def __is_resolved(self, inst, labels):
+        idx = self.ops[inst['op']][1]
+        if idx is None or idx >= len(inst['args']):
+            return True
+        return inst['args'][idx] in labels
+
+    def resolve(self, memory, labels):
+        """
+        Second pipeline stage: yield the instructions that are ready to be
+        encoded. The ones that refer to a label not yet defined are kept in a
+        fixup list and yielded as soon as the label shows up, or at the end of
+        the source, where the callback reports the missing label.
+        """
+        fixups = []
+        known = len(labels)
+        for inst in memory:
+            if known != len(labels) and fixups:
+                known = len(labels)
+                pending = []
+                for f in fixups:
+                    if self.__is_resolved(f, labels):
+                        yield f
+                    else:
+                        pending.append(f)
+                fixups = pending
+
+            if inst['op'] is None:
+                continue
 
-            if tok in lookup_table:
-                inst['op'] = tok
-                inst['prg'] = segment_addr
-                pc_instruction += 1
-                inst_args = True
+            if inst['op'] not in self.ops:
+                raise ValueError(show_msg("Error", inst, "unknow instruction"))
+
+            if self.__is_resolved(inst, labels):
+                yield inst
             else:
-                if tok and not (is_label or is_segment):
-                    raise ValueError(show_msg("Error", inst, "No valid opcode"))
+                fixups.append(inst)
 
-        if label is None and inst['op'] is None:
-            continue
+        yield from fixups
 
-        memory.append(inst)
+    def encode(self, memory, labels):
+        """
+        Last pipeline stage: yield each instruction with its encoded word, None
+        for the directives that take no room in memory.
+        """
+        log = self.log
+        for m in memory:
+            log.debug("%02X-> %s", m['addr'], m)
 
-    return memory, labels
+            if m['op'] is None:
+                continue
 
+            try:
+                callback, _ = self.ops[m['op']]
+            except KeyError:
+                raise ValueError(show_msg("Error", m, "unknow instruction"))
 
-def asm(labels, memory, log):
-    asm_bin = []
-    for m in memory:
-        log.debug(f"{m['addr']:02X}-> {list(m.values())}")
+            yield m, callback(m['op'], self.table, labels, m)
 
-        if m['op'] is None:
-            continue
+    def pipeline(self, src, labels):
+        return self.encode(self.resolve(self.tokenize(src, labels), labels), labels)
 
-        if not m['op'] in lookup_table:
-            raise ValueError(show_msg("Error", m, "unknow instruction"))
+    def parse(self, src):
+        labels = {}
+        memory = list(self.tokenize(src, labels))
+        return memory, labels
 
-        complie_op = lookup_table[m['op']]['callback']
-        asm_bin += complie_op(m['op'], lookup_table, labels, m)
+    @staticmethod
+    def put_word(image, m, word):
+        idx = m['addr'] * 2
+        if idx + 2 > len(image):
+            raise ValueError(show_msg("Error", m, f"Program exceeds the {SRAM_SIZE // 2} words of SRAM"))
 
-        ln = len(asm_bin)
+        WORD.pack_into(image, idx, word)
+        return idx + 2
+
+    @staticmethod
+    def image_view(image, ln):
+        # Program is padded to the 16 bytes row
         if ln % 16:
             ln = (int(ln/16)+1)*16
 
-        padding = [0 for i in range(ln - len(asm_bin))]
+        return memoryview(image)[:ln]
+
+    def asm(self, labels, memory):
+        image = bytearray(SRAM_SIZE)
+        ln = 0
+        for m, word in self.encode(memory, labels):
+            if word is not None:
+                ln = max(ln, self.put_word(image, m, word))
+
+        return self.image_view(image, ln)
+
+    def asm_stream(self, src):
+        """
+        Assemble the source through the pipeline, placing each word at its
+        address, and keep only the segment directives of the memory.
+        """
+        labels = {}
+        image = bytearray(SRAM_SIZE)
+        ln = 0
+        memory = []
+        for m, word in self.pipeline(src, labels):
+            if m['op'] == 'segment':
+                memory.append(m)
+
+            if word is not None:
+                ln = max(ln, self.put_word(image, m, word))
+
+        return self.image_view(image, ln), memory, labels
+
+    def assemble(self, src, name="stdin"):
+        """
+        Assemble a source, given as text or as an iterable of lines, without
+        touching the filesystem.
+        """
+        if isinstance(src, str):
+            src = src.splitlines()
+
+        asm_bin, memory, labels = self.asm_stream(src)
+        return AsmResult(name, asm_bin, memory, labels)
 
-    return asm_bin + padding
 
+# Shared by the module level helpers below
+ASSEMBLER = Assembler()
 
-def deasm(bin, addr, log):
+
+def __assembler(log):
+    if log is ASSEMBLER.log:
+        return ASSEMBLER
+    return Assembler(log=log)
+
+
+def tokenize(src, labels):
+    return ASSEMBLER.tokenize(src, labels)
+
+
+def resolve(memory, labels):
+    return ASSEMBLER.resolve(memory, labels)
+
+
+def encode(memory, labels, log):
+    return __assembler(log).encode(memory, labels)
+
+
+def pipeline(src, labels, log):
+    return __assembler(log).pipeline(src, labels)
+
+
+def parse(src, log):
+    return ASSEMBLER.parse(src)
+
+
+def asm(labels, memory, log):
+    return __assembler(log).asm(labels, memory)
+
+
+def asm_stream(src, log):
+    return __assembler(log).asm_stream(src)
+
+
+@functools.lru_cache(maxsize=None)
+def decode_table():
+    """
+    Build, on first use, the table that maps every 16 bit word to the
+    instruction encoding it, as (name, variant, mask) where variant is the
+    'op' or 'opv' key of lookup_table. When encodings overlap, the one with
+    more opcode bits set wins and then the one with fewer operand bits: so
+    map_start beats ld on the invalid target rd, set_pwm beats wait with
+    prescale and no time, rst beats wait and wait beats ramp with no
+    increments, map_clr beats map_sel and trig_clear beats trigger.
+    """
+    encodings = []
+    for name, entry in lookup_table.items():
+        for opk, mk in [('op', 'mask'), ('opv', 'maskv')]:
+            if entry.get(opk) is None:
+                continue
+            key = (-bin(entry[opk]).count("1"), bin(entry[mk]).count("1"))
+            encodings.append((key, name, opk, entry[mk], entry[opk]))
+
+    table = [None] * 0x10000
+    for _, name, opk, mask, op in sorted(encodings, key=lambda x: x[0]):
+        decoded = (name, opk, mask)
+        operands = mask
+        while True:
+            if table[op | operands] is None:
+                table[op | operands] = decoded
+            if not operands:
+                break
+            operands = (operands - 1) & mask
+
+    return table
+
+
+def decode(word):
+    """
+    Return (name, variant, operands) of the instruction encoded in the word,
+    operands being the bits under the opcode mask.
+    """
+    decoded = decode_table()[word]
+    if decoded is None:
+        raise ValueError(f"Invalid instruction word {word:04X}")
+
+    name, opk, mask = decoded
+    return name, opk, word & mask
+
+
+def __reg(v):
+    return f"r{'abcd'[v]}"
+
+
+def __trigger_args(w):
+    d = []
+    for t, bits in [('w', [(7, '1'), (8, '2'), (9, '3'), (12, 'e')]),
+                    ('s', [(1, '1'), (2, '2'), (3, '3'), (6, 'e')])]:
+        v = [name for bit, name in bits if w & (1 << bit)]
+        if v:
+            d.append(f"{t}{{{'|'.join(v)}}}")
+    return ("".join(d),)
+
+
+def __time_candidates(step, level, prescale):
+    """
+    Integer times in ms, nearest first, that op_ramp/op_wait could have
+    rounded to the given step time.
+    """
+    unit = PRESCALE_MS[prescale] * level
+    nominal = step * unit
+    lo = max(0, int((step - 0.5) * unit))
+    hi = int((step + 0.5) * unit) + 1
+    # Generated nearest first, as the first one that encodes the word wins
+    t = round(nominal)
+    below, above = t - 1, t
+    while below >= lo or above <= hi:
+        if above <= hi and (below < lo or abs(above - nominal) <= abs(nominal - below)):
+            yield above
+            above += 1
+        else:
+            yield below
+            below -= 1
+
+
+def __ramp_args(w, opk):
+    if opk == 'opv':
+        sign = "-" if w & (1 << 4) else ""
+        return (__reg((w >> 2) & 3), f"pre={(w >> 5) & 1}", f"{sign}{__reg(w & 3)}")
+
+    level = w & 0xFF
+    if w & (1 << 8):
+        level = -level
+    return ((f"{t / 1000:g}", str(level))
+            for t in __time_candidates((w >> 9) & 0x1F, abs(level), (w >> 14) & 1))
+
+
+def __wait_args(w):
+    """
+    The wait time of the word, and the same time clamped to the range that
+    op_wait accepts: 31 x 15.625 ms is above its 484 ms maximum, but 484 ms
+    encodes to the same step.
+    """
+    ms = ((w >> 9) & 0x1F) * PRESCALE_MS[(w >> 14) & 1]
+    clamped = min(max(ms, lookup_table['wait']['min']), lookup_table['wait']['max'])
+    return [(f"{ms / 1000:g}",), (repr(ms / 1000),), (f"{clamped / 1000:g}",)]
+
+
+def __alu_args(w, opk):
+    if opk == 'opv':
+        return (__reg((w >> 10) & 3), __reg((w >> 2) & 3), __reg(w & 3))
+    return (__reg((w >> 10) & 3), str(w & 0xFF))
+
+
+def __deasm_args(name, opk, w, addr, prg, label):
+    """
+    Operands that make the op_* callback encode the word again, or an
+    iterable of candidates when the source value has been rounded by the
+    callback.
+    """
+    if name in ['load_start', 'map_start', 'load_end', 'load_addr', 'map_addr']:
+        return (label(w & 0x7F),)
+    if name == 'map_sel':
+        return (str(w & 0x7F),)
+    if name == 'ramp':
+        return __ramp_args(w, opk)
+    if name == 'wait':
+        return __wait_args(w)
+    if name == 'set_pwm':
+        return (__reg(w & 3),) if opk == 'opv' else (str(w & 0xFF),)
+    if name == 'end':
+        return tuple(f for bit, f in [(12, 'i'), (11, 'r')] if w & (1 << bit))
+    if name == 'branch' and opk == 'op':
+        return (str((w >> 7) & 0x3F), label(prg + (w & 0x7F)))
+    if name == 'trigger':
+        return __trigger_args(w)
+    if name in ['jne', 'jl', 'jge', 'je']:
+        return (__reg((w >> 2) & 3), __reg(w & 3), label(addr + ((w >> 4) & 0x1F) + 1))
+    if name == 'ld':
+        return (__reg((w >> 10) & 3), str(w & 0xFF))
+    if name in ['add', 'sub']:
+        return __alu_args(w, opk)
+    if name in ['rst', 'int', 'map_clr', 'map_next', 'map_prev', 'load_next', 'load_prev', 'trig_clear']:
+        return ()
+
+    return []
+
+
+def deasm(bin, addr, log, names=None):
+    """
+    Disassemble the image in one linear pass, given the segment start
+    addresses, and return the source lines that parse() and asm() assemble
+    back to the same image. Label operands get a label named after their
+    address: mNN in the mapping table rows, lNN in the program code.
+    """
     if len(addr) < 3:
-        raise ValueError(show_msg("Error", addr, "wrong address table"))
+        raise ValueError(f"Wrong address table {addr}")
 
-    memory = []
-    for i in range(len(bin)//2):
-        b = bin[i*2] << 8 | bin[i*2+1]
-        memory.append(b)
-
-    vars = []
-    for n, v in enumerate(memory[:addr[0]]):
-        vars.append({f'a{n}': v})
-
-    print(vars)
-    print(addr)
-    idx = 1
-    for n, i in enumerate(memory):
-        op_name = []
-        op_st = ""
-        if n in addr:
-            log.info(f".segment program{idx}")
-            idx += 1
+    if names is None:
+        names = [f"program{n + 1}" for n in range(len(addr))]
+
+    bin = __as_view(bin)
+    memory = [w for w, in WORD.iter_unpack(bin[:len(bin) & ~1])]
+    labels = {}
 
+    def label(a):
+        name = f"m{a}" if a < addr[0] else f"l{a}"
+        labels[name] = a
+        return name
+
+    # Trailing zero words are padding, but each segment keeps at least one
+    # instruction (0000 is rst).
+    end = addr[-1] + 1
+    for n in range(len(memory) - 1, -1, -1):
+        if memory[n]:
+            end = max(end, n + 1)
+            break
+
+    table = decode_table()
+    lines = []
+    prg = addr[0]
+    for n in range(end):
+        w = memory[n] if n < len(memory) else 0
         if n < addr[0]:
-            op_st = f"a{n}: dw {i:016b}b"
+            if w > lookup_table['dw']['max']:
+                raise ValueError(f"Word {w:04X} at {n:02X} can't be written as dw")
+            lines.append(("dw", (f"{w:016b}b",)))
             continue
 
-        for op in lookup_table:
-            for k in [('op', 'mask'), ('opv', 'maskv')]:
-                opk, mk = k
-                if opk not in lookup_table[op]:
-                    continue
-                p = lookup_table[op][opk]
-                if p is None:
-                    continue
+        for a in addr:
+            if a <= n:
+                prg = a
+
+        if table[w] is None:
+            raise ValueError(f"Invalid instruction word {w:04X} at {n:02X}")
+
+        name, opk, _ = table[w]
+        args = __deasm_args(name, opk, w, n, prg, label)
+        candidates = [args] if isinstance(args, tuple) else args
+        for args in candidates:
+            inst = Instruction(n + 1, "", n, prg, name, args)
+            try:
+                if lookup_table[name]['callback'](name, lookup_table, labels, inst) == w:
+                    break
+            except (ValueError, ZeroDivisionError):
+                pass
+        else:
+            raise ValueError(f"Word {w:04X} at {n:02X} can't be written as {name}")
+
+        log.debug("%02X: %04X %s %s", n, w, name, args)
+        lines.append((name, args))
+
+    # Jumps past the last instruction land on padding words
+    while labels and max(labels.values()) > len(lines):
+        lines.append(("rst", ()))
+
+    defs = {}
+    for name, a in labels.items():
+        defs[a] = name
 
-                v = i & ~lookup_table[op][mk]
-                if v == p:
-                    op_st = f"{v:04x} {p:04x}"
-                    op_name.append(op)
+    out = []
+    for n, (name, args) in enumerate(lines):
+        for a, seg in zip(addr, names):
+            if a == n:
+                out.append(f".segment {seg}")
 
-        print(f"{n:03d}: {i:04x} {op_st} {op_name}")
+        lbl = f"{defs[n]}:" if n in defs else ""
+        out.append(f"{lbl:<8}{name:<11}{', '.join(args)}".rstrip())
+
+    for a in sorted(defs):
+        if a >= len(lines):
+            out.append(f"{defs[a]}:")
+
+    return out
+
+
+def hex_parse(src):
+    """
+    Read back a .hex file as written by hex_fmt(): return the image, the
+    segment start addresses and the segment names.
+    """
+    image = bytearray()
+    addr = []
+    names = []
+    for line in src:
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith("@"):
+            _, a, name = line.split()
+            addr.append(int(a, 16))
+            names.append(name)
+            continue
+
+        try:
+            image += bytes.fromhex(line)
+        except ValueError:
+            raise ValueError(f"Wrong hex line [{line}]")
+
+    return image, addr, names
+
+
+def __as_view(bin):
+    try:
+        return memoryview(bin)
+    except TypeError:
+        return memoryview(bytes(bin))
 
 
 def __bin_to_table(bin):
+    bin = __as_view(bin)
     c = []
     for i in range(32):
         s = ""
         idx = 16*i
-        m = []
         if (idx+16) > len(bin):
             break
         m = bin[idx:idx+16]
-        s = ",".join(list(map(lambda x: f"0x{x:02X}", m))) + ","
+        s = ",".join(f"0x{x:02X}" for x in m) + ","
         c.append(s)
 
     return "\n".join(c)
@@ -165,6 +608,148 @@ def __memory_ddr_to_table(memory):
     return ", ".join(d)
 
 
+class AsmResult:
+    """
+    Result of assemble(): the SRAM image as a memoryview, the segment start
+    addresses and names, and the labels. The .hex and C renderings are built
+    on request.
+    """
+
+    def __init__(self, name, image, memory, labels):
+        self.name = name
+        self.image = image
+        self.memory = memory
+        self.labels = labels
+
+    @property
+    def segments(self):
+        return [(m['prg'], m['args'][0] if m['args'] else "") for m in self.memory]
+
+    @property
+    def addr(self):
+        return [m['prg'] for m in self.memory]
+
+    def asm_data(self):
+        return {
+            'path': "",
+            'name': self.name,
+            'memory': self.memory,
+            'labels': self.labels,
+            'bin': self.image
+        }
+
+    def hex(self):
+        return "\n".join(hex_fmt(self.image, self.memory))
+
+    def c_source(self, name=None, post=""):
+        return c_fmt([self.asm_data()], (name or self.name).lower(), post)
+
+    def c_header(self, name=None, post=""):
+        return h_fmt([self.asm_data()], (name or self.name).lower(), post)
+
+
+def assemble(src, name="stdin", log=logging):
+    """
+    Assemble a source, given as text or as an iterable of lines, without
+    touching the filesystem.
+    """
+    return __assembler(log).assemble(src, name)
+
+
+def __cache_pack(asm_bin, memory, labels):
+    return {
+        'bin': bytes(asm_bin).hex(),
+        'memory': [m.values() for m in memory if m['op'] == 'segment'],
+        'labels': labels,
+    }
+
+
+def __cache_unpack(data):
+    asm_bin = memoryview(bytes.fromhex(data['bin']))
+    memory = []
+    for line_no, line, addr, prg, op, args in data['memory']:
+        memory.append(Instruction(line_no, line, addr, prg, op, tuple(args)))
+    return asm_bin, memory, data['labels']
+
+
+def asm_file(fn, log, cache=None):
+    """
+    Assemble a source file, - for stdin, into the asm_data entry used by the
+    output formatters. With a build cache, a source already assembled is
+    taken from the cache without running the assembler.
+    """
+    if fn == "-":
+        asm_bin, memory, labels = asm_stream(sys.stdin, log)
+        fn = "stdin"
+    else:
+        with open(fn) as f:
+            src = f.read()
+
+        data = None
+        if cache is not None:
+            key = cache.key(src)
+            data = cache.get(key)
+
+        if data is not None:
+            log.debug(f"{fn}: from build cache")
+            asm_bin, memory, labels = __cache_unpack(data)
+        else:
+            asm_bin, memory, labels = asm_stream(src.splitlines(), log)
+            if cache is not None:
+                cache.put(key, __cache_pack(asm_bin, memory, labels))
+
+    src_path, src_name = os.path.split(fn)
+    name, _ = os.path.splitext(fn)
+    name = os.path.basename(name)
+
+    return {
+        'path': src_path,
+        'name': name,
+        'memory': memory,
+        'labels': labels,
+        'bin': asm_bin,
+        'deps': [] if fn == "stdin" else [fn]
+    }
+
+
+# Build cache of the -j workers, one for each process
+__job_cache = None
+
+
+def init_job(cache_dir=None, use_cache=True):
+    """
+    Set up the build cache used by asm_job() in this process: the pool
+    initializer of the -j workers, and called once for the jobs run in the
+    main process.
+    """
+    global __job_cache
+    __job_cache = BuildCache(cache_dir, version=__version__) if use_cache else None
+
+
+def asm_job(fn):
+    """
+    Assemble one file for the -j process pool: return the file name, the
+    asm_data entry with the image copied to bytes, and the error message
+    if the source couldn't be read or assembled. Any other error is reported
+    as the failure of this file, with its traceback, so the other files of
+    the batch still get their diagnostics.
+    """
+    logging.debug(fn)
+    try:
+        x = asm_file(fn, logging, __job_cache)
+    except ValueError as e:
+        return fn, None, f"{e}"
+    except OSError as e:
+        if e.filename == fn:
+            return fn, None, f"Can't read the source: {e.strerror}"
+        return fn, None, f"Internal error:\n{traceback.format_exc()}"
+    except Exception:
+        return fn, None, f"Internal error:\n{traceback.format_exc()}"
+
+    x['bin'] = bytes(x['bin'])
+    return fn, x, None
+
+
 HEADER_DATA = """
 extern const uint8_t <NAME><POST>[<BIN_LEN>];
 """
@@ -202,90 +787,117 @@ SOURCE_TEMPLAE = """
 """
 
 
-def c_fmt_merge(asm_data, c_name=None, h_name=None, hdr=True, post=""):
+def write_if_changed(fn, data):
+    """
+    Write the data, str or bytes-like, to fn only when the file doesn't
+    already hold the same content, so the mtime of an unchanged output
+    doesn't trigger rebuilds downstream. The new content is written to a
+    temporary file renamed over fn. Return True if the file was written.
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    data = memoryview(data)
 
-    if c_name is None and h_name is None:
-        for x in asm_data:
-            c_name = os.path.join(x['path'], x['name']+".c")
-            h_name = os.path.join(x['path'], x['name']+".h")
-            name = x['name']
+    mode = 0o644
+    try:
+        st = os.stat(fn)
+        mode = st.st_mode & 0o777
+        if st.st_size == len(data):
+            with open(fn, 'rb') as f:
+                if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+                    return False
+    except FileNotFoundError:
+        pass
+
+    path, name = os.path.split(fn)
+    fd, tmp = tempfile.mkstemp(dir=path or ".", prefix=f".{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, mode)
+        os.replace(tmp, fn)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    return True
 
-            with open(c_name, 'w') as f:
-                src = SOURCE_TEMPLAE
-                src = src.replace("<NAME>", name.lower())
-                src = src.replace("<POST>", post)
 
-                d = SOURCE_DATA.replace("<NAME>", name.lower())
-                d = d.replace("<POST>", post)
-                d = d.replace("<DATA>", __bin_to_table(x['bin']))
+def c_fmt(asm_data, name, post=""):
+    d = ""
+    for x in asm_data:
+        d += SOURCE_DATA.replace("<NAME>", x['name'].lower())
+        d = d.replace("<POST>", post)
+        d = d.replace("<DATA>", __bin_to_table(x['bin']))
 
-                d += SOURCE_DATA_ADDR.replace("<NAME>", name.lower())
-                d = d.replace("<POST>", post)
-                d = d.replace("<DATA>", __memory_ddr_to_table(x['memory']))
+        d += SOURCE_DATA_ADDR.replace("<NAME>", x['name'].lower())
+        d = d.replace("<POST>", post)
+        d = d.replace("<DATA>", __memory_ddr_to_table(x['memory']))
 
-                src = src.replace("<SRC>", d)
+    src = SOURCE_TEMPLAE
+    src = src.replace("<NAME>", name)
+    return src.replace("<SRC>", d)
 
-                f.write(src)
 
-            with open(h_name, 'w') as f:
-                src = HEADER_TEMPLAE
-                src = src.replace("<NAME>", name.lower())
-                src = src.replace("<POST>", post)
+def h_fmt(asm_data, name, post=""):
+    d = ""
+    for x in asm_data:
+        d += HEADER_DATA.replace("<NAME>", x['name'].lower())
+        d = d.replace("<BIN_LEN>", f"{len(x['bin'])}")
+        d += HEADER_DATA_ADDR.replace("<NAME>", x['name'].lower())
+        d = d.replace("<POST>", post)
 
-                d = HEADER_DATA.replace("<NAME>", name.lower())
-                d = d.replace("<BIN_LEN>", f"{len(x['bin'])}")
-                d += HEADER_DATA_ADDR.replace("<NAME>", name.lower())
-                d = d.replace("<POST>", post)
+    src = HEADER_TEMPLAE
+    src = src.replace("<NAME>", name)
+    return src.replace("<SRC>", d)
 
-                src = src.replace("<SRC>", d)
 
-                f.write(src)
+def c_fmt_merge(asm_data, c_name=None, h_name=None, hdr=True, post=""):
+
+    if c_name is None and h_name is None:
+        for x in asm_data:
+            c_name = os.path.join(x['path'], x['name']+".c")
+            h_name = os.path.join(x['path'], x['name']+".h")
+            name = x['name'].lower()
+
+            write_if_changed(c_name, c_fmt([x], name, post))
+            write_if_changed(h_name, h_fmt([x], name, post))
     else:
-        src = SOURCE_TEMPLAE
         c, _ = os.path.splitext(c_name)
         c = os.path.basename(c)
-        src = src.replace("<NAME>", c)
-        with open(c_name, 'w') as f:
-            d = ""
-            for x in asm_data:
-                name = x['name']
-                d += SOURCE_DATA.replace("<NAME>", name.lower())
-                d = d.replace("<POST>", post)
-                d = d.replace("<DATA>", __bin_to_table(x['bin']))
-
-                d += SOURCE_DATA_ADDR.replace("<NAME>", name.lower())
-                d = d.replace("<POST>", post)
-                d = d.replace("<DATA>", __memory_ddr_to_table(x['memory']))
-
-            src = src.replace("<SRC>", d)
-            f.write(src)
-
-        src = HEADER_TEMPLAE
+        write_if_changed(c_name, c_fmt(asm_data, c, post))
+
         h, _ = os.path.splitext(h_name)
         h = os.path.basename(h)
-        src = src.replace("<NAME>", h)
-        with open(h_name, 'w') as f:
-            d = ""
-            for x in asm_data:
-                d += HEADER_DATA.replace("<NAME>", name.lower())
-                d = d.replace("<BIN_LEN>", f"{len(x['bin'])}")
-                d += HEADER_DATA_ADDR.replace("<NAME>", name.lower())
-                d = d.replace("<POST>", post)
+        write_if_changed(h_name, h_fmt(asm_data, h, post))
 
-            src = src.replace("<SRC>", d)
-            f.write(src)
+
+def dep_fmt(targets, deps):
+    """
+    Make/ninja dependency rule of the outputs on the sources, plus an empty
+    rule for each source so that a removed file doesn't break the build.
+    """
+    def esc(fn):
+        return fn.replace(" ", "\\ ")
+
+    out = [f"{' '.join(map(esc, targets))}: {' '.join(map(esc, deps))}"]
+    for d in deps:
+        out.append("")
+        out.append(f"{esc(d)}:")
+    return "\n".join(out) + "\n"
 
 
 def hex_fmt(asm, memory):
+    asm = __as_view(asm)
     out = []
     s = ""
     for i in range(32):
         s = ""
         idx = 16*i
-        m = [0 for x in range(16)]
+        m = bytes(16)
         if (idx+16) <= len(asm):
             m = asm[idx:idx+16]
-        s = " ".join(list(map(lambda x: f"{x:02X}", m)))
+        s = m.hex(" ").upper()
         out.append(s)
 
     for m in memory:
@@ -297,8 +909,6 @@ def hex_fmt(asm, memory):
 
 if __name__ == "__main__":
     import argparse
-    import sys
-    import os
 
     parser = argparse.ArgumentParser(
         prog='lp55xx_asm',
@@ -306,7 +916,7 @@ if __name__ == "__main__":
         epilog='Assemblator for led efx programm')
 
     parser.add_argument('files_src', nargs='+',
-                        help='Engine Led assembly source file')
+                        help='Engine Led assembly source file, - to read it from stdin')
 
     parser.add_argument('-v', '--verbose', dest="verbose", action="store_true",
                         default=False, help="Verbose")
@@ -319,6 +929,28 @@ if __name__ == "__main__":
                         dest="c_fmt_to_file",
                         help="Generate .c and .h source file")
 
+    parser.add_argument('-d', '--deasm', action="store_true",
+                        dest="deasm",
+                        help="Disassemble the given .hex files to source on stdout")
+
+    parser.add_argument('-b', '--bin', action="store_true",
+                        dest="bin_to_file",
+                        help="Generate raw .bin image file")
+
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help="Assemble the sources on N processes")
+
+    parser.add_argument('-MD', action="store_true",
+                        dest="dep_file",
+                        help="Write a .d dependency file for each source, listing its inputs and outputs")
+
+    parser.add_argument('--no-cache', action="store_true",
+                        dest="no_cache",
+                        help="Always assemble, without looking up the build cache")
+
+    parser.add_argument('--cache-dir', dest="cache_dir", default=None,
+                        help="Build cache directory, default ~/.cache/lp5xxx_asm")
+
     args = parser.parse_args()
 
     level = logging.WARNING
@@ -326,35 +958,63 @@ if __name__ == "__main__":
         level = logging.DEBUG
     logging.basicConfig(level=level, format='%(asctime)s [%(levelname)s]: %(message)s')
 
-    try:
-        asm_data = []
+    if args.deasm:
+        try:
+            for f in args.files_src:
+                with open(f) as src:
+                    image, addr, names = hex_parse(src)
+                print("\n".join(deasm(image, addr, logging, names)))
+        except ValueError as e:
+            logging.error(f"{e}")
+            sys.exit(1)
+        sys.exit(0)
+
+    jobs = []
+    pool = None
+    init_job(args.cache_dir, not args.no_cache)
+    if args.jobs > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, initializer=init_job,
+                                                      initargs=(args.cache_dir, not args.no_cache))
+
+    with pool or contextlib.nullcontext():
         for f in args.files_src:
-            src = open(f)
-            logging.debug(f)
-            memory, labels = parse(src, logging)
-            asm_bin = asm(labels, memory, logging)
-
-            src_path, src_name = os.path.split(f)
-            name, _ = os.path.splitext(f)
-            name = os.path.basename(name)
-
-            asm_data.append({
-                'path': src_path,
-                'name': name,
-                'memory': memory,
-                'labels': labels,
-                'bin': asm_bin
-            })
-    except ValueError as e:
-        logging.error(f"{e}")
+            # stdin is only readable from this process
+            if pool is None or f == "-":
+                jobs.append(asm_job(f))
+            else:
+                jobs.append(pool.submit(asm_job, f))
+
+        asm_data = []
+        errors = 0
+        for j in jobs:
+            if isinstance(j, concurrent.futures.Future):
+                j = j.result()
+
+            f, x, e = j
+            if e is not None:
+                logging.error(f"{f}: {e}")
+                errors += 1
+            asm_data.append(x)
+
+    if errors:
+        logging.error(f"{errors} of {len(jobs)} sources failed")
         sys.exit(1)
 
+    outputs = []
     for x in asm_data:
         data = hex_fmt(x['bin'], x['memory'])
         fn = os.path.join(x['path'], f"{x['name']}"+".hex")
-        with open(fn, 'w') as f:
-            f.write("\n".join(data))
+        write_if_changed(fn, "\n".join(data))
+        outputs.append([fn])
 
+    if args.bin_to_file:
+        for x, out in zip(asm_data, outputs):
+            fn = os.path.join(x['path'], f"{x['name']}"+".bin")
+            write_if_changed(fn, x['bin'])
+            out.append(fn)
+
+    # The .c and .h that hold all the sources, with -o
+    merged = []
     if args.c_fmt_to_file:
         c_name = None
         h_name = None
@@ -368,3 +1028,22 @@ if __name__ == "__main__":
 
         logging.debug(f"{c_name}, {h_name}")
         c_fmt_merge(asm_data, c_name, h_name)
+
+        if c_name is None and h_name is None:
+            for x, out in zip(asm_data, outputs):
+                out.append(os.path.join(x['path'], x['name']+".c"))
+                out.append(os.path.join(x['path'], x['name']+".h"))
+        else:
+            merged = [c_name, h_name]
+
+    if args.dep_file:
+        for x, out in zip(asm_data, outputs):
+            if x['deps']:
+                fn = os.path.join(x['path'], f"{x['name']}"+".d")
+                write_if_changed(fn, dep_fmt(out, x['deps']))
+
+        # The merged .c and .h depend on every source: one rule of their own
+        deps = [d for x in asm_data for d in x['deps']]
+        if merged and deps:
+            fn = os.path.splitext(merged[0])[0] + ".d"
+            write_if_changed(fn, dep_fmt(merged, deps))
@@ -3,6 +3,9 @@ import lp5xxx_asm
 import logging
 import tracemalloc
 import os
+import tempfile
+import concurrent.futures
+import unittest.mock
 
 
 memory = []
@@ -35,6 +38,14 @@ class TestASM(unittest.TestCase):
             for n, i in enumerate(chk_bin):
                 self.assertEqual(i, asm_bin[n], f"Missmatch [{i}] {i:02x} != {asm_bin[n]:02x}")
 
+    def __doroundtrip(self, bin, addr):
+        src = lp5xxx_asm.deasm(bin, addr, logging)
+        memory, labels = lp5xxx_asm.parse(src, logging)
+        asm_bin = lp5xxx_asm.asm(labels, memory, logging)
+
+        self.assertEqual([m['prg'] for m in memory if m['op'] == 'segment'], addr)
+        self.assertEqual(bytes(asm_bin).ljust(len(bin), b"\0"), bytes(bin).ljust(len(asm_bin), b"\0"))
+
     def test_labels(self):
         src_name = os.path.join(".", "src", "labels.src")
         with open(src_name) as src:
@@ -110,6 +121,159 @@ class TestASM(unittest.TestCase):
         ]
         self.__dotest(os.path.join(".", "src", "test2.src"), chk_bin)
 
+    def test_stream(self):
+        for s in ["labels.src", "test.src", "test1.src", "ramp.src", "trigger.src", "jump.src", "alu.src", "test2.src"]:
+            with open(os.path.join(".", "src", s)) as src:
+                memory, labels = lp5xxx_asm.parse(src, logging)
+                asm_bin = lp5xxx_asm.asm(labels, memory, logging)
+
+            with open(os.path.join(".", "src", s)) as src:
+                stream_bin, segments, stream_labels = lp5xxx_asm.asm_stream(src, logging)
+
+            self.assertEqual(list(asm_bin), list(stream_bin), f"stream missmatch [{s}]")
+            self.assertEqual(labels, stream_labels)
+            self.assertEqual([m['prg'] for m in memory if m['op'] == 'segment'], [m['prg'] for m in segments])
+
+    def test_image(self):
+        memory, labels = lp5xxx_asm.parse([], logging)
+        self.assertEqual(len(lp5xxx_asm.asm(labels, memory, logging)), 0)
+
+        memory, labels = lp5xxx_asm.parse(["set_pwm 10"] * 256, logging)
+        asm_bin = lp5xxx_asm.asm(labels, memory, logging)
+        self.assertEqual(len(asm_bin), lp5xxx_asm.SRAM_SIZE)
+        self.assertEqual(bytes(asm_bin[-2:]), b"\x40\x0a")
+
+        memory, labels = lp5xxx_asm.parse(["set_pwm 10"] * 257, logging)
+        with self.assertRaises(ValueError):
+            lp5xxx_asm.asm(labels, memory, logging)
+
+    def test_write_if_changed(self):
+        with tempfile.TemporaryDirectory() as path:
+            fn = os.path.join(path, "out.hex")
+            self.assertTrue(lp5xxx_asm.write_if_changed(fn, "00 01"))
+            os.utime(fn, (0, 0))
+
+            self.assertFalse(lp5xxx_asm.write_if_changed(fn, b"00 01"))
+            self.assertEqual(os.stat(fn).st_mtime, 0)
+
+            self.assertTrue(lp5xxx_asm.write_if_changed(fn, memoryview(b"00 02")))
+            self.assertNotEqual(os.stat(fn).st_mtime, 0)
+            with open(fn) as f:
+                self.assertEqual(f.read(), "00 02")
+            self.assertEqual(os.listdir(path), ["out.hex"])
+
+    def test_jobs(self):
+        srcs = [os.path.join(".", "src", s) for s in ["labels.src", "test2.src", "missing.src", "alu.src"]]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2, initializer=lp5xxx_asm.init_job,
+                                                    initargs=(None, False)) as pool:
+            jobs = list(pool.map(lp5xxx_asm.asm_job, srcs))
+
+        self.assertEqual([j[0] for j in jobs], srcs)
+        self.assertIn("Can't read the source", jobs[2][2])
+        for fn, x, e in [jobs[0], jobs[1], jobs[3]]:
+            self.assertIsNone(e)
+            ref = lp5xxx_asm.asm_file(fn, logging)
+            self.assertEqual(x['bin'], bytes(ref['bin']))
+            self.assertEqual(x['memory'], ref['memory'])
+
+        # Bad ramp operands are an assembly error, any other error a failure
+        # of that file only
+        with tempfile.TemporaryDirectory() as path:
+            fn = os.path.join(path, "bad.src")
+            with open(fn, "w") as f:
+                f.write(".segment program1\nramp 1,foo\nend")
+            lp5xxx_asm.init_job(use_cache=False)
+            self.assertIn("Invalid arguments", lp5xxx_asm.asm_job(fn)[2])
+
+            with unittest.mock.patch.object(lp5xxx_asm, "asm_file", side_effect=RuntimeError("boom")):
+                _, x, e = lp5xxx_asm.asm_job(fn)
+            self.assertIsNone(x)
+            self.assertIn("RuntimeError: boom", e)
+
+    def test_threads(self):
+        srcs = []
+        for name in ["labels.src", "test1.src", "test2.src", "alu.src", "jump.src"]:
+            with open(os.path.join(".", "src", name)) as src:
+                srcs.append(src.read())
+        for n in range(2000):
+            srcs.append(f"row: dw {n & 0x1FF}\n.segment prg{n}\nmap_start row\nloop: set_pwm {n % 256}\n"
+                        f"wait 0.{n % 400 + 10:03d}\nbranch {n % 64}, loop\nend")
+
+        assembler = lp5xxx_asm.Assembler()
+        ref = [bytes(assembler.assemble(src).image) for src in srcs]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+            res = list(pool.map(assembler.assemble, srcs))
+
+        self.assertEqual([bytes(r.image) for r in res], ref)
+        self.assertEqual(res[1].labels, lp5xxx_asm.assemble(srcs[1]).labels)
+
+    def test_assemble(self):
+        src_name = os.path.join(".", "src", "test1.src")
+        with open(src_name) as src:
+            text = src.read()
+        x = lp5xxx_asm.asm_file(src_name, logging)
+
+        for r in [lp5xxx_asm.assemble(text, "test1"), lp5xxx_asm.assemble(iter(text.splitlines()), "test1")]:
+            self.assertIsInstance(r.image, memoryview)
+            self.assertEqual(bytes(r.image), bytes(x['bin']))
+            self.assertEqual(r.segments, [(0x0A, "program1"), (0x1C, "program2"), (0x33, "program3")])
+            self.assertEqual(r.addr, [0x0A, 0x1C, 0x33])
+            self.assertEqual(r.labels, x['labels'])
+            self.assertEqual(r.hex(), "\n".join(lp5xxx_asm.hex_fmt(x['bin'], x['memory'])))
+            self.assertEqual(r.c_source(), lp5xxx_asm.c_fmt([x], "test1"))
+            self.assertEqual(r.c_header("efx", "_a"), lp5xxx_asm.h_fmt([x], "efx", "_a"))
+
+    def test_dep_fmt(self):
+        self.assertEqual(lp5xxx_asm.dep_fmt(["src/a.hex", "src/a.c"], ["src/my a.src"]),
+                         "src/a.hex src/a.c: src/my\\ a.src\n\nsrc/my\\ a.src:\n")
+
+    def test_inst_memory(self):
+        line = "set_pwm 20"
+        n = 1000
+
+        def traced(make):
+            start, _ = tracemalloc.get_traced_memory()
+            insts = [make(i) for i in range(n)]
+            size, _ = tracemalloc.get_traced_memory()
+            del insts
+            return (size - start) / n
+
+        dict_size = traced(lambda i: {
+            "line_no": i, "line": line, "addr": i, "prg": 0, "op": "set_pwm", "args": line.split()[1:]})
+        slot_size = traced(lambda i: lp5xxx_asm.Instruction(i, line, i, 0, "set_pwm", tuple(line.split()[1:])))
+
+        self.assertLess(slot_size, dict_size)
+
+    def test_inst_dict_access(self):
+        inst = lp5xxx_asm.Instruction(3, "ramp 1,100", 0x0A, 0x0A, "ramp", ("1", "100"))
+        self.assertEqual(inst['args'], ("1", "100"))
+        self.assertEqual(dict(inst), {
+            "line_no": 3, "line": "ramp 1,100", "addr": 0x0A, "prg": 0x0A, "op": "ramp", "args": ("1", "100")})
+        with self.assertRaises(KeyError):
+            inst['bad']
+        with self.assertRaises(TypeError):
+            hash(inst)
+
+    def test_decode(self):
+        for s in ["labels.src", "test.src", "test1.src", "ramp.src", "trigger.src", "jump.src", "alu.src", "test2.src"]:
+            with open(os.path.join(".", "src", s)) as src:
+                memory, labels = lp5xxx_asm.parse(src, logging)
+                asm_bin = lp5xxx_asm.asm(labels, memory, logging)
+
+            for m in memory:
+                if m['op'] in [None, 'dw', 'segment']:
+                    continue
+                word = asm_bin[m['addr']*2] << 8 | asm_bin[m['addr']*2+1]
+                self.assertEqual(lp5xxx_asm.decode(word)[0], m['op'], f"decode missmatch [{s}] {m}")
+
+        self.assertEqual(lp5xxx_asm.decode(0x0000)[0], "rst")
+        self.assertEqual(lp5xxx_asm.decode(0x4000)[0], "set_pwm")
+        self.assertEqual(lp5xxx_asm.decode(0x5A00), ("wait", "op", 0x5A00))
+        self.assertEqual(lp5xxx_asm.decode(0x9D00)[0], "map_clr")
+        self.assertEqual(lp5xxx_asm.decode(0x9C7F), ("map_start", "op", 0x7F))
+        self.assertEqual(lp5xxx_asm.decode(0x9F00 | 100), ("load_addr", "op", 100))
+        self.assertEqual(lp5xxx_asm.decode(0x8423)[0:2], ("ramp", "opv"))
+
     def test_deasm0(self):
         bin = [
             0x00, 0x01, 0x00, 0x08, 0x00, 0x40, 0x00, 0x02, 0x00, 0x10, 0x00, 0x80, 0x00, 0x04, 0x00, 0x20,
@@ -120,11 +284,7 @@ class TestASM(unittest.TestCase):
 
         addr = [0x0A, 0x12, 0x20]
 
-        # src = open(os.path.join(".", "src", "test2.src"))
-        # memory, labels = lp5xxx_asm.parse(src, logging)
-        # asm_bin = lp5xxx_asm.asm(labels, memory, logging)
-        lp5xxx_asm.deasm(bin, addr, logging)
-        print(memory, labels)
+        self.__doroundtrip(bin, addr)
 
     def test_deasm1(self):
         bin = [
@@ -135,9 +295,7 @@ class TestASM(unittest.TestCase):
 
         addr = [0x0A, 0x10, 0x15]
 
-        # self.__dotest(os.path.join(".", "src", "alu.src"), chk_bin)
-        lp5xxx_asm.deasm(bin, addr, logging)
-        print(memory, labels)
+        self.__doroundtrip(bin, addr)
 
     def test_deasm2(self):
         bin = [
@@ -151,9 +309,26 @@ class TestASM(unittest.TestCase):
         ]
 
         addr = [0x0A, 0x1C, 0x33]
-        # self.__dotest(os.path.join(".", "src", "test1.src"), chk_bin)
-        lp5xxx_asm.deasm(bin, addr, logging)
-        print(memory, labels)
+        self.__doroundtrip(bin, addr)
+
+    def test_deasm_times(self):
+        # Every wait time in ms, 484 ms included, that encodes to 31 x
+        # 15.625 ms, above the maximum written in the source, and ramps
+        lines = [f"wait {t / 1000:g}" for t in range(1, 485)]
+        lines += [f"ramp {t / 1000:g}, {lvl}" for lvl in [1, -3, 255] for t in range(abs(lvl), 485 * abs(lvl), 11 * abs(lvl))]
+        for n in range(0, len(lines), 100):
+            src = ".segment program1\n" + "\n".join(lines[n:n + 100]) + "\n.segment program2\nend\n.segment program3\nend"
+            r = lp5xxx_asm.assemble(src)
+            self.__doroundtrip(r.image, r.addr)
+
+    def test_deasm_hex(self):
+        with open(os.path.join(".", "src", "labels.hex")) as src:
+            image, addr, names = lp5xxx_asm.hex_parse(src)
+
+        self.assertEqual(len(image), lp5xxx_asm.SRAM_SIZE)
+        self.assertEqual(addr, [0x0A, 0x1C, 0x1D])
+        self.assertEqual(names, ["program1", "program2", "program3"])
+        self.__doroundtrip(image, addr)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,336 @@
+#!/bin/env python
+
+# Batch simulation of many variants of a program with NumPy. The state of
+# the engines of all the variants is held in arrays and every step runs one
+# action, the same one lp5xxx_sim.Simulator would run next, for each variant
+# at once. NumPy is needed only by this module.
+
+from lp5xxx_asm import WORD, SRAM_SIZE, decode_table
+from lp5xxx_sim import (INST_CYCLES, PRESCALE_CYCLES, LEDS, ENGINES, PWM_MAX,
+                        TRIG_SEND, TRIG_WAIT, TRIG_WAIT_EXT)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Instruction names, the index is the code of the decoded word
+NAMES = sorted({name for name, _, _ in filter(None, decode_table())})
+CODE = {name: n for n, name in enumerate(NAMES)}
+
+
+def render(events, samples, dt):
+    """
+    PWM of each LED sampled every dt cycles, from the events of a
+    lp5xxx_sim.Simulator: array of shape (samples, LEDS).
+    """
+    out = np.zeros((samples, LEDS), dtype=np.uint8)
+    for ev in events:
+        # First sample taken at or after the change
+        n = -(-ev.time // dt)
+        if n < samples:
+            out[n:, ev.led] = ev.pwm
+    return out
+
+
+class BatchSimulator:
+    """
+    Run N variants of a program in lock-step. images holds one image for
+    each variant; addr the engine start addresses, shared by all the
+    variants or given for each one. render() returns the PWM of each LED of
+    each variant over time, the same values the scalar Simulator gives.
+    """
+
+    def __init__(self, images, addr, leds=None, var_d=0):
+        if np is None:
+            raise ImportError("Batch simulation needs numpy")
+
+        n = len(images)
+        if addr and isinstance(addr[0], int):
+            addr = [addr] * n
+        e = len(addr[0])
+        if e > ENGINES or any(len(a) != e for a in addr):
+            raise ValueError(f"Each variant should start the same number of engines, at most {ENGINES}")
+
+        memory = np.zeros((n, SRAM_SIZE // 2), dtype=np.int64)
+        for v, image in enumerate(images):
+            image = bytes(image)[:SRAM_SIZE]
+            memory[v, :len(image) // 2] = [w for w, in WORD.iter_unpack(image[:len(image) & ~1])]
+
+        table = decode_table()
+        code = np.full(1 << 16, -1, dtype=np.int64)
+        opv = np.zeros(1 << 16, dtype=bool)
+        for w, d in enumerate(table):
+            if d is not None:
+                code[w] = CODE[d[0]]
+                opv[w] = d[1] == 'opv'
+
+        self.n = n
+        self.e = e
+        self.memory = memory
+        self.code = code[memory]
+        self.opv = opv[memory]
+
+        k = n * e
+        self.variant = np.arange(k) // e
+        self.engine = np.arange(k) % e
+        self.start = np.array(addr, dtype=np.int64).reshape(k)
+        self.pc = self.start.copy()
+        self.next = np.zeros(k, dtype=np.int64)
+        self.epwm = np.zeros(k, dtype=np.int64)
+        self.var = np.zeros((k, 2), dtype=np.int64)
+        self.var_c = np.zeros(n, dtype=np.int64)
+        self.var_d = np.full(n, var_d, dtype=np.int64)
+        if leds is None:
+            leds = [0] * e
+        self.leds = np.tile(np.array(leds, dtype=np.int64), n)
+        self.map_start = np.zeros(k, dtype=np.int64)
+        self.map_end = np.zeros(k, dtype=np.int64)
+        self.index = np.zeros(k, dtype=np.int64)
+        # Loops left of each branch address, -1 when not loaded
+        self.loops = np.full((k, SRAM_SIZE // 2), -1, dtype=np.int64)
+        self.ramp_left = np.zeros(k, dtype=np.int64)
+        self.ramp_step = np.zeros(k, dtype=np.int64)
+        self.ramp_sign = np.ones(k, dtype=np.int64)
+        self.pending = np.zeros(k, dtype=np.int64)
+        self.wait_mask = np.zeros(k, dtype=np.int64)
+        self.wait_time = np.full(k, -1, dtype=np.int64)
+        self.pwm = np.zeros((n, LEDS), dtype=np.uint8)
+        self.interrupts = np.zeros(n, dtype=np.int64)
+        self.now = 0
+
+        self.__stop = np.iinfo(np.int64).max
+        self.__bits = 1 << np.arange(LEDS)
+        self.__exec = {
+            'ramp': self.__ramp,
+            'wait': self.__wait,
+            'set_pwm': self.__set_pwm,
+            'rst': self.__rst,
+            'end': self.__end,
+            'int': self.__int,
+            'branch': self.__branch,
+            'trigger': self.__trigger,
+            'trig_clear': self.__trig_clear,
+            'jne': self.__jump,
+            'jl': self.__jump,
+            'jge': self.__jump,
+            'je': self.__jump,
+            'ld': self.__ld,
+            'add': self.__alu,
+            'sub': self.__alu,
+        }
+        for name in ['load_start', 'map_start', 'load_end', 'map_sel', 'map_clr', 'map_next',
+                     'map_prev', 'load_next', 'load_prev', 'load_addr', 'map_addr']:
+            self.__exec[name] = self.__mapping
+
+    def run(self, until):
+        """
+        Run all the variants up to the given time, in clock cycles.
+        """
+        nxt = self.next.reshape(self.n, self.e)
+        rows = np.arange(self.n)
+        while True:
+            # For each variant the engine with the earliest action, the
+            # lowest one on a tie, as the scalar simulator does
+            e = nxt.argmin(axis=1)
+            v = np.flatnonzero(nxt[rows, e] <= until)
+            if not v.size:
+                break
+            self.__step(v * self.e + e[v])
+
+        self.now = max(self.now, until)
+
+    def render(self, samples, dt):
+        """
+        Run the variants and sample the PWM of each LED every dt cycles:
+        array of shape (N, samples, LEDS).
+        """
+        out = np.empty((self.n, samples, LEDS), dtype=np.uint8)
+        for i in range(samples):
+            self.run(i * dt)
+            out[:, i] = self.pwm
+        return out
+
+    def __get(self, k, idx):
+        v = self.variant[k]
+        local = self.var[k, np.minimum(idx, 1)]
+        return np.where(idx < 2, local, np.where(idx == 2, self.var_c[v], self.var_d[v]))
+
+    def __set(self, k, idx, value):
+        value = value & 0xFF
+        local = idx < 2
+        self.var[k[local], idx[local]] = value[local]
+        c = idx == 2
+        self.var_c[self.variant[k[c]]] = value[c]
+        d = idx == 3
+        self.var_d[self.variant[k[d]]] = value[d]
+
+    def __push(self, k):
+        v = self.variant[k]
+        mapped = (self.leds[k, None] & self.__bits) != 0
+        self.pwm[v] = np.where(mapped, self.epwm[k, None], self.pwm[v])
+
+    def __wake(self, k, t):
+        ready = (self.wait_time[k] >= 0) & (self.pending[k] & self.wait_mask[k] == self.wait_mask[k])
+        k, t = k[ready], t[ready]
+        self.pending[k] &= ~self.wait_mask[k]
+        self.next[k] = np.maximum(t, self.wait_time[k] + INST_CYCLES)
+        self.wait_time[k] = -1
+
+    def __step(self, k):
+        ramp = self.ramp_left[k] > 0
+        if ramp.any():
+            r = k[ramp]
+            self.epwm[r] = np.clip(self.epwm[r] + self.ramp_sign[r], 0, PWM_MAX)
+            self.__push(r)
+            self.ramp_left[r] -= 1
+            going = self.ramp_left[r] > 0
+            self.next[r[going]] += self.ramp_step[r[going]]
+            k = np.concatenate([k[~ramp], r[~going]])
+            if not k.size:
+                return
+
+        pc = self.pc[k]
+        if (pc >= SRAM_SIZE // 2).any():
+            raise ValueError("Engine runs out of SRAM")
+
+        v = self.variant[k]
+        w = self.memory[v, pc]
+        code = self.code[v, pc]
+        opv = self.opv[v, pc]
+        if (code < 0).any():
+            bad = np.flatnonzero(code < 0)[0]
+            raise ValueError(f"Invalid instruction word {w[bad]:04X} at {pc[bad]:02X}")
+
+        self.pc[k] = pc + 1
+        for c in np.unique(code):
+            s = code == c
+            name = NAMES[c]
+            self.__exec[name](k[s], name, opv[s], w[s], pc[s])
+
+    def __ramp(self, k, name, opv, w, addr):
+        prescale = np.where(opv, (w >> 5) & 1, (w >> 14) & 1)
+        sign = np.where(opv, (w >> 4) & 1, (w >> 8) & 1)
+        step = np.where(opv, self.__get(k, (w >> 2) & 3), (w >> 9) & 0x1F)
+        level = np.where(opv, self.__get(k, w & 3), w & 0xFF)
+
+        step = np.maximum(step, 1) * np.where(prescale, PRESCALE_CYCLES[1], PRESCALE_CYCLES[0])
+        self.ramp_left[k] = level
+        self.ramp_step[k] = step
+        self.ramp_sign[k] = 1 - 2 * sign
+        self.next[k] += step
+
+    def __wait(self, k, name, opv, w, addr):
+        unit = np.where((w >> 14) & 1, PRESCALE_CYCLES[1], PRESCALE_CYCLES[0])
+        self.next[k] += ((w >> 9) & 0x1F) * unit
+
+    def __set_pwm(self, k, name, opv, w, addr):
+        self.epwm[k] = np.where(opv, self.__get(k, w & 3), w & 0xFF)
+        self.__push(k)
+        self.next[k] += INST_CYCLES
+
+    def __rst(self, k, name, opv, w, addr):
+        self.pc[k] = self.start[k]
+        self.next[k] += INST_CYCLES
+
+    def __end(self, k, name, opv, w, addr):
+        r = k[(w & (1 << 11)) != 0]
+        saved = self.epwm[r]
+        self.epwm[r] = 0
+        self.__push(r)
+        self.epwm[r] = saved
+
+        self.interrupts[self.variant[k[(w & (1 << 12)) != 0]]] += 1
+        self.pc[k] = self.start[k]
+        self.next[k] = self.__stop
+
+    def __int(self, k, name, opv, w, addr):
+        self.interrupts[self.variant[k]] += 1
+        self.next[k] += INST_CYCLES
+
+    def __branch(self, k, name, opv, w, addr):
+        count = np.where(opv, self.__get(k, w & 3), (w >> 7) & 0x3F)
+        target = self.start[k] + np.where(opv, (w >> 2) & 0x7F, w & 0x7F)
+
+        # Loop count 0 is an infinite loop
+        left = self.loops[k, addr]
+        left = np.where(left < 0, count, left)
+        done = (count > 0) & (left == 0)
+        going = (count > 0) & ~done
+        self.loops[k[done], addr[done]] = -1
+        self.loops[k[going], addr[going]] = left[going] - 1
+
+        self.pc[k[~done]] = target[~done]
+        self.next[k] += INST_CYCLES
+
+    def __trigger(self, k, name, opv, w, addr):
+        t = self.next[k]
+        for n, bit in enumerate(TRIG_SEND[:self.e]):
+            s = (w & bit) != 0
+            if not s.any():
+                continue
+            target = self.variant[k[s]] * self.e + n
+            self.pending[target] |= np.array(TRIG_WAIT)[self.engine[k[s]]]
+            self.__wake(target, t[s])
+
+        mask = w & (TRIG_WAIT[0] | TRIG_WAIT[1] | TRIG_WAIT[2] | TRIG_WAIT_EXT)
+        ready = (self.pending[k] & mask) == mask
+        r = k[ready]
+        self.pending[r] &= ~mask[ready]
+        self.next[r] += INST_CYCLES
+
+        b = k[~ready]
+        self.wait_mask[b] = mask[~ready]
+        self.wait_time[b] = t[~ready]
+        self.next[b] = self.__stop
+
+    def __trig_clear(self, k, name, opv, w, addr):
+        self.pending[k] = 0
+        self.next[k] += INST_CYCLES
+
+    def __jump(self, k, name, opv, w, addr):
+        v1 = self.__get(k, (w >> 2) & 3)
+        v2 = self.__get(k, w & 3)
+        cond = {
+            'jne': v1 != v2,
+            'jl': v1 < v2,
+            'jge': v1 >= v2,
+            'je': v1 == v2,
+        }[name]
+        self.pc[k[cond]] += (w[cond] >> 4) & 0x1F
+        self.next[k] += INST_CYCLES
+
+    def __ld(self, k, name, opv, w, addr):
+        self.__set(k, (w >> 10) & 3, w & 0xFF)
+        self.next[k] += INST_CYCLES
+
+    def __alu(self, k, name, opv, w, addr):
+        target = (w >> 10) & 3
+        v1 = np.where(opv, self.__get(k, (w >> 2) & 3), self.__get(k, target))
+        v2 = np.where(opv, self.__get(k, w & 3), w & 0xFF)
+        self.__set(k, target, v1 + v2 if name == 'add' else v1 - v2)
+        self.next[k] += INST_CYCLES
+
+    def __mapping(self, k, name, opv, w, addr):
+        a = w & 0x7F
+        if name in ['map_start', 'load_start']:
+            self.map_start[k] = a
+            self.index[k] = a
+        elif name == 'load_end':
+            self.map_end[k] = a
+        elif name in ['map_addr', 'load_addr']:
+            self.index[k] = a
+        elif name in ['map_next', 'load_next']:
+            i = self.index[k]
+            self.index[k] = np.where(i < self.map_end[k], i + 1, self.map_start[k])
+        elif name in ['map_prev', 'load_prev']:
+            i = self.index[k]
+            self.index[k] = np.where(i > self.map_start[k], i - 1, self.map_end[k])
+        elif name == 'map_sel':
+            self.leds[k] = np.where((a >= 1) & (a <= LEDS), 1 << np.clip(a - 1, 0, LEDS - 1), 0)
+        elif name == 'map_clr':
+            self.leds[k] = 0
+
+        if name in ['map_start', 'map_addr', 'map_next', 'map_prev']:
+            self.leds[k] = self.memory[self.variant[k], self.index[k]] & ((1 << LEDS) - 1)
+        self.next[k] += INST_CYCLES
@@ -0,0 +1,91 @@
+import unittest
+import lp5xxx_asm
+import lp5xxx_sim
+import lp5xxx_batch
+import logging
+import os
+
+from lp5xxx_sim import Simulator
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+VARIANT = """
+r0: dw 0000000000000011b
+r1: dw 0000000000000100b
+r2: dw 0000000000011000b
+.segment program1
+    map_start r0
+    load_end r2
+    ld ra, {count}
+loop:
+    ramp {time}, {level}
+    map_next
+    set_pwm {pwm}
+    trigger s{{2}}
+    sub ra, 1
+    je ra, rc, done
+    branch 0, loop
+done:
+    end
+.segment program2
+    map_sel 6
+again:
+    trigger w{{1}}
+    ramp 0.05, -{pwm}
+    set_pwm rb
+    add rb, 7
+    branch 0, again
+"""
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+
+    def __variants(self):
+        results = []
+        for n in range(24):
+            src = VARIANT.format(count=n % 5 + 1, time=0.1 + (n % 7) / 10,
+                                 level=(n * 37) % 200 - 100 or 1, pwm=(n * 53) % 255 + 1)
+            results.append(lp5xxx_asm.assemble(src))
+        return results
+
+    def test_render(self):
+        results = self.__variants()
+        samples, dt = 400, lp5xxx_sim.cycles(10)
+
+        batch = lp5xxx_batch.BatchSimulator([r.image for r in results], results[0].addr, var_d=2)
+        out = batch.render(samples, dt)
+        self.assertEqual(out.shape, (len(results), samples, lp5xxx_sim.LEDS))
+
+        for n, r in enumerate(results):
+            sim = Simulator(r.image, r.addr, var_d=2)
+            ref = lp5xxx_batch.render(sim.run((samples - 1) * dt), samples, dt)
+            np.testing.assert_array_equal(out[n], ref)
+            self.assertEqual(batch.var[n * 2:n * 2 + 2].tolist(), [e.var for e in sim.engines])
+
+    def test_src(self):
+        names = ["test.src", "test1.src", "test2.src", "ramp.src", "labels.src", "jump.src", "alu.src"]
+        xs = [lp5xxx_asm.asm_file(os.path.join(".", "src", name), logging) for name in names]
+        addr = [[m['prg'] for m in x['memory']] for x in xs]
+        samples, dt = 40, lp5xxx_sim.cycles(25)
+
+        batch = lp5xxx_batch.BatchSimulator([x['bin'] for x in xs], addr, leds=[1, 2, 4], var_d=3)
+        out = batch.render(samples, dt)
+        for n, x in enumerate(xs):
+            sim = Simulator(x['bin'], addr[n], leds=[1, 2, 4], var_d=3)
+            ref = lp5xxx_batch.render(sim.run((samples - 1) * dt), samples, dt)
+            np.testing.assert_array_equal(out[n], ref)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            lp5xxx_batch.BatchSimulator([b"\x40\x00"] * 2, [[0], [0, 1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/bin/env python
+
+# Simulation of several LP5569 that share the external trigger line, as on
+# a board with many drivers on the same I2C bus.
+
+import heapq
+import functools
+import collections
+
+from lp5xxx_sim import Simulator
+
+BusEvent = collections.namedtuple("BusEvent", "time chip led pwm")
+
+
+class Bus:
+    """
+    Run M devices, each with its own image and engines. A global queue
+    holds the time of the next action of each device, so the cost follows
+    the number of actions and not the number of devices: a device that
+    waits for a trigger costs nothing until the trigger comes.
+
+    An external trigger sent by a device reaches all the other ones at the
+    same time, the sender doesn't see its own trigger.
+    """
+
+    def __init__(self, devices):
+        self.devices = list(devices)
+        self.triggers = []
+        self.now = 0
+
+        self.__queue = []
+        for n, dev in enumerate(self.devices):
+            dev.external_out = functools.partial(self.__external, n)
+            self.__schedule(n)
+
+    @classmethod
+    def from_images(cls, images, addr, **kw):
+        """
+        Build a bus of devices running the given images, with the engine
+        start addresses shared by all of them or given for each one.
+        """
+        if addr and isinstance(addr[0], int):
+            addr = [addr] * len(images)
+        return cls(Simulator(image, a, **kw) for image, a in zip(images, addr))
+
+    def run(self, until):
+        """
+        Run all the devices up to the given time, in clock cycles, and
+        yield a BusEvent for each change of a LED PWM value.
+        """
+        queue = self.__queue
+        while queue and queue[0][0] <= until:
+            t, n = heapq.heappop(queue)
+            dev = self.devices[n]
+            if dev.next_time() != t:
+                # Stale entry, the device has been woken up by a trigger
+                continue
+
+            self.now = t
+            for ev in dev.step():
+                yield BusEvent(ev.time, n, ev.led, ev.pwm)
+            self.__schedule(n)
+
+        self.now = max(self.now, until)
+
+    def external(self, t):
+        """
+        External trigger pulled by the host at time t.
+        """
+        for n, dev in enumerate(self.devices):
+            self.__wake(n, t)
+
+    def __schedule(self, n):
+        t = self.devices[n].next_time()
+        if t is not None:
+            heapq.heappush(self.__queue, (t, n))
+
+    def __wake(self, n, t):
+        dev = self.devices[n]
+        before = dev.next_time()
+        dev.external(t)
+        if dev.next_time() != before:
+            self.__schedule(n)
+
+    def __external(self, sender, t):
+        self.triggers.append((t, sender))
+        for n in range(len(self.devices)):
+            if n != sender:
+                self.__wake(n, t)
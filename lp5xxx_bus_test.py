@@ -0,0 +1,80 @@
+import unittest
+import lp5xxx_asm
+import lp5xxx_sim
+import lp5xxx_bus
+import logging
+import os
+
+from lp5xxx_bus import Bus, BusEvent
+from lp5xxx_sim import Simulator
+
+
+MASTER = """
+.segment program1
+    map_sel 1
+    set_pwm 10
+    wait 0.1
+    trigger s{e}
+    trigger w{e}
+    set_pwm 20
+    end
+"""
+
+FOLLOWER = """
+.segment program1
+    map_sel 1
+loop:
+    trigger w{{e}}
+    set_pwm 255
+    wait {wait}
+    set_pwm 0
+    branch 1, loop
+    end
+"""
+
+
+class TestBus(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+
+    def test_sync(self):
+        images = [lp5xxx_asm.assemble(MASTER)]
+        for n in range(11):
+            images.append(lp5xxx_asm.assemble(FOLLOWER.format(wait=f"{0.01 * (n + 1):g}")))
+        bus = Bus(Simulator(r.image, r.addr) for r in images)
+
+        ev = list(bus.run(lp5xxx_sim.cycles(1000)))
+        sent = 32 + round(100 / 15.625) * 512
+        self.assertEqual(bus.triggers, [(sent, 0)])
+
+        # All the followers light up together, the master doesn't see its own
+        # trigger and waits for ever
+        on = [e for e in ev if e.pwm == 255]
+        self.assertEqual(on, [BusEvent(sent, n, 0, 255) for n in range(1, 12)])
+        self.assertEqual([e for e in ev if e.chip == 0], [BusEvent(16, 0, 0, 10)])
+
+        # A second trigger from the host restarts the followers and releases
+        # the master
+        t = lp5xxx_sim.cycles(2000)
+        bus.external(t)
+        ev = list(bus.run(t + lp5xxx_sim.cycles(1000)))
+        self.assertEqual(ev[0], BusEvent(t, 0, 0, 20))
+        self.assertEqual(sorted(e.chip for e in ev if e.pwm == 255), list(range(1, 12)))
+        self.assertEqual(len(ev), 1 + 2 * 11)
+
+    def test_single(self):
+        x = lp5xxx_asm.asm_file(os.path.join(".", "src", "test2.src"), logging)
+        addr = [m['prg'] for m in x['memory']]
+        until = lp5xxx_sim.cycles(5000)
+
+        ref = list(Simulator(x['bin'], addr).run(until))
+        bus = lp5xxx_bus.Bus.from_images([x['bin']] * 3, addr)
+        ev = list(bus.run(until))
+
+        self.assertEqual(len(ev), 3 * len(ref))
+        for n in range(3):
+            self.assertEqual([(e.time, e.led, e.pwm) for e in ev if e.chip == n], [tuple(e) for e in ref])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/bin/env python
+
+# Thin client of lp5xxx_server.py: it only needs the standard library
+# modules below, so each build step doesn't pay the import of the
+# assembler.
+
+import os
+import sys
+import json
+import socket
+import tempfile
+
+
+class Client:
+    """
+    Connection to an assembler server listening on a unix socket.
+    """
+
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile('r', encoding="utf-8")
+        self.wfile = self.sock.makefile('w', encoding="utf-8")
+        self.req_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.sock.close()
+
+    def assemble(self, src, name="stdin", hex=True, c=False, post=""):
+        self.req_id += 1
+        req = {'id': self.req_id, 'name': name, 'src': src, 'hex': hex, 'c': c, 'post': post}
+        self.wfile.write(json.dumps(req) + "\n")
+        self.wfile.flush()
+
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        return json.loads(line)
+
+
+def write_if_changed(fn, data):
+    # Same behaviour of lp5xxx_asm.write_if_changed()
+    if isinstance(data, str):
+        data = data.encode()
+
+    mode = 0o644
+    try:
+        st = os.stat(fn)
+        mode = st.st_mode & 0o777
+        if st.st_size == len(data):
+            with open(fn, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except FileNotFoundError:
+        pass
+
+    path, name = os.path.split(fn)
+    fd, tmp = tempfile.mkstemp(dir=path or ".", prefix=f".{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, mode)
+        os.replace(tmp, fn)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='lp5xxx_client',
+        description='Send led engine sources to a running lp5xxx_server',
+        epilog='Writes the same outputs of lp5xxx_asm.py next to each source')
+
+    parser.add_argument('files_src', nargs='+',
+                        help='Engine Led assembly source file')
+
+    parser.add_argument('-s', '--socket', dest="socket", required=True,
+                        help="Unix socket of the server")
+
+    parser.add_argument('-c', '--c-fmt', action="store_true",
+                        dest="c_fmt_to_file",
+                        help="Generate .c and .h source file")
+
+    parser.add_argument('-b', '--bin', action="store_true",
+                        dest="bin_to_file",
+                        help="Generate raw .bin image file")
+
+    args = parser.parse_args()
+
+    errors = 0
+    with Client(args.socket) as client:
+        for fn in args.files_src:
+            with open(fn) as f:
+                src = f.read()
+
+            path, _ = os.path.split(fn)
+            name, _ = os.path.splitext(os.path.basename(fn))
+
+            res = client.assemble(src, name, c=args.c_fmt_to_file)
+            if not res['ok']:
+                print(f"{fn}: {res['error']}", file=sys.stderr)
+                errors += 1
+                continue
+
+            write_if_changed(os.path.join(path, name + ".hex"), res['hex'])
+            if args.bin_to_file:
+                write_if_changed(os.path.join(path, name + ".bin"), bytes.fromhex(res['bin']))
+            if args.c_fmt_to_file:
+                write_if_changed(os.path.join(path, name + ".c"), res['c'])
+                write_if_changed(os.path.join(path, name + ".h"), res['h'])
+
+    if errors:
+        sys.exit(1)
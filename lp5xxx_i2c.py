@@ -0,0 +1,153 @@
+#!/bin/env python
+
+# I2C upload of an assembled image to the LP5569: the list of register
+# writes, each one an I2C burst transaction, that puts the engines in load
+# mode, fills the program memory and sets the engine start addresses.
+#
+# The program memory is seen through a window of 32 registers from 50h, one
+# page of 16 words, selected by the page register just before the window:
+# so each page is a single burst, from the page register on. The image of the
+# assembler ends with the last word it placed: the pages past it are not
+# written.
+
+from lp5xxx_asm import SRAM_SIZE
+
+REG_ENGINE_CONTROL2 = 0x02
+REG_PROG_START = 0x4B
+REG_PAGE_SEL = 0x4F
+PAGE_BYTES = 32
+PAGES = SRAM_SIZE // PAGE_BYTES
+# ENGINE_CONTROL2: the three engines in load program mode
+LOAD_PROGRAM = 0b01010100
+
+SOURCE_I2C = """
+#include <<NAME>_i2c.h>
+
+/* I2C writes: register, payload length, payload */
+const uint8_t <NAME><POST>_i2c[]={
+<DATA>
+};
+
+"""
+
+HEADER_I2C = """
+#ifndef _<NAME>_I2C_H_
+#define _<NAME>_I2C_H_
+#include <sys.h>
+
+#define <UNAME><UPOST>_I2C_WRITES <WRITES>
+extern const uint8_t <NAME><POST>_i2c[<LEN>];
+
+#endif /* _<NAME>_I2C_H_ */
+
+"""
+
+
+def pages(image, addr=()):
+    """
+    Number of pages to write: up to the end of the image, or to an engine
+    start address past it. The image isn't trimmed to its last word that
+    isn't zero, as rst and dw 0 are zero words too.
+    """
+    words = len(bytes(image)[:SRAM_SIZE]) // 2
+    words = max([words] + [a + 1 for a in addr])
+    return (words * 2 + PAGE_BYTES - 1) // PAGE_BYTES
+
+
+def transactions(image, addr, load=True):
+    """
+    Register writes that upload the image and the engine start addresses,
+    as (register, payload) tuples. With load, the first one puts the
+    engines in load program mode, that the program memory needs to be
+    written; the run mode is left to the caller.
+    """
+    if len(addr) > 3:
+        raise ValueError(f"LP5569 has 3 engines, {len(addr)} start addresses given")
+
+    image = bytes(image)[:SRAM_SIZE]
+    # A program that is only rst, past the end of the image, still needs
+    # its word written
+    end = max([a * 2 + 2 for a in addr] + [0])
+    image += bytes(max(end - len(image), 0))
+
+    out = []
+    if load:
+        out.append((REG_ENGINE_CONTROL2, bytes([LOAD_PROGRAM])))
+
+    for p in range(pages(image, addr)):
+        out.append((REG_PAGE_SEL, bytes([p]) + image[p * PAGE_BYTES:(p + 1) * PAGE_BYTES]))
+
+    if addr:
+        out.append((REG_PROG_START, bytes(addr)))
+    return out
+
+
+def transactions_result(r, load=True):
+    """
+    Register writes that upload an AsmResult: its image ends with the last
+    word placed by the assembler, padded to a row of 8 words.
+    """
+    return transactions(r.image, r.addr, load)
+
+
+def bus_bytes(writes):
+    """
+    Bytes on the bus for the writes, device address and register included,
+    and for the same data written one register at a time.
+    """
+    burst = sum(2 + len(payload) for _, payload in writes)
+    single = sum(3 * len(payload) for _, payload in writes)
+    return burst, single
+
+
+def c_fmt(writes, name, post=""):
+    lines = []
+    for reg, payload in writes:
+        lines.append(", ".join([f"0x{reg:02X}", f"{len(payload)}"] + [f"0x{x:02X}" for x in payload]) + ",")
+    src = SOURCE_I2C.replace("<NAME>", name).replace("<POST>", post)
+    return src.replace("<DATA>", "\n".join(lines))
+
+
+def h_fmt(writes, name, post=""):
+    src = HEADER_I2C.replace("<NAME>", name).replace("<POST>", post)
+    src = src.replace("<UNAME>", name.upper()).replace("<UPOST>", post.upper())
+    src = src.replace("<WRITES>", f"{len(writes)}")
+    return src.replace("<LEN>", f"{sum(2 + len(p) for _, p in writes)}")
+
+
+if __name__ == "__main__":
+    import os
+    import argparse
+    import logging
+
+    from lp5xxx_asm import assemble, write_if_changed
+
+    parser = argparse.ArgumentParser(
+        prog='lp5xxx_i2c',
+        description='I2C register writes that upload led engine sources to the LP5569')
+
+    parser.add_argument('files_src', nargs='+', help='Engine Led assembly source file')
+    parser.add_argument('-c', '--c-fmt', action="store_true", dest="c_fmt_to_file",
+                        help="Write the writes in a _i2c.c and _i2c.h source file")
+    parser.add_argument('--no-load', action="store_false", dest="load",
+                        help="Don't put the engines in load program mode first")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    for fn in args.files_src:
+        with open(fn) as f:
+            r = assemble(f.read(), fn)
+        writes = transactions_result(r, args.load)
+
+        if args.c_fmt_to_file:
+            base, _ = os.path.splitext(fn)
+            name = os.path.basename(base).lower()
+            write_if_changed(base + "_i2c.c", c_fmt(writes, name))
+            write_if_changed(base + "_i2c.h", h_fmt(writes, name))
+            continue
+
+        burst, single = bus_bytes(writes)
+        print(f"{fn}: {len(writes)} writes, {burst} bytes on the bus, {single} one register at a time")
+        for reg, payload in writes:
+            print(f"  {reg:02X}: {payload.hex(' ').upper()}")
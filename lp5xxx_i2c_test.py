@@ -0,0 +1,86 @@
+import unittest
+import lp5xxx_asm
+import lp5xxx_i2c
+import logging
+
+from lp5xxx_i2c import REG_ENGINE_CONTROL2, REG_PAGE_SEL, REG_PROG_START, LOAD_PROGRAM
+
+
+def upload(writes):
+    """
+    Program memory and start addresses after the writes.
+    """
+    sram = bytearray(lp5xxx_asm.SRAM_SIZE)
+    start = None
+    for reg, payload in writes:
+        if reg == REG_PAGE_SEL:
+            page = payload[0]
+            sram[page * 32:page * 32 + len(payload) - 1] = payload[1:]
+        elif reg == REG_PROG_START:
+            start = list(payload)
+    return sram, start
+
+
+class TestI2c(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+
+    def test_sources(self):
+        for fn in ["src/test1.src", "src/labels.src", "src/alu.src"]:
+            with open(fn) as f:
+                r = lp5xxx_asm.assemble(f.read())
+            writes = lp5xxx_i2c.transactions_result(r)
+            sram, start = upload(writes)
+
+            self.assertEqual(writes[0], (REG_ENGINE_CONTROL2, bytes([LOAD_PROGRAM])))
+            self.assertEqual(bytes(sram[:len(r.image)]), bytes(r.image))
+            self.assertEqual(start, r.addr)
+            # One write for each page, and none past the image
+            self.assertEqual(len(writes), 2 + (len(r.image) + 31) // 32)
+            self.assertTrue(all(len(p) <= 33 for _, p in writes))
+
+    def test_pages(self):
+        image = bytearray(lp5xxx_asm.SRAM_SIZE)
+        image[40] = 0x9D
+        self.assertEqual(lp5xxx_i2c.pages(image[:48]), 2)
+        # Zero words at the end of the image are still written
+        self.assertEqual(lp5xxx_i2c.pages(image[:80]), 3)
+        # A program that is only rst gets its page
+        self.assertEqual(lp5xxx_i2c.pages(image[:48], [0, 1, 100]), 7)
+
+        writes = lp5xxx_i2c.transactions(image[:48], [0, 20, 100], load=False)
+        self.assertEqual([p[0] for _, p in writes[:-1]], list(range(7)))
+        self.assertEqual(writes[-1], (REG_PROG_START, bytes([0, 20, 100])))
+
+        burst, single = lp5xxx_i2c.bus_bytes(writes)
+        self.assertEqual(burst, 6 * 35 + 13 + 5)
+        self.assertEqual(single, 3 * (6 * 33 + 11 + 3))
+
+    def test_rst(self):
+        # The closing rst of program3 is alone on page 1
+        src = ".segment program1\nend\n.segment program2\nend\n.segment program3\nmap_sel 1\n" + \
+            "set_pwm 1\n" * 13 + "rst"
+        r = lp5xxx_asm.assemble(src)
+        writes = lp5xxx_i2c.transactions_result(r)
+        sram, _ = upload(writes)
+
+        self.assertEqual(len(writes), 4)
+        self.assertEqual(writes[2][1][0], 1)
+        self.assertEqual(bytes(sram[:len(r.image)]), bytes(r.image))
+
+    def test_c_fmt(self):
+        r = lp5xxx_asm.assemble(".segment program1\nmap_sel 1\nend\n.segment program2\nend\n.segment program3\nend")
+        writes = lp5xxx_i2c.transactions_result(r)
+        c = lp5xxx_i2c.c_fmt(writes, "fx")
+        h = lp5xxx_i2c.h_fmt(writes, "fx")
+
+        self.assertIn("#include <fx_i2c.h>", c)
+        self.assertIn("0x02, 1, 0x54,", c)
+        self.assertIn("0x4F, 17, 0x00, 0x9D, 0x01, 0xC0, 0x00,", c)
+        self.assertIn("0x4B, 3, 0x00, 0x02, 0x03,", c)
+        self.assertIn("#define FX_I2C_WRITES 3", h)
+        self.assertIn("extern const uint8_t fx_i2c[27];", h)
+
+
+if __name__ == '__main__':
+    unittest.main()
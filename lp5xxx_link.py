@@ -0,0 +1,371 @@
+#!/bin/env python
+
+# Linker: place the programs of several sources in one SRAM image, so the
+# firmware loads the device once and switches effect by writing the engine
+# start addresses. The mapping table rows of all the sources are merged,
+# each table stored once, also when it is a part of another one, and the
+# programs that end in end or rst and assemble to the same words are stored
+# once.
+#
+# A source refers to the labels of the other ones by name, when it doesn't
+# define it, or as unit.label; in the image every label is unit.label.
+
+import logging
+import collections
+
+from lp5xxx_asm import Instruction, AsmResult, SRAM_SIZE, parse, asm
+from lp5xxx_asm import SOURCE_TEMPLAE, SOURCE_DATA, SOURCE_DATA_ADDR, HEADER_TEMPLAE, HEADER_DATA
+from instruction_set import lookup_table
+from callbacks import show_msg
+
+ENGINES = 3
+# Operand index of the label, for the instructions that take one
+LABEL_ARG = {name: entry['label'] for name, entry in lookup_table.items() if 'label' in entry}
+
+HEADER_DATA_UNIT = """
+extern const uint8_t <NAME><POST>_addr[<LEN>];
+"""
+
+Unit = collections.namedtuple("Unit", "name memory labels")
+Unit.__doc__ = """
+A source to link: its name, and the instructions and labels of parse().
+"""
+
+
+def unit(src, name):
+    """
+    Parse a source, given as text or as lines, in a unit to link.
+    """
+    if isinstance(src, str):
+        src = src.splitlines()
+    memory, labels = parse(src, logging)
+    return Unit(name, memory, labels)
+
+
+class __Split:
+    """
+    The tables of consecutive dw rows and the segments of a unit, and where
+    each address of the unit went: ('row', table, offset) or ('seg',
+    segment, offset).
+    """
+
+    def __init__(self, u):
+        self.tables = []
+        self.segments = []
+        self.where = {}
+        last = None
+        end = 0
+        for inst in u.memory:
+            if inst.op is None:
+                continue
+            if inst.op == 'segment':
+                self.segments.append((inst, []))
+                continue
+
+            if inst.op == 'dw':
+                if last is None or last.op != 'dw' or last.addr + 1 != inst.addr:
+                    self.tables.append([])
+                self.where[inst.addr] = ('row', len(self.tables) - 1, len(self.tables[-1]))
+                self.tables[-1].append(inst)
+            elif not self.segments:
+                raise ValueError(show_msg("Error", inst, f"{u.name}: code outside a segment can't be linked"))
+            else:
+                body = self.segments[-1][1]
+                self.where[inst.addr] = ('seg', len(self.segments) - 1, len(body))
+                body.append(inst)
+            last = inst
+            end = inst.addr + 1
+
+        # Labels past the last instruction close the last segment
+        if self.segments:
+            self.where.setdefault(end, ('seg', len(self.segments) - 1, len(self.segments[-1][1])))
+
+
+def __place_rows(tables):
+    """
+    Merge the tables of rows, as tuples of values, in one list: a table
+    already in the list, or in a longer table, is stored once, and a table
+    that starts with the end of the list only adds the rest. Return the
+    rows and the offset of each table.
+    """
+    rows = []
+    offset = [None] * len(tables)
+    order = sorted(range(len(tables)), key=lambda n: -len(tables[n]))
+    for n in order:
+        t = tables[n]
+        for a in range(len(rows) - len(t) + 1):
+            if tuple(rows[a:a + len(t)]) == t:
+                offset[n] = a
+                break
+        else:
+            k = len(t)
+            while k and tuple(rows[len(rows) - k:]) != t[:k]:
+                k -= 1
+            offset[n] = len(rows) - k
+            rows.extend(t[k:])
+    return rows, offset
+
+
+def __find(placed, key):
+    """
+    Address where the program of the given key can run from the words of
+    the programs already placed, None when there is none. The program ends
+    in end or rst, so it can also run from the middle of a longer one.
+    """
+    m = len(key)
+    partial = all(x[0] != 'branch' for x in key)
+    for host, addr in placed:
+        if host == key:
+            return addr
+        if not partial:
+            continue
+        for p in range(len(host) - m + 1):
+            if host[p:p + m] == key:
+                return addr + p
+    return None
+
+
+def __falls_through(body):
+    """
+    True when the program counter can go past the last instruction of the
+    segment, in the next one.
+    """
+    if not body:
+        return True
+    last = body[-1]
+    if last.op in ('end', 'rst'):
+        return False
+    # branch 0 loops for ever
+    return not (last.op == 'branch' and last.args[:1] == ('0',))
+
+
+class LinkResult:
+    """
+    Result of link(): the SRAM image, the segment directives of all the
+    programs in address order, the labels as unit.label, and for each unit
+    the start address of its programs.
+    """
+
+    def __init__(self, name, image, memory, labels, units, words):
+        self.name = name
+        self.image = image
+        self.memory = memory
+        self.labels = labels
+        self.units = units
+        self.words = words
+
+    def engines(self, name):
+        """
+        Engine start addresses of a unit.
+        """
+        return [a for _, a in self.units[name]][:ENGINES]
+
+    def result(self, name):
+        """
+        AsmResult of the image, with the start addresses of a unit: its .hex
+        and C renderings load that effect.
+        """
+        memory = [Instruction(0, "", a, a, 'segment', (seg,)) for seg, a in self.units[name][:ENGINES]]
+        return AsmResult(name, self.image, memory, self.labels)
+
+    def c_source(self, name=None, post=""):
+        name = (name or self.name).lower()
+        image = bytes(self.image)
+        d = SOURCE_DATA.replace("<NAME>", name).replace("<POST>", post)
+        d = d.replace("<DATA>", "\n".join(",".join(f"0x{x:02X}" for x in image[i:i + 16]) + ","
+                                          for i in range(0, len(image), 16)))
+        for u in self.units:
+            d += SOURCE_DATA_ADDR.replace("<NAME>", f"{name}_{u.lower()}").replace("<POST>", post)
+            d = d.replace("<DATA>", ", ".join(f"0x{a:02X}" for a in self.engines(u)))
+        return SOURCE_TEMPLAE.replace("<NAME>", name).replace("<SRC>", d)
+
+    def c_header(self, name=None, post=""):
+        name = (name or self.name).lower()
+        d = HEADER_DATA.replace("<NAME>", name).replace("<POST>", post).replace("<BIN_LEN>", f"{len(self.image)}")
+        for u in self.units:
+            d += HEADER_DATA_UNIT.replace("<NAME>", f"{name}_{u.lower()}").replace("<POST>", post)
+            d = d.replace("<LEN>", f"{len(self.engines(u))}")
+        return HEADER_TEMPLAE.replace("<NAME>", name).replace("<SRC>", d)
+
+
+def link(units, name="link", log=logging):
+    """
+    Place the mapping table rows and the programs of the units in one
+    image. Rows go first, so the map and load instructions reach them, then
+    the programs. The segments of a unit that run or jump in the next ones
+    stay together, in source order.
+    """
+    names = [u.name for u in units]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Units with the same name: {names}")
+
+    splits = [__Split(u) for u in units]
+
+    # Rows: the same values are stored once
+    tables = []
+    for s in splits:
+        for t in s.tables:
+            tables.append(tuple(lookup_table['dw']['callback']('dw', lookup_table, {}, inst) for inst in t))
+    rows, offset = __place_rows(tables)
+    table_base = []
+    n = 0
+    for s in splits:
+        table_base.append(offset[n:n + len(s.tables)])
+        n += len(s.tables)
+
+    # Where each label is, before the programs are placed
+    owner = collections.defaultdict(list)
+    for u in units:
+        for lbl in u.labels:
+            owner[lbl].append(u.name)
+
+    def qualify(u, lbl, inst):
+        if lbl in u.labels:
+            return f"{u.name}.{lbl}"
+        if "." in lbl and lbl.split(".", 1)[0] in names:
+            un, ln = lbl.split(".", 1)
+            if ln in units[names.index(un)].labels:
+                return lbl
+        if len(owner[lbl]) == 1:
+            return f"{owner[lbl][0]}.{lbl}"
+        if owner[lbl]:
+            raise ValueError(show_msg("Error", inst, f"Label {lbl} defined in {', '.join(owner[lbl])}"))
+        raise ValueError(show_msg("Error", inst, f"No such label {lbl} in the linked units"))
+
+    def location(lbl):
+        un, ln = lbl.split(".", 1)
+        n = names.index(un)
+        return n, splits[n].where.get(units[n].labels[ln])
+
+    # Programs, as the key of each instruction: the label operand becomes the
+    # row it refers to, or the distance of the label in the same program.
+    # Segments of a unit that fall through in the next one, or that refer
+    # to a label of another one, are chained: they keep their source order
+    # and are never shared.
+    chains = []
+    for n, (u, s) in enumerate(zip(units, splits)):
+        link_next = [__falls_through(body) for _, body in s.segments]
+        progs = []
+        for k, (directive, body) in enumerate(s.segments):
+            key = []
+            code = []
+            alone = True
+            for off, inst in enumerate(body):
+                args = list(inst.args)
+                idx = LABEL_ARG.get(inst.op)
+                ref = None
+                if idx is not None and idx < len(args):
+                    args[idx] = qualify(u, args[idx], inst)
+                    ln, loc = location(args[idx])
+                    if loc is not None and loc[0] == 'row':
+                        ref = ('row', table_base[ln][loc[1]] + loc[2])
+                    elif loc is not None and ln == n and loc[1] == k:
+                        ref = ('self', loc[2] - off)
+                    else:
+                        # Refers to another program: never shared
+                        ref = ('far', n, k)
+                        alone = False
+                        if loc is not None and ln == n:
+                            for j in range(min(k, loc[1]), max(k, loc[1])):
+                                link_next[j] = True
+                key.append((inst.op, tuple(a for j, a in enumerate(inst.args) if j != idx), ref))
+                code.append((inst, tuple(args)))
+            seg = f"{u.name}.{directive.args[0] if directive.args else k}"
+            progs.append((k, seg, directive, tuple(key), code, alone))
+
+        chain = []
+        for k, p in enumerate(progs):
+            chain.append(p)
+            if k + 1 == len(progs) or not link_next[k]:
+                chains.append((n, chain))
+                chain = []
+
+    # Placement, largest chains first: the order of the chains doesn't change
+    # what they do. A program that ends in end or rst, with no label out of
+    # it, equal to one already placed, or to a part of one, takes no room.
+    # branch counts steps from the program start, so only programs without
+    # branch go in the middle of another one.
+    pc = len(rows)
+    placed = []
+    seg_addr = [[None] * len(s.segments) for s in splits]
+    memory = []
+    for n, chain in sorted(chains, key=lambda c: -sum(len(p[3]) for p in c[1])):
+        k, seg, _, key, _, alone = chain[0]
+        if len(chain) == 1 and alone and key and key[-1][0] in ('end', 'rst'):
+            addr = __find(placed, key)
+            if addr is not None:
+                seg_addr[n][k] = addr
+                log.info("%s: shares the words at %02X", seg, addr)
+                continue
+
+        start = pc
+        for k, seg, directive, key, code, _ in chain:
+            memory.append(Instruction(directive.line_no, directive.line, pc, pc, 'segment', (seg,)))
+            for off, (inst, args) in enumerate(code):
+                memory.append(Instruction(inst.line_no, inst.line, pc + off, pc, inst.op, args))
+            seg_addr[n][k] = pc
+            pc += len(code)
+        placed.append((sum((p[3] for p in chain), ()), start))
+
+    if pc > SRAM_SIZE // 2:
+        raise ValueError(f"Linked programs take {pc} words, the SRAM has {SRAM_SIZE // 2}")
+
+    # Final labels
+    labels = {}
+    for n, (u, s) in enumerate(zip(units, splits)):
+        for lbl, a in u.labels.items():
+            loc = s.where.get(a)
+            if loc is None:
+                continue
+            if loc[0] == 'row':
+                labels[f"{u.name}.{lbl}"] = table_base[n][loc[1]] + loc[2]
+            else:
+                labels[f"{u.name}.{lbl}"] = seg_addr[n][loc[1]] + loc[2]
+
+    rows_memory = [Instruction(0, f"dw {v}", a, 0, 'dw', (f"{v:016b}b",)) for a, v in enumerate(rows)]
+    image = asm(labels, rows_memory + memory, log)
+
+    units_addr = collections.OrderedDict()
+    for u, s, addr in zip(units, splits, seg_addr):
+        units_addr[u.name] = [(f"{u.name}.{d.args[0] if d.args else k}", a)
+                              for k, ((d, _), a) in enumerate(zip(s.segments, addr))]
+
+    log.info("%s: %d rows, %d words", name, len(rows), pc)
+    return LinkResult(name, image, memory, labels, units_addr, pc)
+
+
+if __name__ == "__main__":
+    import os
+    import argparse
+
+    from lp5xxx_asm import write_if_changed
+
+    parser = argparse.ArgumentParser(
+        prog='lp5xxx_link',
+        description='Link the programs of many led engine sources in one SRAM image')
+
+    parser.add_argument('files_src', nargs='+', help='Engine Led assembly source file')
+    parser.add_argument('-o', '--output', default="link",
+                        help="Name of the .c and .h files to write, default link")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    units = []
+    for fn in args.files_src:
+        with open(fn) as f:
+            units.append(unit(f.read(), os.path.splitext(os.path.basename(fn))[0]))
+
+    try:
+        r = link(units, os.path.basename(args.output))
+    except ValueError as e:
+        logging.error(f"{e}")
+        raise SystemExit(1)
+
+    write_if_changed(args.output + ".c", r.c_source())
+    write_if_changed(args.output + ".h", r.c_header())
+
+    alone = sum(1 for u in units for m in u.memory if m.op not in (None, 'segment'))
+    print(f"{r.name}: {r.words} words, {alone} assembled one by one")
+    for u in r.units:
+        print(f"  {u}: " + ", ".join(f"{a:02X}" for a in r.engines(u)))
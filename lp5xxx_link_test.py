@@ -0,0 +1,117 @@
+import unittest
+import lp5xxx_asm
+import logging
+
+from lp5xxx_sim import Simulator
+from lp5xxx_link import unit, link
+
+
+ROWS = "".join(f"m{n}: dw {1 << n}\n" for n in range(9)) + "all: dw 511\n"
+
+
+def words(u):
+    return sum(1 for m in u.memory if m.op not in (None, 'segment'))
+
+
+LEDS = [0b111, 0b111000, 0b111000000]
+
+
+def events(image, addr):
+    return list(Simulator(image, addr, LEDS).run(20 * 32768))
+
+
+class TestLink(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+
+    def test_sources(self):
+        units = []
+        for name in ["test1", "test2", "labels", "jump"]:
+            with open(f"src/{name}.src") as f:
+                units.append(unit(f.read(), name))
+        r = link(units)
+
+        alone = 0
+        for u in units:
+            a = lp5xxx_asm.asm(u.labels, u.memory, logging)
+            addr = [m.prg for m in u.memory if m.op == 'segment']
+            alone += words(u)
+            self.assertTrue(events(a, addr), u.name)
+            self.assertEqual(events(a, addr), events(r.image, r.engines(u.name)), u.name)
+
+        self.assertLess(r.words, alone)
+        self.assertEqual(len(r.engines("test1")), 3)
+        self.assertIn("const uint8_t link_test2_addr[]", r.c_source())
+        self.assertIn("extern const uint8_t link_labels_addr[3];", r.c_header())
+        self.assertIn(f"@ {r.engines('jump')[0]:02X} jump.program1", r.result("jump").hex())
+
+    def test_rows(self):
+        # The same table is stored once, as a table that is a part of it and
+        # one that overlaps its end
+        r = link([unit(ROWS + ".segment program1\nmap_addr all\nend", "a"),
+                  unit(ROWS + ".segment program1\nmap_start m0\nload_end m8\nend", "b"),
+                  unit("x: dw 4\ny: dw 8\n.segment program1\nmap_start x\nload_end y\nend", "c"),
+                  unit("p: dw 511\nq: dw 7\n.segment program1\nmap_start p\nload_end q\nend", "d")])
+
+        self.assertEqual(r.labels["a.all"], r.labels["b.all"])
+        self.assertEqual(r.labels["c.x"], r.labels["a.m2"])
+        self.assertEqual(r.labels["d.p"], r.labels["a.all"])
+        self.assertEqual(r.labels["d.q"], 10)
+        self.assertEqual(r.memory[0].addr, 11)
+
+    def test_labels(self):
+        rows = unit(ROWS, "rows")
+        a = unit(".segment program1\nmap_addr all\nload_addr rows.m1\nend", "a")
+        r = link([rows, a])
+        self.assertEqual(r.labels["rows.all"], 9)
+        self.assertEqual(r.image[20:24], bytes([0x9F, 0x89, 0x9F, 0x01]))
+
+        # Defined in two units, or in none
+        with self.assertRaises(ValueError):
+            link([rows, unit(ROWS, "rows2"), a])
+        with self.assertRaises(ValueError):
+            link([unit(".segment program1\nmap_addr none\nend", "a")])
+
+    def test_shared(self):
+        a = ".segment program1\nmap_sel 1\nloop: set_pwm 10\nwait 0.1\nset_pwm 0\nbranch 2, loop\nset_pwm 0\nend\n" \
+            ".segment program2\nset_pwm 0\nend\n.segment program3\nend"
+        b = ".segment program1\nmap_sel 2\nloop: set_pwm 10\nwait 0.1\nset_pwm 0\nbranch 2, loop\nend\n" \
+            ".segment program2\nmap_sel 1\nloop2: set_pwm 10\nwait 0.1\nset_pwm 0\nbranch 2, loop2\nset_pwm 0\nend"
+        r = link([unit(a, "a"), unit(b, "b")])
+
+        # b.program2 is a.program1, a.program2 and a.program3 its end
+        self.assertEqual(r.words, 7 + 6)
+        self.assertEqual(r.engines("b")[1], r.engines("a")[0])
+        self.assertEqual(r.engines("a")[1], r.engines("a")[0] + 5)
+        self.assertEqual(r.engines("a")[2], r.engines("a")[0] + 6)
+        self.assertEqual(events(lp5xxx_asm.assemble(a).image, lp5xxx_asm.assemble(a).addr),
+                         events(r.image, r.engines("a")))
+
+    def test_fall_through(self):
+        # program1 runs in program2, a shorter program with no end, that
+        # must still follow it after the larger program of b
+        a = ".segment program1\nset_pwm 10\nwait 0.1\n.segment program2\nset_pwm 200\nwait 0.1\nend\n" \
+            ".segment program3\nend"
+        b = ".segment program1\nset_pwm 1\nset_pwm 2\nset_pwm 3\nset_pwm 4\nset_pwm 5\nend"
+        r = link([unit(a, "a"), unit(b, "b")])
+        x = lp5xxx_asm.assemble(a)
+
+        self.assertEqual(r.engines("a")[1], r.engines("a")[0] + 2)
+        self.assertIn((3088, 0, 200), events(x.image, x.addr))
+        self.assertEqual(events(x.image, x.addr), events(r.image, r.engines("a")))
+
+    def test_jump_next(self):
+        # A forward jump to the start of the next segment, a larger one
+        a = ".segment program1\nld ra, 1\njne ra, rb, nxt\nset_pwm 5\nend\n" \
+            ".segment program2\nnxt: set_pwm 200\nwait 0.1\nset_pwm 100\nwait 0.1\nset_pwm 0\nend\n" \
+            ".segment program3\nend"
+        r = link([unit(a, "a")])
+        x = lp5xxx_asm.assemble(a)
+
+        self.assertEqual(r.labels["a.nxt"], r.engines("a")[1])
+        self.assertEqual(r.engines("a")[1], r.engines("a")[0] + 4)
+        self.assertEqual(events(x.image, x.addr), events(r.image, r.engines("a")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,535 @@
+#!/bin/env python
+
+# Peephole optimizer: a pass on the instruction list returned by parse(),
+# before asm(), that removes the words the program doesn't need. Labels are
+# then moved to the new addresses, so the jumps and the mapping table
+# references are encoded on the optimized program.
+
+import bisect
+import logging
+import collections
+
+from lp5xxx_asm import Instruction
+from instruction_set import lookup_table
+
+WAIT_MAX = lookup_table['wait']['max']
+WAIT_MIN = lookup_table['wait']['min']
+# Instructions after which the program counter never falls through
+STOP = ('end', 'rst')
+CANCEL = {'map_next': 'map_prev', 'map_prev': 'map_next'}
+# Instructions that turn the table mapping on, or off: map_next and map_prev
+# cancel out only once it is on, as they turn it on themselves
+MAP_TABLE = ('map_start', 'map_addr', 'map_next', 'map_prev')
+MAP_LEDS = ('map_sel', 'map_clr')
+# Conditional jumps and the jump on the opposite condition
+INVERT = {'jne': 'je', 'je': 'jne', 'jl': 'jge', 'jge': 'jl'}
+SKIP_MAX = lookup_table['jne']['max']
+
+# Loop rolling: branch loop count and step number ranges
+LOOP_COUNT_MAX = lookup_table['branch']['max'][0]
+LOOP_STEP_MAX = lookup_table['branch']['max'][1]
+# Instructions that can't be moved in a loop body: their word depends on
+# their address, or they leave the body
+NO_ROLL = ('branch', 'jne', 'jl', 'jge', 'je', 'end', 'rst', 'dw', 'segment')
+HASH_MOD = (1 << 61) - 1
+HASH_BASE = 1000003
+
+
+def __seconds(inst):
+    try:
+        return float(inst.args[0])
+    except (ValueError, IndexError):
+        return None
+
+
+def __ramp_to_wait(inst):
+    """
+    A ramp with 0 increments doesn't change the PWM, so it is a wait of the
+    ramp time, when it fits in a wait.
+    """
+    try:
+        t = float(inst.args[0])
+        level = int(inst.args[1])
+    except (ValueError, IndexError):
+        return inst
+
+    if level or not WAIT_MIN <= t * 1000 <= WAIT_MAX:
+        return inst
+    return Instruction(inst.line_no, f"wait {inst.args[0]}", inst.addr, inst.prg, 'wait', (inst.args[0],))
+
+
+def __merge_waits(a, b):
+    ta = __seconds(a)
+    tb = __seconds(b)
+    if ta is None or tb is None or (ta + tb) * 1000 > WAIT_MAX:
+        return None
+    t = f"{ta + tb:g}"
+    return Instruction(a.line_no, f"wait {t}", a.addr, a.prg, 'wait', (t,))
+
+
+def __never_returns(inst):
+    if inst.op in STOP:
+        return True
+    # branch 0 loops for ever
+    return inst.op == 'branch' and inst.args[:1] == ('0',)
+
+
+def optimize(memory, labels, log=logging):
+    """
+    Optimize the instructions returned by parse(). Adjacent waits are
+    merged, ramps with 0 increments become waits, map_next and map_prev
+    that cancel out are dropped, as the code that can't be reached after
+    end, rst and infinite branches. Instructions are never merged across a
+    label, so every jump still sees the same program, and map_next and
+    map_prev only when a table mapping is on before them. The PWM values don't
+    change, but the program gets faster by the time of the dropped map_next
+    and map_prev, and merged waits are rounded once instead of twice.
+
+    Return the new memory, the new labels and the words saved for each
+    segment; the input is left untouched.
+    """
+    targets = set(labels.values())
+    out = []
+    removed = []
+    saved = collections.OrderedDict()
+    segment = ""
+    # Index in out of the first instruction that can be merged with the next
+    fence = 0
+    dead = False
+    # For each instruction in out, if a table mapping is on after it; at a
+    # fence it is not known
+    table = []
+
+    def table_before(n):
+        return n > fence and table[n - 1]
+
+    for inst in memory:
+        if inst.op is None:
+            table.append(table_before(len(out)))
+            out.append(inst)
+            continue
+
+        if inst.op in ('segment', 'dw'):
+            if inst.op == 'segment':
+                segment = inst.args[0] if inst.args else ""
+                saved.setdefault(segment, 0)
+            table.append(False)
+            out.append(inst)
+            fence = len(out)
+            dead = False
+            continue
+
+        if inst.addr in targets:
+            fence = len(out)
+            dead = False
+        elif dead:
+            removed.append(inst.addr)
+            saved[segment] = saved.get(segment, 0) + 1
+            continue
+
+        if inst.op == 'ramp':
+            inst = __ramp_to_wait(inst)
+
+        prev = out[-1] if len(out) > fence else None
+        if prev is not None and inst.addr not in targets:
+            if prev.op == 'wait' and inst.op == 'wait':
+                merged = __merge_waits(prev, inst)
+                if merged is not None:
+                    out[-1] = merged
+                    removed.append(inst.addr)
+                    saved[segment] = saved.get(segment, 0) + 1
+                    continue
+
+            if CANCEL.get(prev.op) == inst.op and table_before(len(out) - 1):
+                out.pop()
+                table.pop()
+                removed.extend([prev.addr, inst.addr])
+                saved[segment] = saved.get(segment, 0) + 2
+                continue
+
+        if inst.op in MAP_TABLE:
+            table.append(True)
+        elif inst.op in MAP_LEDS:
+            table.append(False)
+        else:
+            table.append(table_before(len(out)))
+        out.append(inst)
+        dead = __never_returns(inst)
+
+    removed.sort()
+
+    def move(a):
+        return a - bisect.bisect_left(removed, a)
+
+    memory = [Instruction(m.line_no, m.line, move(m.addr), None if m.prg is None else move(m.prg), m.op, m.args)
+              for m in out]
+    labels = {k: move(a) for k, a in labels.items()}
+
+    for name, n in saved.items():
+        log.info("%s: %d words saved", name or "no segment", n)
+
+    return memory, labels, saved
+
+
+class __Runs:
+    """
+    Tandem repeats in a run of instruction keys, found with a polynomial
+    rolling hash: two slices are compared in constant time, and the longest
+    common extension of two positions with a binary search on it.
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.h = [0]
+        self.p = [1]
+        for k in keys:
+            self.h.append((self.h[-1] * HASH_BASE + k) % HASH_MOD)
+            self.p.append(self.p[-1] * HASH_BASE % HASH_MOD)
+
+    def hash(self, i, n):
+        return (self.h[i + n] - self.h[i] * self.p[n]) % HASH_MOD
+
+    def lce(self, a, b, hi):
+        """
+        Length of the common prefix of the keys from a and from b, up to hi.
+        """
+        lo, up = 0, hi - b
+        while lo < up:
+            m = (lo + up + 1) // 2
+            if self.hash(a, m) == self.hash(b, m):
+                lo = m
+            else:
+                up = m - 1
+        return lo
+
+    def best(self, i, hi):
+        """
+        Body length and repeats of the loop that saves more words at i,
+        None when no loop saves a word.
+        """
+        keys = self.keys
+        best = None
+        for n in range(1, min((hi - i) // 2, LOOP_STEP_MAX) + 1):
+            if keys[i] != keys[i + n]:
+                continue
+            k = min(1 + self.lce(i, i + n, hi) // n, LOOP_COUNT_MAX + 1)
+            if k < 2 or keys[i:i + n] * k != keys[i:i + n * k]:
+                continue
+            saving = n * (k - 1) - 1
+            if saving > 0 and (best is None or saving > best[0]):
+                best = (saving, n, k)
+        return None if best is None else best[1:]
+
+    def roll(self, lo, hi, pos):
+        """
+        Items for the keys from lo to hi, placed at word pos of the
+        segment: an index, or a (body items, repeats) loop.
+        """
+        out = []
+        i = lo
+        while i < hi:
+            best = self.best(i, hi) if pos <= LOOP_STEP_MAX else None
+            if best is None:
+                out.append(i)
+                i += 1
+                pos += 1
+                continue
+
+            n, k = best
+            body = self.roll(i, i + n, pos)
+            out.append((body, k))
+            pos += self.size(body) + 1
+            i += n * k
+        return out
+
+    @classmethod
+    def size(cls, items):
+        return sum(1 if isinstance(x, int) else cls.size(x[0]) + 1 for x in items)
+
+
+def __new_label(names, prefix):
+    n = len(names)
+    while f"{prefix}{n}" in names:
+        n += 1
+    names.add(f"{prefix}{n}")
+    return f"{prefix}{n}"
+
+
+def __place(out, labels):
+    """
+    Give an address to each (instruction, labels it defines) item, in
+    order, and to the labels with it; an item without instruction only
+    defines labels. Return the instructions, the labels and the words of
+    each segment. The labels of the source not defined by any item go past
+    the last instruction.
+    """
+    res = []
+    new_labels = {}
+    words = collections.OrderedDict()
+    addr = 0
+    prg = 0
+    segment = ""
+    for inst, lbls in out:
+        for name in lbls:
+            new_labels[name] = addr
+        if inst is None:
+            continue
+
+        if inst.op == 'segment':
+            prg = addr
+            segment = inst.args[0] if inst.args else ""
+            words.setdefault(segment, 0)
+        elif inst.op != 'dw':
+            words[segment] = words.get(segment, 0) + 1
+        res.append(Instruction(inst.line_no, inst.line, addr, prg, inst.op, inst.args))
+        if inst.op != 'segment':
+            addr += 1
+
+    for name in labels:
+        new_labels.setdefault(name, addr)
+
+    return res, new_labels, words
+
+
+def roll(memory, labels, log=logging):
+    """
+    Turn the runs of repeated instructions of the parse() output in branch
+    loops, nested when the body repeats too: a run is rolled when the loop
+    takes less words, within the loop count and step number of branch. A
+    loop never starts across a label, and the body takes no jumps; the
+    program gets slower by one branch for each repeat.
+
+    Return the new memory, the new labels and the words saved for each
+    segment; the input is left untouched.
+    """
+    defs = collections.defaultdict(list)
+    for name, a in labels.items():
+        defs[a].append(name)
+    ids = {}
+    names = set(labels)
+
+    # Output items: (instruction, labels it defines)
+    out = []
+    before = collections.OrderedDict()
+    segment = ""
+    seg_start = 0
+    segments = 0
+    run = []
+
+    def emit(items):
+        for x in items:
+            if isinstance(x, int):
+                inst = run[x]
+                # Only the first instruction of a run can have labels
+                out.append((inst, defs.get(inst.addr, []) if x == 0 else []))
+                continue
+
+            body, k = x
+            lbl = __new_label(names, "roll")
+            start = len(out)
+            emit(body)
+            # Outer loops first, after the labels of the source
+            inst, lbls = out[start]
+            n = len(defs.get(inst.addr, [])) if inst is run[0] else 0
+            out[start] = (inst, lbls[:n] + [lbl] + lbls[n:])
+            last = out[-1][0]
+            args = (str(k - 1), lbl)
+            out.append((Instruction(last.line_no, f"branch {', '.join(args)}", None, None, 'branch', args), []))
+
+    def flush():
+        if not run:
+            return
+        keys = [ids.setdefault((m.op, m.args), len(ids)) for m in run]
+        emit(__Runs(keys).roll(0, len(keys), len(out) - segments - seg_start))
+        run.clear()
+
+    for inst in memory:
+        if inst.op is None:
+            continue
+
+        if inst.op == 'segment':
+            flush()
+            segment = inst.args[0] if inst.args else ""
+            before.setdefault(segment, 0)
+            out.append((inst, []))
+            segments += 1
+            seg_start = len(out) - segments
+            continue
+
+        if inst.op != 'dw':
+            before[segment] = before.get(segment, 0) + 1
+        if inst.op in NO_ROLL:
+            flush()
+            out.append((inst, defs.get(inst.addr, [])))
+            continue
+
+        if inst.addr in defs:
+            flush()
+        run.append(inst)
+    flush()
+
+    res, new_labels, after = __place(out, labels)
+
+    saved = collections.OrderedDict((name, n - after.get(name, 0)) for name, n in before.items())
+    for name, n in saved.items():
+        log.info("%s: %d words saved", name or "no segment", n)
+
+    return res, new_labels, saved
+
+
+def relax(memory, labels, log=logging):
+    """
+    Rewrite the conditional jumps that can't be encoded, backward or more
+    than 31 instructions ahead, as the jump on the opposite condition over
+    a branch 0 to the label:
+
+        jne ra, rb, far     ->      je ra, rb, relax0
+                                    branch 0, far
+                            relax0:
+
+    Each rewrite moves the code after it, so the jumps are checked again
+    until none changes: a jump once rewritten stays so, and the passes are
+    as many as the chained rewrites, each linear in the program size.
+
+    Return the new memory, the new labels and the list of the rewritten
+    jumps, as the source instruction and the instructions in its place.
+    """
+    defs = collections.defaultdict(list)
+    for name, a in labels.items():
+        defs[a].append(name)
+
+    items = []
+    for inst in memory:
+        if inst.op is None:
+            continue
+        lbls = [] if inst.op == 'segment' else defs.pop(inst.addr, [])
+        items.append((inst, lbls))
+
+    jumps = [n for n, (inst, _) in enumerate(items) if inst.op in INVERT]
+    far = set()
+    while True:
+        # Address of each item and of each label, with the jumps in far
+        # taking two words
+        addr = []
+        at = {}
+        a = 0
+        for n, (inst, lbls) in enumerate(items):
+            addr.append(a)
+            for name in lbls:
+                at[name] = a
+            if inst.op != 'segment':
+                a += 2 if n in far else 1
+
+        grown = False
+        for n in jumps:
+            if n in far:
+                continue
+            inst = items[n][0]
+            target = at.get(inst.args[-1], a) if len(inst.args) == 3 else None
+            if target is None:
+                continue
+            skip = target - addr[n] - 1
+            if skip < 0 or skip > SKIP_MAX:
+                far.add(n)
+                grown = True
+        if not grown:
+            break
+
+    names = set(labels)
+    out = []
+    rewritten = []
+    for n, (inst, lbls) in enumerate(items):
+        if n not in far:
+            out.append((inst, lbls))
+            continue
+
+        lbl = __new_label(names, "relax")
+        jump = Instruction(inst.line_no, inst.line, None, None, INVERT[inst.op], inst.args[:2] + (lbl,))
+        branch = Instruction(inst.line_no, inst.line, None, None, 'branch', ('0', inst.args[-1]))
+        out.extend([(jump, lbls), (branch, []), (None, [lbl])])
+        rewritten.append((inst, [jump, branch]))
+        log.info("line %d: %s %s relaxed", inst.line_no, inst.op, ", ".join(inst.args))
+
+    res, new_labels, _ = __place(out, labels)
+    return res, new_labels, rewritten
+
+
+def words(memory):
+    """
+    SRAM words used by an instruction list.
+    """
+    return sum(1 for m in memory if m.op not in (None, 'segment'))
+
+
+def source(memory, labels):
+    """
+    Source lines of an instruction list, as parse() reads them back.
+    """
+    defs = collections.defaultdict(list)
+    for name, a in labels.items():
+        defs[a].append(name)
+
+    out = []
+    done = set()
+    for m in memory:
+        if m.op is None:
+            continue
+        if m.op == 'segment':
+            out.append(f".segment {' '.join(m.args)}")
+            continue
+
+        lbl = ""
+        if m.addr not in done:
+            done.add(m.addr)
+            lbl = " ".join(f"{n}:" for n in defs.get(m.addr, []))
+        out.append(f"{(lbl + ' ').ljust(8)}{m.op:<11}{', '.join(m.args)}".rstrip())
+
+    for a in sorted(defs):
+        if a not in done:
+            out.extend(f"{n}:" for n in defs[a])
+
+    return out
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from lp5xxx_asm import parse, asm
+
+    parser = argparse.ArgumentParser(
+        prog='lp5xxx_opt',
+        description='Shrink led engine sources with a peephole optimizer, and relax the far jumps')
+
+    parser.add_argument('files_src', nargs='+', help='Engine Led assembly source file')
+    parser.add_argument('-s', '--source', action="store_true",
+                        help="Print the optimized source on stdout")
+    parser.add_argument('-r', '--roll', action="store_true",
+                        help="Roll the repeated instructions in branch loops too")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    for fn in args.files_src:
+        with open(fn) as f:
+            memory, labels = parse(f.read().splitlines(), logging)
+        before = words(memory)
+        memory, labels, saved = optimize(memory, labels)
+        if args.roll:
+            memory, labels, rolled = roll(memory, labels)
+            for name, n in rolled.items():
+                saved[name] = saved.get(name, 0) + n
+        memory, labels, rewritten = relax(memory, labels)
+        after = words(memory)
+        # Check that the optimized program still assembles
+        asm(labels, memory, logging)
+
+        if args.source:
+            print("\n".join(source(memory, labels)))
+            continue
+
+        print(f"{fn}: {before} -> {after} words")
+        for name, n in saved.items():
+            print(f"  {name or 'no segment'}: {n} words saved")
+        for inst, new in rewritten:
+            print(f"  line {inst.line_no}: {inst.op} {', '.join(inst.args)} -> "
+                  + "; ".join(f"{m.op} {', '.join(m.args)}" for m in new))
@@ -0,0 +1,183 @@
+import unittest
+import lp5xxx_asm
+import lp5xxx_opt
+import logging
+
+from lp5xxx_sim import Simulator, INST_CYCLES
+
+
+SRC = """
+all: dw 0000000111111111b
+.segment program1
+loop:
+    wait 0.2
+    ramp 0.2, 0
+    map_addr all
+    map_next
+    map_next
+    map_prev
+    map_prev
+    set_pwm 10
+    branch 3, loop
+    ld ra, 1
+    ld rb, 2
+    jne ra, rb, skip
+    end
+    set_pwm 0
+    wait 0.1
+skip:
+    wait 0.2
+    wait 0.2
+    end i
+    rst
+.segment program2
+    end
+"""
+
+
+def optimize(src):
+    memory, labels = lp5xxx_asm.parse(src.splitlines(), logging)
+    return lp5xxx_opt.optimize(memory, labels)
+
+
+def events(image, addr):
+    return list(Simulator(image, addr).run(60 * 32768))
+
+
+class TestOpt(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+
+    def test_rules(self):
+        memory, labels, saved = optimize(SRC)
+
+        self.assertEqual(dict(saved), {"program1": 9, "program2": 0})
+        self.assertEqual(lp5xxx_opt.words(memory), 12)
+        self.assertEqual(labels, {"all": 0, "loop": 1, "skip": 9})
+        self.assertEqual(lp5xxx_opt.source(memory, labels)[2:10], [
+            "loop:   wait       0.4",
+            "        map_addr   all",
+            "        set_pwm    10",
+            "        branch     3, loop",
+            "        ld         ra, 1",
+            "        ld         rb, 2",
+            "        jne        ra, rb, skip",
+            "        end",
+        ])
+
+        # The optimized program runs as the original one, where a ramp with 0
+        # increments is written as a wait
+        before = lp5xxx_asm.assemble(SRC.replace("ramp 0.2, 0", "wait 0.2"))
+        after = lp5xxx_asm.asm(labels, memory, logging)
+        ev = events(before.image, before.addr)
+        opt = events(after, [1, 11])
+        self.assertEqual([e[1:] for e in ev], [e[1:] for e in opt])
+        # Less the time of the map_next and map_prev dropped
+        self.assertEqual(ev[0].time - opt[0].time, 4 * INST_CYCLES)
+        self.assertEqual([m.line for m in memory if m.op == "wait"][0], "wait 0.4")
+
+        # map_next turns the table mapping on after map_sel, or at a label
+        for src in ["map_sel 1\nmap_next\nmap_prev", "map_addr all\nl: map_next\nmap_prev"]:
+            _, _, saved = optimize(f"all: dw 511\n.segment program1\n{src}\nend")
+            self.assertEqual(saved["program1"], 0, src)
+
+    def test_labels(self):
+        # Nothing is merged across a label
+        src = ".segment program1\nwait 0.1\nl1: wait 0.1\nmap_next\nl2: map_prev\nend\nl3: end"
+        memory, labels, saved = optimize(src)
+        self.assertEqual(saved["program1"], 0)
+        self.assertEqual(labels, {"l1": 1, "l2": 3, "l3": 5})
+
+        # Long waits are not merged
+        memory, _, saved = optimize(".segment program1\nwait 0.3\nwait 0.3\nend")
+        self.assertEqual(saved["program1"], 0)
+
+    def test_sources(self):
+        for fn in ["src/labels.src", "src/test1.src", "src/jump.src"]:
+            with open(fn) as f:
+                src = f.read()
+            memory, labels, _ = optimize(src)
+            r = lp5xxx_asm.assemble(lp5xxx_opt.source(memory, labels))
+            self.assertEqual(r.image, lp5xxx_asm.asm(labels, memory, logging))
+
+    def test_roll(self):
+        chase = "set_pwm 50\nmap_next\n" * 3 + "wait 0.1\n"
+        src = ".segment program1\nmap_addr all\nmap_start m0\nload_end m8\n" + chase * 4 + "end"
+        rows = "".join(f"m{n}: dw {1 << n}\n" for n in range(9)) + "all: dw 511\n"
+        memory, labels = lp5xxx_asm.parse((rows + src).splitlines(), logging)
+        memory, labels, saved = lp5xxx_opt.roll(memory, labels)
+
+        # Nested loops: 5 words for 4 x 7 words
+        self.assertEqual(saved["program1"], 28 - 5)
+        self.assertEqual(lp5xxx_opt.source(memory, labels)[10:], [
+            ".segment program1",
+            "        map_addr   all",
+            "        map_start  m0",
+            "        load_end   m8",
+            "roll10: roll11: set_pwm    50",
+            "        map_next",
+            "        branch     2, roll11",
+            "        wait       0.1",
+            "        branch     3, roll10",
+            "        end",
+        ])
+
+        before = lp5xxx_asm.assemble(rows + src)
+        after = lp5xxx_asm.asm(labels, memory, logging)
+        ev = events(before.image, before.addr)
+        opt = events(after, [10, 19])
+        self.assertEqual([e[1:] for e in ev], [e[1:] for e in opt])
+
+    def test_roll_limits(self):
+        # Labels split the runs, long runs take more loops
+        src = ".segment program1\n" + "map_next\n" * 3 + "l1: " + "map_next\n" * 130 + "end"
+        memory, labels, saved = lp5xxx_opt.roll(*lp5xxx_asm.parse(src.splitlines(), logging))
+        lines = lp5xxx_opt.source(memory, labels)
+        self.assertEqual([x.split()[-2:] for x in lines if "branch" in x],
+                         [["2,", "roll1"], ["63,", "roll2"]])
+        self.assertEqual(lines[3], "l1: roll2: map_next")
+        self.assertEqual(saved["program1"], 133 - 7)
+        lp5xxx_asm.asm(labels, memory, logging)
+
+        # No loop starts past the reach of branch
+        src = ".segment program1\n" + "".join(f"set_pwm {n % 256}\n" for n in range(130)) + "map_next\n" * 4
+        memory, labels, saved = lp5xxx_opt.roll(*lp5xxx_asm.parse(src.splitlines(), logging))
+        self.assertEqual(saved["program1"], 0)
+
+    def test_roll_large(self):
+        # A long unrolled effect, rolled in a few words
+        body = "".join(f"set_pwm {n}\nwait 0.01\n" for n in range(0, 200, 40))
+        src = ".segment program1\nmap_sel 1\n" + body * 1000 + "end"
+        memory, labels, saved = lp5xxx_opt.roll(*lp5xxx_asm.parse(src.splitlines(), logging))
+        self.assertLess(lp5xxx_opt.words(memory), 30)
+        lp5xxx_asm.asm(labels, memory, logging)
+
+    def test_relax(self):
+        # A far jump, one that gets too far when the first one grows, and a
+        # backward one
+        src = (".segment program1\nmap_sel 1\nld ra, 5\nld rb, 3\nback: set_pwm 10\nsub ra, 1\n"
+               "jge ra, rb, near\njl ra, rb, done\n" + "wait 0.001\n" * 30
+               + "near: set_pwm 20\njne ra, rb, back\ndone: set_pwm 30\nend")
+        memory, labels = lp5xxx_asm.parse(src.splitlines(), logging)
+        memory, labels, rewritten = lp5xxx_opt.relax(memory, labels)
+
+        self.assertEqual([(m.op, [(n.op, n.args) for n in new]) for m, new in rewritten], [
+            ("jge", [("jl", ("ra", "rb", "relax3")), ("branch", ("0", "near"))]),
+            ("jl", [("jge", ("ra", "rb", "relax4")), ("branch", ("0", "done"))]),
+            ("jne", [("je", ("ra", "rb", "relax5")), ("branch", ("0", "back"))]),
+        ])
+        self.assertEqual(labels["relax3"], labels["back"] + 4)
+        self.assertEqual(labels["near"], labels["relax4"] + 30)
+
+        image = lp5xxx_asm.asm(labels, memory, logging)
+        ev = events(image, [0, 0, 0])
+        self.assertEqual([e.pwm for e in ev], [10, 20, 10, 20, 30])
+
+        # A jump in range is left as it is
+        _, _, rewritten = lp5xxx_opt.relax(*lp5xxx_asm.parse(
+            ".segment program1\njne ra, rb, l1\nmap_next\nl1: end".splitlines(), logging))
+        self.assertEqual(rewritten, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
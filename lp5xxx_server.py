@@ -0,0 +1,146 @@
+#!/bin/env python
+
+import io
+import os
+import sys
+import json
+import stat
+import logging
+import socketserver
+
+from lp5xxx_asm import assemble
+
+
+def handle(req, log):
+    """
+    Assemble the source of one request and return the response:
+
+    request:  {"id": .., "name": "effect", "src": "<source text>",
+               "hex": true, "c": false, "post": ""}
+    response: {"id": .., "ok": true, "bin": "<image hex>",
+               "segments": [[addr, "program1"], ..], "labels": {..},
+               "hex": "<.hex file>", "c": "<.c file>", "h": "<.h file>"}
+    or        {"id": .., "ok": false, "error": "<message>"}
+    """
+    if not isinstance(req, dict):
+        return {'id': None, 'ok': False, 'error': "Bad request: request should be a json object"}
+
+    res = {'id': req.get('id'), 'ok': False}
+    try:
+        name = req.get('name', "stdin")
+        if not isinstance(name, str):
+            raise ValueError("name should be a string")
+        src = req['src']
+        if not isinstance(src, str):
+            raise ValueError("src should be the source text")
+
+        result = assemble(src, name, log)
+        out = {'bin': result.image.hex(),
+               'segments': [list(s) for s in result.segments],
+               'labels': result.labels}
+
+        if req.get('hex', True):
+            out['hex'] = result.hex()
+
+        if req.get('c', False):
+            post = req.get('post', "")
+            if not isinstance(post, str):
+                raise ValueError("post should be a string")
+            out['c'] = result.c_source(post=post)
+            out['h'] = result.c_header(post=post)
+    except KeyError as e:
+        res['error'] = f"Missing request field {e}"
+        return res
+    except ValueError as e:
+        res['error'] = f"{e}"
+        return res
+    except Exception as e:
+        # A bad request must never stop the server: the next ones still
+        # get their answer
+        log.exception("Request %s failed", res['id'])
+        res['error'] = f"Internal error: {type(e).__name__}: {e}"
+        return res
+
+    res['ok'] = True
+    res.update(out)
+    return res
+
+
+def serve_lines(fin, fout, log):
+    """
+    Answer one json request per line until the input is closed.
+    """
+    for line in fin:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            req = json.loads(line)
+        except ValueError as e:
+            res = {'id': None, 'ok': False, 'error': f"Bad request: {e}"}
+        else:
+            res = handle(req, log)
+
+        fout.write(json.dumps(res) + "\n")
+        fout.flush()
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        fin = io.TextIOWrapper(self.rfile, encoding="utf-8")
+        fout = io.TextIOWrapper(self.wfile, encoding="utf-8")
+        try:
+            serve_lines(fin, fout, logging)
+        finally:
+            # The socket files are closed by the request handler
+            fin.detach()
+            fout.detach()
+
+
+def serve_socket(path):
+    # Only a stale socket is replaced, never a file given by mistake
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise ValueError(f"{path} exists and is not a socket")
+        os.unlink(path)
+
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='lp5xxx_server',
+        description='Long running ASM for Texas led driver LP55xx ic',
+        epilog='Reads json requests, one for each line, from stdin or from a unix socket')
+
+    parser.add_argument('-s', '--socket', dest="socket", default=None,
+                        help="Listen on this unix socket instead of stdin/stdout")
+
+    parser.add_argument('-v', '--verbose', dest="verbose", action="store_true",
+                        default=False, help="Verbose")
+
+    args = parser.parse_args()
+
+    level = logging.WARNING
+    if args.verbose:
+        level = logging.DEBUG
+    logging.basicConfig(level=level, format='%(asctime)s [%(levelname)s]: %(message)s')
+
+    try:
+        if args.socket is not None:
+            serve_socket(args.socket)
+        else:
+            serve_lines(sys.stdin, sys.stdout, logging)
+    except ValueError as e:
+        logging.error(f"{e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
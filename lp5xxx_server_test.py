@@ -0,0 +1,99 @@
+import unittest
+import lp5xxx_asm
+import lp5xxx_server
+import lp5xxx_client
+import socketserver
+import threading
+import tempfile
+import logging
+import json
+import io
+import os
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+
+    def __src(self, name):
+        with open(os.path.join(".", "src", name)) as f:
+            return f.read()
+
+    def test_handle(self):
+        x = lp5xxx_asm.asm_file(os.path.join(".", "src", "test2.src"), logging)
+        res = lp5xxx_server.handle({'id': 7, 'name': "test2", 'src': self.__src("test2.src"), 'c': True}, logging)
+
+        self.assertTrue(res['ok'])
+        self.assertEqual(res['id'], 7)
+        self.assertEqual(bytes.fromhex(res['bin']), bytes(x['bin']))
+        self.assertEqual(res['segments'], [[0x0A, "program1"], [0x12, "program2"], [0x20, "program3"]])
+        self.assertEqual(res['labels'], x['labels'])
+        self.assertEqual(res['hex'], "\n".join(lp5xxx_asm.hex_fmt(x['bin'], x['memory'])))
+        self.assertEqual(res['c'], lp5xxx_asm.c_fmt([x], "test2"))
+        self.assertEqual(res['h'], lp5xxx_asm.h_fmt([x], "test2"))
+
+    def test_lines(self):
+        fin = io.StringIO("\n".join([
+            json.dumps({'id': 1, 'src': "set_pwm 10\nend"}),
+            "",
+            json.dumps({'id': 2, 'src': "set_pwm 300"}),
+            "[1, 2]",
+            json.dumps({'id': 3}),
+        ]))
+        fout = io.StringIO()
+        lp5xxx_server.serve_lines(fin, fout, logging)
+
+        res = [json.loads(r) for r in fout.getvalue().splitlines()]
+        self.assertEqual([r['id'] for r in res], [1, 2, None, 3])
+        self.assertEqual([r['ok'] for r in res], [True, False, False, False])
+        self.assertEqual(res[0]['bin'][:8], "400ac000")
+
+    def test_bad_requests(self):
+        fin = io.StringIO("\n".join([
+            json.dumps({'id': 1, 'src': "ramp 1,foo"}),
+            json.dumps({'id': 2, 'name': 5, 'c': True, 'src': "end"}),
+            "[1, 2]",
+            "5",
+            json.dumps({'id': 3, 'src': "set_pwm 10\nend"}),
+        ]))
+        fout = io.StringIO()
+        logging.disable(logging.CRITICAL)
+        try:
+            lp5xxx_server.serve_lines(fin, fout, logging)
+        finally:
+            logging.disable(logging.NOTSET)
+
+        res = [json.loads(r) for r in fout.getvalue().splitlines()]
+        self.assertEqual([r['id'] for r in res], [1, 2, None, None, 3])
+        self.assertEqual([r['ok'] for r in res], [False, False, False, False, True])
+        self.assertEqual(lp5xxx_server.handle([1, 2], logging)['ok'], False)
+
+    def test_socket_path(self):
+        # A file that isn't a socket is never removed
+        with tempfile.TemporaryDirectory() as path:
+            fn = os.path.join(path, "asm.sock")
+            with open(fn, "w") as f:
+                f.write("data")
+            with self.assertRaises(ValueError):
+                lp5xxx_server.serve_socket(fn)
+            self.assertTrue(os.path.isfile(fn))
+
+    def test_socket(self):
+        with tempfile.TemporaryDirectory() as path:
+            sock = os.path.join(path, "asm.sock")
+            server = socketserver.ThreadingUnixStreamServer(sock, lp5xxx_server.Handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                with lp5xxx_client.Client(sock) as client:
+                    for name in ["labels", "alu", "jump"]:
+                        res = client.assemble(self.__src(name + ".src"), name)
+                        x = lp5xxx_asm.asm_file(os.path.join(".", "src", name + ".src"), logging)
+                        self.assertEqual(res['hex'], "\n".join(lp5xxx_asm.hex_fmt(x['bin'], x['memory'])))
+            finally:
+                server.shutdown()
+                server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,423 @@
+#!/bin/env python
+
+# Event driven simulator of the three LP5569 program engines. Time is
+# counted in cycles of the 32768 Hz clock, but the simulator never walks the
+# single cycles: each engine tells when its next action happens (end of an
+# instruction, next ramp step, end of a wait) and the simulation jumps from
+# one action to the next one.
+
+import heapq
+import collections
+
+from lp5xxx_asm import WORD, SRAM_SIZE, decode_table
+
+CLOCK_HZ = 32768
+# Every instruction takes 16 clock cycles, waits and ramps are counted in
+# units of the prescale: 16 cycles (0.488 ms) or 512 cycles (15.625 ms)
+INST_CYCLES = 16
+PRESCALE_CYCLES = (16, 512)
+
+LEDS = 9
+ENGINES = 3
+PWM_MAX = 255
+
+# Trigger bits of the trigger instruction
+TRIG_SEND = (1 << 1, 1 << 2, 1 << 3)
+TRIG_SEND_EXT = 1 << 6
+TRIG_WAIT = (1 << 7, 1 << 8, 1 << 9)
+TRIG_WAIT_EXT = 1 << 12
+
+PwmEvent = collections.namedtuple("PwmEvent", "time led pwm")
+
+
+def cycles(ms):
+    """
+    Clock cycles elapsed in the given time in ms.
+    """
+    return round(ms * CLOCK_HZ / 1000)
+
+
+def ms(cycles):
+    return cycles * 1000 / CLOCK_HZ
+
+
+class Engine:
+    """
+    State of one program engine.
+    """
+    __slots__ = ("n", "start", "pc", "pwm", "var", "leds", "map_start", "map_end", "index",
+                 "loops", "ramp_left", "ramp_step", "ramp_sign", "pending", "wait_mask", "wait_time",
+                 "running")
+
+    def __init__(self, n, start, leds=0):
+        self.n = n
+        self.start = start
+        self.pc = start
+        self.pwm = 0
+        # Local variables A and B
+        self.var = [0, 0]
+        # LEDs driven by the engine, as a bit mask
+        self.leds = leds
+        self.map_start = 0
+        self.map_end = 0
+        self.index = 0
+        # branch address -> loops left
+        self.loops = {}
+        self.ramp_left = 0
+        self.ramp_step = 0
+        self.ramp_sign = 1
+        # Received triggers, with the bits of the wait field
+        self.pending = 0
+        self.wait_mask = 0
+        self.wait_time = None
+        self.running = True
+
+
+class Simulator:
+    """
+    Run the program engines of one LP5569 on an image built by asm(),
+    starting each engine at one of the given segment addresses.
+
+    leds is, for each engine, the mask of the LEDs driven by the engine
+    when no mapping is active (the LEDx_CONTROL setting), var_d the global
+    variable D written over I2C.
+    """
+
+    def __init__(self, image, addr, leds=None, var_d=0):
+        if len(addr) > ENGINES:
+            raise ValueError(f"LP5569 has {ENGINES} engines, {len(addr)} given")
+
+        image = bytes(image)[:SRAM_SIZE]
+        image += bytes(SRAM_SIZE - len(image))
+        self.memory = [w for w, in WORD.iter_unpack(image)]
+
+        table = decode_table()
+        self.code = [table[w] for w in self.memory]
+
+        if leds is None:
+            leds = [0] * len(addr)
+        self.engines = [Engine(n, a, leds[n]) for n, a in enumerate(addr)]
+
+        self.pwm = [0] * LEDS
+        self.var_c = 0
+        self.var_d = var_d
+        self.now = 0
+        self.interrupts = []
+        # Called with the time of each external trigger sent by an engine
+        self.external_out = None
+
+        self.__queue = [(0, e.n) for e in self.engines]
+        self.__out = []
+        self.__exec = {
+            'ramp': self.__ramp,
+            'wait': self.__wait,
+            'set_pwm': self.__set_pwm,
+            'rst': self.__rst,
+            'end': self.__end,
+            'int': self.__int,
+            'branch': self.__branch,
+            'trigger': self.__trigger,
+            'trig_clear': self.__trig_clear,
+            'jne': self.__jump,
+            'jl': self.__jump,
+            'jge': self.__jump,
+            'je': self.__jump,
+            'ld': self.__ld,
+            'add': self.__alu,
+            'sub': self.__alu,
+            'load_start': self.__mapping,
+            'map_start': self.__mapping,
+            'load_end': self.__mapping,
+            'map_sel': self.__mapping,
+            'map_clr': self.__mapping,
+            'map_next': self.__mapping,
+            'map_prev': self.__mapping,
+            'load_next': self.__mapping,
+            'load_prev': self.__mapping,
+            'load_addr': self.__mapping,
+            'map_addr': self.__mapping,
+        }
+
+    def run(self, until):
+        """
+        Run the engines up to the given time, in clock cycles, and yield a
+        PwmEvent for each change of a LED PWM value.
+        """
+        queue = self.__queue
+        while queue and queue[0][0] <= until:
+            yield from self.step()
+
+        self.now = max(self.now, until)
+
+    def step(self):
+        """
+        Run the next engine action and return the PwmEvents it produced.
+        """
+        t, n = heapq.heappop(self.__queue)
+        self.now = t
+        step = self.__step(self.engines[n], t)
+        if step is not None:
+            heapq.heappush(self.__queue, (t + step, n))
+
+        out, self.__out = self.__out, []
+        return out
+
+    def next_time(self):
+        """
+        Time of the next engine action, None when all the engines are
+        stopped or waiting for a trigger.
+        """
+        return self.__queue[0][0] if self.__queue else None
+
+    def external(self, t):
+        """
+        External trigger received at time t by all the engines.
+        """
+        for e in self.engines:
+            e.pending |= TRIG_WAIT_EXT
+            self.__wake(e, t)
+
+    def __get(self, e, v):
+        if v < 2:
+            return e.var[v]
+        return self.var_c if v == 2 else self.var_d
+
+    def __set(self, e, v, value):
+        value &= 0xFF
+        if v < 2:
+            e.var[v] = value
+        elif v == 2:
+            self.var_c = value
+        else:
+            self.var_d = value
+
+    def __push(self, e, t):
+        """
+        Write the engine PWM to the LEDs it drives.
+        """
+        for led in range(LEDS):
+            if e.leds & (1 << led) and self.pwm[led] != e.pwm:
+                self.pwm[led] = e.pwm
+                self.__out.append(PwmEvent(t, led, e.pwm))
+
+    def __wake(self, e, t):
+        if e.wait_time is None or e.pending & e.wait_mask != e.wait_mask:
+            return
+        e.pending &= ~e.wait_mask
+        heapq.heappush(self.__queue, (max(t, e.wait_time + INST_CYCLES), e.n))
+        e.wait_time = None
+
+    def __step(self, e, t):
+        """
+        Run the next action of the engine at time t and return the cycles to
+        the following one, None when the engine stops or waits.
+        """
+        if e.ramp_left:
+            e.pwm = min(max(e.pwm + e.ramp_sign, 0), PWM_MAX)
+            self.__push(e, t)
+            e.ramp_left -= 1
+            if e.ramp_left:
+                return e.ramp_step
+
+        if e.pc >= len(self.code):
+            raise ValueError(f"Engine {e.n + 1} runs out of SRAM")
+
+        inst = self.code[e.pc]
+        if inst is None:
+            raise ValueError(f"Engine {e.n + 1}: invalid instruction word {self.memory[e.pc]:04X} at {e.pc:02X}")
+
+        name, opk, _ = inst
+        w = self.memory[e.pc]
+        addr = e.pc
+        e.pc += 1
+        return self.__exec[name](e, t, name, opk, w, addr)
+
+    def __ramp(self, e, t, name, opk, w, addr):
+        if opk == 'opv':
+            prescale = (w >> 5) & 1
+            sign = (w >> 4) & 1
+            step = self.__get(e, (w >> 2) & 3)
+            level = self.__get(e, w & 3)
+        else:
+            prescale = (w >> 14) & 1
+            step = (w >> 9) & 0x1F
+            sign = (w >> 8) & 1
+            level = w & 0xFF
+
+        # Step time 0 changes the output once for each prescale cycle
+        step = max(step, 1) * PRESCALE_CYCLES[prescale]
+        if not level:
+            return step
+
+        e.ramp_left = level
+        e.ramp_step = step
+        e.ramp_sign = -1 if sign else 1
+        return step
+
+    def __wait(self, e, t, name, opk, w, addr):
+        return ((w >> 9) & 0x1F) * PRESCALE_CYCLES[(w >> 14) & 1]
+
+    def __set_pwm(self, e, t, name, opk, w, addr):
+        e.pwm = self.__get(e, w & 3) if opk == 'opv' else w & 0xFF
+        self.__push(e, t)
+        return INST_CYCLES
+
+    def __rst(self, e, t, name, opk, w, addr):
+        e.pc = e.start
+        return INST_CYCLES
+
+    def __end(self, e, t, name, opk, w, addr):
+        if w & (1 << 11):
+            saved = e.pwm
+            e.pwm = 0
+            self.__push(e, t)
+            e.pwm = saved
+        if w & (1 << 12):
+            self.interrupts.append((t, e.n))
+        e.pc = e.start
+        e.running = False
+        return None
+
+    def __int(self, e, t, name, opk, w, addr):
+        self.interrupts.append((t, e.n))
+        return INST_CYCLES
+
+    def __branch(self, e, t, name, opk, w, addr):
+        if opk == 'opv':
+            count = self.__get(e, w & 3)
+            target = e.start + ((w >> 2) & 0x7F)
+        else:
+            count = (w >> 7) & 0x3F
+            target = e.start + (w & 0x7F)
+
+        # Loop count 0 is an infinite loop, otherwise the body is repeated
+        # count times after the first pass
+        if count:
+            left = e.loops.get(addr, count)
+            if not left:
+                e.loops.pop(addr, None)
+                return INST_CYCLES
+            e.loops[addr] = left - 1
+
+        e.pc = target
+        return INST_CYCLES
+
+    def __trigger(self, e, t, name, opk, w, addr):
+        for n, bit in enumerate(TRIG_SEND):
+            if w & bit and n < len(self.engines):
+                target = self.engines[n]
+                target.pending |= TRIG_WAIT[e.n]
+                self.__wake(target, t)
+        if w & TRIG_SEND_EXT and self.external_out is not None:
+            self.external_out(t)
+
+        mask = w & (TRIG_WAIT[0] | TRIG_WAIT[1] | TRIG_WAIT[2] | TRIG_WAIT_EXT)
+        if not mask:
+            return INST_CYCLES
+
+        e.wait_mask = mask
+        e.wait_time = t
+        if e.pending & mask == mask:
+            e.pending &= ~mask
+            e.wait_time = None
+            return INST_CYCLES
+        return None
+
+    def __trig_clear(self, e, t, name, opk, w, addr):
+        e.pending = 0
+        return INST_CYCLES
+
+    def __jump(self, e, t, name, opk, w, addr):
+        v1 = self.__get(e, (w >> 2) & 3)
+        v2 = self.__get(e, w & 3)
+        cond = {
+            'jne': v1 != v2,
+            'jl': v1 < v2,
+            'jge': v1 >= v2,
+            'je': v1 == v2,
+        }[name]
+        if cond:
+            e.pc += (w >> 4) & 0x1F
+        return INST_CYCLES
+
+    def __ld(self, e, t, name, opk, w, addr):
+        self.__set(e, (w >> 10) & 3, w & 0xFF)
+        return INST_CYCLES
+
+    def __alu(self, e, t, name, opk, w, addr):
+        target = (w >> 10) & 3
+        if opk == 'opv':
+            v1 = self.__get(e, (w >> 2) & 3)
+            v2 = self.__get(e, w & 3)
+        else:
+            v1 = self.__get(e, target)
+            v2 = w & 0xFF
+        self.__set(e, target, v1 + v2 if name == 'add' else v1 - v2)
+        return INST_CYCLES
+
+    def __mapping(self, e, t, name, opk, w, addr):
+        a = w & 0x7F
+        if name in ['map_start', 'load_start']:
+            e.map_start = a
+            e.index = a
+        elif name == 'load_end':
+            e.map_end = a
+        elif name in ['map_addr', 'load_addr']:
+            e.index = a
+        elif name in ['map_next', 'load_next']:
+            e.index = e.index + 1 if e.index < e.map_end else e.map_start
+        elif name in ['map_prev', 'load_prev']:
+            e.index = e.index - 1 if e.index > e.map_start else e.map_end
+        elif name == 'map_sel':
+            e.leds = 1 << (a - 1) if 1 <= a <= LEDS else 0
+        elif name == 'map_clr':
+            e.leds = 0
+
+        if name in ['map_start', 'map_addr', 'map_next', 'map_prev']:
+            e.leds = self.memory[e.index] & ((1 << LEDS) - 1)
+        return INST_CYCLES
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    from lp5xxx_asm import assemble
+
+    parser = argparse.ArgumentParser(
+        prog='lp5xxx_sim',
+        description='Simulate the engines of a LP5569 running a led engine source',
+        epilog='Prints one line for each change of a LED PWM value: time in ms, LED, PWM')
+
+    parser.add_argument('file_src', help='Engine Led assembly source file')
+
+    parser.add_argument('-t', '--time', dest="time", type=float, default=1000,
+                        help="Simulated time in ms")
+
+    parser.add_argument('-l', '--leds', dest="leds", default="1,2,4",
+                        help="LED mask of each engine when no mapping is active, comma separated, "
+                             "default 1,2,4: engine N drives LED N-1")
+
+    parser.add_argument('-o', '--trace', dest="trace", default=None,
+                        help="Write the PWM changes in a binary trace file instead of printing them")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    try:
+        leds = [int(x, 0) for x in args.leds.split(",")]
+    except ValueError:
+        parser.error(f"--leds should be LED masks separated by commas, not {args.leds}")
+
+    with open(args.file_src) as f:
+        r = assemble(f.read(), args.file_src)
+
+    leds = (leds + [0] * len(r.addr))[:len(r.addr)]
+    sim = Simulator(r.image, r.addr, leds)
+    if args.trace is not None:
+        from lp5xxx_trace import write_trace
+
+        write_trace(args.trace, sim.run(cycles(args.time)))
+    else:
+        for ev in sim.run(cycles(args.time)):
+            print(f"{ms(ev.time):10.3f} LED{ev.led} {ev.pwm}")
@@ -0,0 +1,115 @@
+import unittest
+import lp5xxx_asm
+import lp5xxx_sim
+import logging
+import os
+
+from lp5xxx_sim import PwmEvent, Simulator, INST_CYCLES
+
+
+def program(*segments, rows=""):
+    src = [rows]
+    for n, body in enumerate(segments):
+        src.append(f".segment program{n + 1}\n{body}")
+    return lp5xxx_asm.assemble("\n".join(src))
+
+
+class TestSim(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+
+    def __run(self, r, until, **kw):
+        sim = Simulator(r.image, r.addr, **kw)
+        return sim, list(sim.run(until))
+
+    def test_set_pwm(self):
+        r = program("map_sel 1\nset_pwm 10\nwait 0.1\nset_pwm 20\nend")
+        sim, ev = self.__run(r, 100000)
+
+        wait = round(100 / 15.625) * 512
+        self.assertEqual(ev, [PwmEvent(16, 0, 10), PwmEvent(32 + wait, 0, 20)])
+        self.assertEqual(sim.pwm[:2], [20, 0])
+        self.assertIsNone(sim.next_time())
+
+    def test_ramp(self):
+        r = program("map_sel 2\nset_pwm 100\nramp 0.1, -10\nset_pwm 0\nend")
+        step = lp5xxx_sim.PRESCALE_CYCLES[0] * round(100 / 10 / 0.488)
+        sim, ev = self.__run(r, 100000)
+
+        self.assertEqual(ev[0], PwmEvent(16, 1, 100))
+        self.assertEqual(ev[1:11], [PwmEvent(32 + k * step, 1, 100 - k) for k in range(1, 11)])
+        self.assertEqual(ev[11], PwmEvent(32 + 10 * step, 1, 0))
+
+    def test_time_skip(self):
+        # One hour of a slow blink costs a handful of events per period
+        r = program("map_sel 1\nloop: set_pwm 255\nwait 0.4\nset_pwm 0\nwait 0.4\nbranch 0, loop")
+        hour = lp5xxx_sim.cycles(3600 * 1000)
+        sim, ev = self.__run(r, hour)
+
+        period = 2 * INST_CYCLES + 2 * round(400 / 15.625) * 512 + INST_CYCLES
+        self.assertEqual(len(ev), 2 * ((hour - 16) // period + 1))
+        self.assertEqual(sim.now, hour)
+
+    def test_branch(self):
+        r = program("map_sel 1\nld ra, 0\nloop: add ra, 1\nset_pwm ra\nbranch 3, loop\n"
+                    "outer: set_pwm 0\ninner: set_pwm 1\nbranch 1, inner\nbranch 2, outer\nend")
+        sim, ev = self.__run(r, 100000)
+
+        # The body runs once, then the branch jumps back 3 times
+        self.assertEqual([e.pwm for e in ev], [1, 2, 3, 4] + [0, 1] * 3)
+        self.assertEqual(sim.engines[0].var[0], 4)
+
+    def test_jump(self):
+        r = program("map_sel 1\nld ra, 5\nld rb, 7\njl ra, rb, less\nset_pwm 1\n"
+                    "less: jge ra, rb, ge\nset_pwm 2\nge: je ra, ra, eq\nset_pwm 3\n"
+                    "eq: jne ra, ra, ne\nset_pwm 4\nne: sub rb, rb, ra\nset_pwm rb\nend")
+        sim, ev = self.__run(r, 100000)
+
+        self.assertEqual([e.pwm for e in ev], [2, 4, 2])
+        self.assertEqual(sim.engines[0].var, [5, 2])
+
+    def test_mapping(self):
+        rows = "r0: dw 0000000000000011b\nr1: dw 0000000000000100b\nr2: dw 0000000000001000b\n"
+        r = program("map_start r0\nload_end r2\nset_pwm 10\nmap_next\nset_pwm 20\nmap_next\nmap_next\n"
+                    "set_pwm 30\nmap_prev\nmap_prev\nset_pwm 40\nload_next\nset_pwm 50\nmap_clr\nset_pwm 60\nend",
+                    rows=rows)
+        sim, ev = self.__run(r, 100000)
+
+        # map_next and map_prev roll over, load_next keeps the LEDs mapped
+        self.assertEqual([(e.led, e.pwm) for e in ev],
+                         [(0, 10), (1, 10), (2, 20), (0, 30), (1, 30), (2, 40), (2, 50)])
+
+    def test_trigger(self):
+        r = program("map_sel 1\ntrigger w{2}\nset_pwm 10\nend",
+                    "map_sel 2\nwait 0.01\nset_pwm 20\ntrigger s{1|3}\nend",
+                    "map_sel 3\ntrigger w{2|e}\nset_pwm 30\nend")
+        sim, ev = self.__run(r, 100000)
+
+        wait = round(10 / 0.488) * 16
+        # Engine 1 starts after engine 2 sends, engine 3 waits the external one
+        self.assertEqual(ev, [PwmEvent(16 + wait, 1, 20), PwmEvent(32 + wait, 0, 10)])
+
+        sim.external(200000)
+        ev = list(sim.run(300000))
+        self.assertEqual(ev, [PwmEvent(200000, 2, 30)])
+
+    def test_end(self):
+        r = program("map_sel 1\nset_pwm 10\nend i, r", "map_sel 2\nset_pwm 20\nrst")
+        sim, ev = self.__run(r, 100)
+
+        self.assertEqual(ev, [PwmEvent(16, 0, 10), PwmEvent(16, 1, 20), PwmEvent(32, 0, 0)])
+        self.assertEqual(sim.interrupts, [(32, 0)])
+        self.assertIsNotNone(sim.next_time())
+
+    def test_src(self):
+        for name in ["test.src", "test1.src", "test2.src", "ramp.src", "labels.src", "jump.src", "alu.src"]:
+            x = lp5xxx_asm.asm_file(os.path.join(".", "src", name), logging)
+            sim = Simulator(x['bin'], [m['prg'] for m in x['memory']], var_d=3)
+            ev = list(sim.run(lp5xxx_sim.cycles(10000)))
+            self.assertEqual(ev, sorted(ev, key=lambda e: e.time))
+            for e in ev:
+                self.assertTrue(0 <= e.pwm <= 255)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+#!/bin/env python
+
+# Static timing analysis of an assembled image: the duration of each
+# segment is computed in closed form from the decoded words, loops are
+# counted by multiplying their period, without running the program.
+
+import math
+import collections
+
+from lp5xxx_asm import WORD, SRAM_SIZE, decode_table
+from lp5xxx_sim import INST_CYCLES, PRESCALE_CYCLES, CLOCK_HZ
+
+INFINITE = math.inf
+# Worst values of a ramp that takes step time and increments from variables
+VAR_STEP_MAX = 31
+VAR_LEVEL_MAX = 255
+
+LoopTiming = collections.namedtuple("LoopTiming", "addr target count period total")
+LoopTiming.__doc__ = """
+Branch at addr back to target, repeated count times (0 for ever). period
+is the worst duration of one pass of the body, branch included, and total
+the cycles the branch adds once it is reached: count extra passes and the
+last branch.
+"""
+
+Timing = collections.namedtuple("Timing", "name addr cycles loops flags")
+Timing.__doc__ = """
+Worst duration in clock cycles of a segment, from its start to the end
+instruction, INFINITE when it never ends. flags lists what makes the
+duration a bound rather than an exact figure.
+"""
+
+
+def ms(cycles):
+    return cycles * 1000 / CLOCK_HZ
+
+
+class __Analysis:
+    """
+    Worst time of the paths of one segment, memoized by start address and
+    stop address.
+    """
+
+    def __init__(self, memory, code, start):
+        self.memory = memory
+        self.code = code
+        self.start = start
+        self.loops = {}
+        self.flags = []
+        self.__memo = {}
+        self.__active = set()
+
+    def flag(self, msg):
+        if msg not in self.flags:
+            self.flags.append(msg)
+
+    def duration(self, name, opk, w):
+        if name == 'wait':
+            return ((w >> 9) & 0x1F) * PRESCALE_CYCLES[(w >> 14) & 1]
+        if name != 'ramp':
+            return INST_CYCLES
+
+        if opk == 'opv':
+            self.flag("ramp with variables, taken at their worst")
+            return VAR_LEVEL_MAX * VAR_STEP_MAX * PRESCALE_CYCLES[(w >> 5) & 1]
+
+        step = max((w >> 9) & 0x1F, 1) * PRESCALE_CYCLES[(w >> 14) & 1]
+        return max(w & 0xFF, 1) * step
+
+    def dist(self, x, stop):
+        """
+        Worst time from address x until the program counter reaches stop,
+        or until the end instruction when stop is None. None when no path
+        gets there.
+        """
+        if x == stop:
+            return 0
+        if stop is not None and x > stop:
+            return None
+
+        key = (x, stop)
+        if key in self.__memo:
+            return self.__memo[key]
+        if key in self.__active:
+            self.flag(f"irregular jumps at {x:02X}")
+            return INFINITE
+
+        self.__active.add(key)
+        t = self.__dist(x, stop)
+        self.__active.discard(key)
+        self.__memo[key] = t
+        return t
+
+    def __dist(self, x, stop):
+        if x >= len(self.code):
+            raise ValueError("Program runs out of SRAM")
+        if self.code[x] is None:
+            raise ValueError(f"Invalid instruction word {self.memory[x]:04X} at {x:02X}")
+
+        name, opk, _ = self.code[x]
+        w = self.memory[x]
+
+        if name == 'end':
+            return INST_CYCLES if stop is None else None
+
+        if name == 'rst':
+            self.flag(f"restart at {x:02X}")
+            return INFINITE
+
+        if name == 'trigger' and w & 0x1380:
+            self.flag(f"wait for trigger at {x:02X}, counted as one instruction")
+
+        if name in ['jne', 'jl', 'jge', 'je']:
+            paths = [self.dist(x + 1, stop), self.dist(x + 1 + ((w >> 4) & 0x1F), stop)]
+            paths = [p for p in paths if p is not None]
+            return INST_CYCLES + max(paths) if paths else None
+
+        if name == 'branch':
+            return self.__branch(x, stop, opk, w)
+
+        t = self.dist(x + 1, stop)
+        return None if t is None else self.duration(name, opk, w) + t
+
+    def __branch(self, x, stop, opk, w):
+        if opk == 'opv':
+            self.flag(f"loop count from a variable at {x:02X}")
+            count = 0
+            target = self.start + ((w >> 2) & 0x7F)
+        else:
+            count = (w >> 7) & 0x3F
+            target = self.start + (w & 0x7F)
+
+        if target > x:
+            # Forward branch: a plain jump
+            t = self.dist(target, stop)
+            return None if t is None else INST_CYCLES + t
+
+        body = self.dist(target, x)
+        if body is None:
+            self.flag(f"loop at {x:02X} never gets back to its branch")
+            body = 0
+        period = INST_CYCLES + body
+
+        if not count:
+            self.flag(f"infinite loop at {x:02X}")
+            self.loops[x] = LoopTiming(x, target, count, period, INFINITE)
+            return INFINITE
+
+        total = count * period + INST_CYCLES
+        self.loops[x] = LoopTiming(x, target, count, period, total)
+
+        t = self.dist(x + 1, stop)
+        return None if t is None else total + t
+
+
+def analyze(image, addr, names=None):
+    """
+    Timing of each segment of the image, given the segment start addresses,
+    in the order of addr.
+    """
+    image = bytes(image)[:SRAM_SIZE]
+    memory = [w for w, in WORD.iter_unpack(image[:len(image) & ~1])]
+    memory += [0] * (SRAM_SIZE // 2 - len(memory))
+    table = decode_table()
+    code = [table[w] for w in memory]
+
+    if names is None:
+        names = [f"program{n + 1}" for n in range(len(addr))]
+
+    res = []
+    for name, start in zip(names, addr):
+        a = __Analysis(memory, code, start)
+        cycles = a.dist(start, None)
+        if cycles is None:
+            cycles = INFINITE
+        loops = [a.loops[k] for k in sorted(a.loops)]
+        res.append(Timing(name, start, cycles, loops, a.flags))
+
+    return res
+
+
+def analyze_result(r):
+    """
+    Timing of the segments of an AsmResult.
+    """
+    return analyze(r.image, r.addr, [name for _, name in r.segments])
+
+
+def report(timings):
+    """
+    Lines of a readable report of the timings.
+    """
+    lines = []
+    for t in timings:
+        d = "infinite" if t.cycles == INFINITE else f"{ms(t.cycles):.3f}ms"
+        lines.append(f"{t.name} @{t.addr:02X}: {d}")
+        for lp in t.loops:
+            total = "for ever" if lp.total == INFINITE else f"{ms(lp.total):.3f}ms"
+            lines.append(f"  loop {lp.target:02X}-{lp.addr:02X} x{lp.count}: period {ms(lp.period):.3f}ms, {total}")
+        for f in t.flags:
+            lines.append(f"  ! {f}")
+    return lines
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    from lp5xxx_asm import assemble
+
+    parser = argparse.ArgumentParser(
+        prog='lp5xxx_timing',
+        description='Duration of the segments and loops of led engine sources, without simulation')
+
+    parser.add_argument('files_src', nargs='+', help='Engine Led assembly source file')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    for fn in args.files_src:
+        with open(fn) as f:
+            r = assemble(f.read(), fn)
+        print(fn)
+        print("\n".join(report(analyze_result(r))))
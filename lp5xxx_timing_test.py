@@ -0,0 +1,102 @@
+import unittest
+import lp5xxx_asm
+import lp5xxx_sim
+import lp5xxx_timing
+import logging
+
+from lp5xxx_sim import Simulator
+from lp5xxx_timing import INFINITE
+
+
+NESTED = """
+.segment program1
+    map_sel 1
+outer:
+    ramp 0.2, 50
+    inner:
+        wait 0.01
+        set_pwm 3
+        branch 4, inner
+    ramp 0.3, -50
+    branch 2, outer
+    wait 0.4
+    end i
+.segment program2
+    ld ra, {a}
+    ld rb, 5
+    jl ra, rb, short
+    wait 0.3
+    ramp 0.4, 40
+short:
+    wait 0.1
+    end i
+"""
+
+
+def end_time(r, until):
+    sim = Simulator(r.image, r.addr)
+    list(sim.run(until))
+    return {n: t + lp5xxx_sim.INST_CYCLES for t, n in sim.interrupts}
+
+
+class TestTiming(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+
+    def test_nested(self):
+        r = lp5xxx_asm.assemble(NESTED.format(a=9))
+        t = lp5xxx_timing.analyze_result(r)
+        ends = end_time(r, lp5xxx_sim.cycles(60 * 1000))
+
+        self.assertEqual([x.name for x in t], ["program1", "program2"])
+        self.assertEqual(t[0].cycles, ends[0])
+        self.assertEqual(t[0].flags, [])
+
+        inner, outer = t[0].loops
+        self.assertEqual((inner.count, outer.count), (4, 2))
+        self.assertEqual(inner.period, 2 * lp5xxx_sim.INST_CYCLES + 20 * 16)
+        self.assertEqual(outer.total, 2 * outer.period + lp5xxx_sim.INST_CYCLES)
+
+        # The worst case takes the long path of the jump
+        self.assertEqual(t[1].cycles, ends[1])
+        r = lp5xxx_asm.assemble(NESTED.format(a=0))
+        self.assertLess(end_time(r, lp5xxx_sim.cycles(60 * 1000))[1], t[1].cycles)
+
+    def test_jump_target(self):
+        # The longest path is the one the jump lands on
+        r = lp5xxx_asm.assemble(".segment program1\nld ra, 1\njne ra, rb, long\nend i\n"
+                                "long: wait 0.4\nset_pwm 10\nend i")
+        t = lp5xxx_timing.analyze_result(r)
+        self.assertEqual(t[0].cycles, end_time(r, lp5xxx_sim.cycles(60 * 1000))[0])
+        self.assertGreater(lp5xxx_sim.ms(t[0].cycles), 400)
+
+    def test_infinite(self):
+        r = lp5xxx_asm.assemble(".segment program1\nloop: set_pwm 1\nwait 0.1\nbranch 0, loop\nend\n"
+                                ".segment program2\nwait 0.1\nrst\n"
+                                ".segment program3\ntrigger w{1}\nend")
+        t = lp5xxx_timing.analyze(r.image, r.addr)
+
+        self.assertEqual(t[0].cycles, INFINITE)
+        self.assertEqual(t[0].loops[0].total, INFINITE)
+        self.assertEqual(t[0].flags, ["infinite loop at 02"])
+        self.assertEqual(t[1].cycles, INFINITE)
+        self.assertEqual(t[1].flags, ["restart at 05"])
+        self.assertEqual(t[2].cycles, 2 * lp5xxx_sim.INST_CYCLES)
+        self.assertEqual(len(t[2].flags), 1)
+
+        lines = lp5xxx_timing.report(t)
+        self.assertIn("program1 @00: infinite", lines)
+        self.assertIn("  ! infinite loop at 02", lines)
+
+    def test_generated(self):
+        # Programs with random shapes: the analysis matches the simulation
+        for n in range(40):
+            body = [f"l{n}_{k}: ramp {0.05 + k / 20:g}, {(n + k) % 9 + 1}\nwait 0.0{k + 1}\n"
+                    f"branch {(n * k) % 5 + 1}, l{n}_{k}" for k in range(n % 4 + 1)]
+            r = lp5xxx_asm.assemble(".segment program1\nmap_sel 1\n" + "\n".join(body) + "\nend i")
+            t = lp5xxx_timing.analyze_result(r)
+            self.assertEqual(t[0].cycles, end_time(r, lp5xxx_sim.cycles(3600 * 1000))[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
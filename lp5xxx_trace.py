@@ -0,0 +1,247 @@
+#!/bin/env python
+
+# Binary trace of the LED PWM changes. The file is a header followed by
+# blocks of a fixed number of records, and each block holds its records as
+# three columns:
+#
+#   header:  magic "LP5T", version u16, reserved u16, clock Hz u32,
+#            records for each block u32
+#   block:   records u32, reserved u32, base time u64,
+#            time delta u32 x block, LED u8 x block, PWM u8 x block
+#
+# All the values are little endian. The time delta is in clock cycles from
+# the previous record, the base time is the time of the record before the
+# block, so each block can be read on its own. Every block but the last one
+# is full; the last one has columns of its own records only. A delta that doesn't fit in 32 bit is split in records of
+# the NO_LED led, that only move the time.
+#
+# The writer needs only the standard library, the reader maps the file and
+# returns NumPy views of the columns.
+
+import os
+import sys
+import mmap
+import array
+import struct
+
+from lp5xxx_sim import CLOCK_HZ
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b"LP5T"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")
+BLOCK_HEADER = struct.Struct("<IIQ")
+BLOCK_RECORDS = 65536
+NO_LED = 0xFF
+DELTA_MAX = 0xFFFFFFFF
+
+
+def block_size(records):
+    return BLOCK_HEADER.size + records * 6
+
+
+class TraceWriter:
+    """
+    Write the trace while the records come, keeping in memory only the
+    block being filled. Records must come in time order.
+    """
+
+    def __init__(self, fn, block=BLOCK_RECORDS, clock=CLOCK_HZ):
+        if block <= 0 or block % 8:
+            raise ValueError(f"Block records should be a positive multiple of 8, not {block}")
+
+        self.f = open(fn, 'wb')
+        self.block = block
+        self.time = 0
+        self.count = 0
+        self.__base = 0
+        self.__dt = array.array('I')
+        self.__led = bytearray()
+        self.__pwm = bytearray()
+        self.f.write(HEADER.pack(MAGIC, VERSION, 0, clock, block))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, time, led, pwm):
+        dt = time - self.time
+        if dt < 0:
+            raise ValueError(f"Trace records should come in time order: {time} after {self.time}")
+
+        while dt > DELTA_MAX:
+            self.__append(DELTA_MAX, NO_LED, 0)
+            dt -= DELTA_MAX
+        self.__append(dt, led, pwm)
+        self.time = time
+
+    def write_events(self, events):
+        """
+        Write the events of a simulator, anything with time, led and pwm
+        fields, and return how many have been written.
+        """
+        n = 0
+        for ev in events:
+            self.write(ev.time, ev.led, ev.pwm)
+            n += 1
+        return n
+
+    def close(self):
+        if self.f.closed:
+            return
+        if self.__dt:
+            self.__flush()
+        self.f.close()
+
+    def __append(self, dt, led, pwm):
+        self.__dt.append(dt)
+        self.__led.append(led)
+        self.__pwm.append(pwm)
+        self.count += 1
+        if len(self.__dt) == self.block:
+            self.__flush()
+
+    def __flush(self):
+        n = len(self.__dt)
+        dt = self.__dt
+        if sys.byteorder != "little":
+            dt = array.array('I', dt)
+            dt.byteswap()
+
+        self.f.write(BLOCK_HEADER.pack(n, 0, self.__base))
+        self.f.write(dt.tobytes())
+        self.f.write(self.__led)
+        self.f.write(self.__pwm)
+
+        self.__base += sum(self.__dt)
+        self.__dt = array.array('I')
+        self.__led = bytearray()
+        self.__pwm = bytearray()
+
+
+def write_trace(fn, events, block=BLOCK_RECORDS):
+    """
+    Write the events in a trace file and return how many have been written.
+    """
+    with TraceWriter(fn, block) as w:
+        return w.write_events(events)
+
+
+class TraceReader:
+    """
+    Map a trace file in memory. The columns of each block are returned as
+    NumPy views of the mapping, without copies; dt, led and pwm join the
+    blocks, so they copy the data when the trace has more than one block.
+    """
+
+    def __init__(self, fn):
+        if np is None:
+            raise ImportError("Reading a trace needs numpy")
+
+        with open(fn, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError(f"{fn}: not a trace file")
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, self.clock, self.block = HEADER.unpack_from(self.mm)
+        if magic != MAGIC or version != VERSION:
+            self.mm.close()
+            raise ValueError(f"{fn}: not a trace file, or version not supported")
+
+        # Walk the block headers: only the last block can be short
+        self.__blocks = []
+        offset = HEADER.size
+        while offset < size:
+            if self.block <= 0 or offset + BLOCK_HEADER.size > size:
+                break
+            count = BLOCK_HEADER.unpack_from(self.mm, offset)[0]
+            end = offset + block_size(count)
+            if count > self.block or end > size or (count < self.block and end != size):
+                break
+            self.__blocks.append(self.__view(offset, count))
+            offset = end
+
+        if offset != size:
+            self.__blocks = []
+            self.mm.close()
+            raise ValueError(f"{fn}: truncated trace file")
+        self.blocks_no = len(self.__blocks)
+        self.__len = sum(len(b[1]) for b in self.__blocks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.__len
+
+    def close(self):
+        """
+        Release the mapping. The views returned before keep it alive, and
+        valid: it is unmapped with the last of them.
+        """
+        self.__blocks = []
+        try:
+            self.mm.close()
+        except BufferError:
+            # Views still exported: the mapping goes when they are freed
+            pass
+
+    def __view(self, offset, count):
+        _, _, base = BLOCK_HEADER.unpack_from(self.mm, offset)
+        offset += BLOCK_HEADER.size
+        dt = np.frombuffer(self.mm, dtype="<u4", count=count, offset=offset)
+        offset += count * 4
+        led = np.frombuffer(self.mm, dtype=np.uint8, count=count, offset=offset)
+        offset += count
+        pwm = np.frombuffer(self.mm, dtype=np.uint8, count=count, offset=offset)
+        return base, dt, led, pwm
+
+    def blocks(self):
+        """
+        Yield, for each block, the base time and the dt, led and pwm views.
+        """
+        yield from self.__blocks
+
+    def __column(self, n):
+        if len(self.__blocks) == 1:
+            return self.__blocks[0][n]
+        if not self.__blocks:
+            return np.zeros(0, dtype=np.uint32 if n == 1 else np.uint8)
+        return np.concatenate([b[n] for b in self.__blocks])
+
+    @property
+    def dt(self):
+        return self.__column(1)
+
+    @property
+    def led(self):
+        return self.__column(2)
+
+    @property
+    def pwm(self):
+        return self.__column(3)
+
+    def time(self):
+        """
+        Absolute time of each record, in clock cycles.
+        """
+        return np.cumsum(self.dt, dtype=np.uint64)
+
+    def events(self):
+        """
+        Absolute time, led and pwm of the records that change a LED.
+        """
+        t = self.time()
+        led = self.led
+        keep = led != NO_LED
+        return t[keep], led[keep], self.pwm[keep]
@@ -0,0 +1,105 @@
+import unittest
+import lp5xxx_asm
+import lp5xxx_sim
+import lp5xxx_trace
+import tempfile
+import logging
+import shutil
+import os
+
+from lp5xxx_sim import PwmEvent, Simulator
+from lp5xxx_trace import TraceReader, TraceWriter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+        self.path = tempfile.mkdtemp()
+        self.fn = os.path.join(self.path, "trace.lpt")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_sim(self):
+        x = lp5xxx_asm.asm_file(os.path.join(".", "src", "test1.src"), logging)
+        addr = [m['prg'] for m in x['memory']]
+        until = lp5xxx_sim.cycles(60 * 1000)
+
+        ref = list(Simulator(x['bin'], addr).run(until))
+        n = lp5xxx_trace.write_trace(self.fn, Simulator(x['bin'], addr).run(until), block=1024)
+        self.assertEqual(n, len(ref))
+        self.assertGreater(n, 1024)
+
+        # 6 bytes for each record, and a short last block
+        blocks = -(-n // 1024)
+        self.assertEqual(os.path.getsize(self.fn),
+                         lp5xxx_trace.HEADER.size + blocks * lp5xxx_trace.BLOCK_HEADER.size + 6 * n)
+
+        with TraceReader(self.fn) as r:
+            self.assertEqual(len(r), n)
+            self.assertEqual(r.clock, lp5xxx_sim.CLOCK_HZ)
+            t, led, pwm = r.events()
+            self.assertEqual(t.tolist(), [e.time for e in ref])
+            self.assertEqual(led.tolist(), [e.led for e in ref])
+            self.assertEqual(pwm.tolist(), [e.pwm for e in ref])
+
+            # Each block is a view of the file and starts from its base time
+            total = 0
+            for base, dt, led, pwm in r.blocks():
+                self.assertFalse(dt.flags.owndata)
+                self.assertFalse(dt.flags.writeable)
+                self.assertEqual(base, ref[total - 1].time if total else 0)
+                total += len(dt)
+            self.assertEqual(total, n)
+            first = next(r.blocks())
+
+        # The views outlive the reader
+        self.assertEqual(first[2][:3].tolist(), [e.led for e in ref[:3]])
+
+    def test_gap(self):
+        events = [PwmEvent(5, 1, 10), PwmEvent(5, 2, 10), PwmEvent(5 + 3 * (1 << 32), 1, 0)]
+        with TraceWriter(self.fn, block=8) as w:
+            w.write_events(events)
+            with self.assertRaises(ValueError):
+                w.write(4, 0, 0)
+
+        self.assertEqual(os.path.getsize(self.fn), lp5xxx_trace.HEADER.size + lp5xxx_trace.block_size(6))
+        with TraceReader(self.fn) as r:
+            self.assertEqual(len(r), 6)
+            self.assertEqual(r.led.tolist(), [1, 2, lp5xxx_trace.NO_LED, lp5xxx_trace.NO_LED,
+                                              lp5xxx_trace.NO_LED, 1])
+            t, led, pwm = r.events()
+            self.assertEqual(list(zip(t.tolist(), led.tolist(), pwm.tolist())), [tuple(e) for e in events])
+
+    def test_bad(self):
+        with open(self.fn, 'wb') as f:
+            f.write(b"LP5X" + bytes(20))
+        with self.assertRaises(ValueError):
+            TraceReader(self.fn)
+
+        with TraceWriter(self.fn, block=8) as w:
+            w.write(1, 1, 1)
+        with open(self.fn, 'ab') as f:
+            f.write(b"\0")
+        with self.assertRaises(ValueError):
+            TraceReader(self.fn)
+
+        # A short block that isn't the last one
+        with TraceWriter(self.fn, block=8) as w:
+            w.write(1, 1, 1)
+        with open(self.fn, 'rb') as f:
+            data = f.read()
+        with open(self.fn, 'ab') as f:
+            f.write(data[lp5xxx_trace.HEADER.size:])
+        with self.assertRaises(ValueError):
+            TraceReader(self.fn)
+
+
+if __name__ == '__main__':
+    unittest.main()
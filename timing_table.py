@@ -0,0 +1,109 @@
+#!/bin/env python
+
+import bisect
+
+# Length of one prescale unit in ms: 16 or 512 cycles of the 32768 Hz clock
+PRESCALE_MS = (16 * 1000 / 32768, 512 * 1000 / 32768)
+STEP_MAX = 31
+
+# Every step time the engine can do, as (ms, prescale, step time), sorted
+# by duration. A ramp lasts step time x increments and a wait step time, so
+# this table holds all the achievable durations up to the increments factor.
+STEPS = sorted((step * PRESCALE_MS[p], p, step) for p in range(2) for step in range(1, STEP_MAX + 1))
+STEP_MS = [s[0] for s in STEPS]
+
+
+def nearest_step(ms):
+    """
+    Encoding of the step time closest to the given one in ms, on a tie the
+    one with the lower prescale: (ms, prescale, step time).
+    """
+    i = bisect.bisect_left(STEP_MS, ms)
+    return min(STEPS[max(i - 1, 0):i + 1], key=lambda s: (abs(s[0] - ms), s[1]))
+
+
+def wait_encoding(ms):
+    """
+    Prescale and time of the wait closest to the given time in ms, with the
+    timing error in ms.
+    """
+    step_ms, prescale, step = nearest_step(ms)
+    return prescale, step, step_ms - ms
+
+
+def ramp_encoding(ms, increments):
+    """
+    Prescale and step time of the ramp of the given increments closest to
+    the given time in ms, with the timing error of the whole ramp in ms.
+    """
+    step_ms, prescale, step = nearest_step(ms / increments)
+    return prescale, step, step_ms * increments - ms
+
+
+def requested(inst):
+    """
+    Time in ms asked by a wait or ramp instruction of the parsed source, and
+    the increments for a ramp, or None when it takes variables.
+    """
+    try:
+        if inst['op'] == 'wait':
+            return float(inst['args'][0]) * 1000, None
+        if inst['op'] == 'ramp':
+            return int(float(inst['args'][0]) * 1000), abs(int(inst['args'][1]))
+    except (ValueError, IndexError):
+        pass
+    return None
+
+
+def deviations(memory):
+    """
+    For each numeric wait and ramp of the parsed source, yield the
+    instruction, the requested and the encoded time in ms and the error.
+    """
+    for inst in memory:
+        req = requested(inst)
+        if req is None:
+            continue
+
+        ms, increments = req
+        if increments is None:
+            err = wait_encoding(ms)[2]
+        elif increments:
+            err = ramp_encoding(ms, increments)[2]
+        else:
+            continue
+        yield inst, ms, ms + err, err
+
+
+def report(memory):
+    """
+    Lines of a readable report of the timing errors of the source.
+    """
+    lines = []
+    for inst, ms, actual, err in deviations(memory):
+        rel = f" ({err / ms * 100:+.1f}%)" if ms else ""
+        lines.append(f"{inst['line_no']:4d} {inst['op']:<5} {', '.join(inst['args'])}: "
+                     f"{ms:.3f}ms -> {actual:.3f}ms, error {err:+.3f}ms{rel}")
+    return lines
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    from lp5xxx_asm import parse
+
+    parser = argparse.ArgumentParser(
+        prog='timing_table',
+        description='How far the encoded ramps and waits are from the requested times')
+
+    parser.add_argument('files_src', nargs='+', help='Engine Led assembly source file')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    for fn in args.files_src:
+        with open(fn) as f:
+            memory, _ = parse(f.read().splitlines(), logging)
+        print(fn)
+        print("\n".join(report(memory)))
@@ -0,0 +1,51 @@
+import unittest
+import logging
+import lp5xxx_asm
+import timing_table
+
+from timing_table import PRESCALE_MS, nearest_step, wait_encoding, ramp_encoding
+
+
+class TestTimingTable(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(level=logging.ERROR)
+
+    def test_nearest(self):
+        # The bisect lookup gives the same error of a search on all encodings
+        for n in range(2000):
+            ms = n * 0.25
+            best = min(abs(s * PRESCALE_MS[p] - ms) for p in range(2) for s in range(1, 32))
+            step_ms, prescale, step = nearest_step(ms)
+            self.assertEqual(step_ms, step * PRESCALE_MS[prescale])
+            self.assertAlmostEqual(abs(step_ms - ms), best)
+
+        # 31 low prescale units are closer than one high prescale unit
+        self.assertEqual(nearest_step(15.372)[1:], (0, 31))
+        self.assertEqual(nearest_step(15.6)[1:], (1, 1))
+        self.assertEqual(nearest_step(0)[1:], (0, 1))
+
+    def test_encoding(self):
+        self.assertEqual(wait_encoding(400), (1, 26, 6.25))
+        prescale, step, err = ramp_encoding(1000, 100)
+        self.assertEqual((prescale, step), (0, 20))
+        self.assertAlmostEqual(err, 20 * PRESCALE_MS[0] * 100 - 1000)
+
+    def test_report(self):
+        memory, _ = lp5xxx_asm.parse(".segment program1\nwait 0.4\nramp 1, -100\nramp ra, pre=0, +rb\n"
+                                     "wait 0.25\nend".splitlines(), logging)
+        dev = list(timing_table.deviations(memory))
+        self.assertEqual([d[0]['line_no'] for d in dev], [2, 3, 5])
+        self.assertEqual(dev[0][1:], (400, 406.25, 6.25))
+        self.assertEqual(dev[2][3], 0)
+        self.assertEqual(len(timing_table.report(memory)), 3)
+
+    def test_ramp_range(self):
+        with self.assertRaises(ValueError):
+            lp5xxx_asm.assemble(".segment program1\nramp 1, 0\nend")
+        with self.assertRaises(ValueError):
+            lp5xxx_asm.assemble(".segment program1\nramp 60, 100\nend")
+        lp5xxx_asm.assemble(".segment program1\nramp 48, 100\nend")
+
+
+if __name__ == '__main__':
+    unittest.main()